@@ -12,6 +12,8 @@ ai_bp = Blueprint('ai_kitchen', __name__)
 # --- КОНФИГУРАЦИЯ ---
 # Модель Nano Banana (Gemini 2.5 Flash Image) для редактирования фото
 MODEL_NAME = "gemini-2.5-flash-image-preview"
+# Можно направить на локальную заглушку (stub_server.py) для нагрузочных тестов
+GOOGLE_API_BASE_URL = os.getenv("GOOGLE_API_BASE_URL")
 
 # Строгий промпт: Реализм + Фон + Угол
 FOOD_STYLE_PROMPT = (
@@ -47,7 +49,8 @@ def generate_food_image_google():
         return jsonify({"error": "Файл не выбран"}), 400
 
     try:
-        client = genai.Client(api_key=os.environ.get("GOOGLE_API_KEY"))
+        http_options = types.HttpOptions(base_url=GOOGLE_API_BASE_URL) if GOOGLE_API_BASE_URL else None
+        client = genai.Client(api_key=os.environ.get("GOOGLE_API_KEY"), http_options=http_options)
 
         # 1. КОНВЕРТАЦИЯ (Исправление ошибки MIME type и формата)
         image_bytes = file.read()
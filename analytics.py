@@ -0,0 +1,299 @@
+"""
+Аналитика продаж на предагрегатах.
+
+Отчеты не сканируют orders/order_items: при доставке заказа (статус "Успешно доставлен" —
+из админки, официантом или оплатой наличными через pay_order_cash) его позиции один раз
+добавляются в почасовые таблицы sales_rollups (заказы, выручка) и sales_item_rollups
+(блюдо: количество, выручка, число заказов). Запись идет в той же транзакции, что и смена
+статуса (before_flush), флаг Order.rolled_up не дает учесть заказ дважды. Учтенные позиции
+с ценами запоминаются в Order.rollup_lines: если доставленный заказ вернули в другой статус,
+вычитается ровно этот снимок, даже если с тех пор поменялись цены меню или состав заказа.
+
+Час — по времени создания заказа, в UTC. День и средний чек считаются из часовых строк.
+
+Заказы, доставленные до появления таблиц:
+    python analytics.py backfill [--restaurant-id N] [--rebuild]
+"""
+import argparse
+import datetime
+
+from flask import Blueprint, request, jsonify
+from flask_login import login_required, current_user
+from sqlalchemy import event, func, update, delete, select
+from sqlalchemy.dialects import sqlite, postgresql
+from sqlalchemy.orm import selectinload, object_session
+
+from models import SessionLocal, Order, OrderItem, OrderStatus, MenuItem, SalesRollup, SalesItemRollup
+from db_routing import read_session
+
+analytics_bp = Blueprint('analytics', __name__)
+
+DEFAULT_RANGE_DAYS = 30
+MAX_RANGE_DAYS = 366
+BACKFILL_BATCH = 500
+
+
+# --- Запись ---
+
+def _hour(dt):
+    if dt is None: dt = datetime.datetime.now(datetime.timezone.utc)
+    if dt.tzinfo is not None: dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _upsert(conn, model, keys, increments, values=None):
+    """INSERT ... ON CONFLICT DO UPDATE: счетчики прибавляются к существующей строке."""
+    table = model.__table__
+    values = values or {}
+    dialect = conn.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        stmt = insert(table).values(**keys, **increments, **values)
+        set_ = {k: table.c[k] + stmt.excluded[k] for k in increments}
+        set_.update({k: stmt.excluded[k] for k in values})
+        conn.execute(stmt.on_conflict_do_update(index_elements=list(keys), set_=set_))
+        return
+
+    where = [table.c[k] == v for k, v in keys.items()]
+    set_ = {k: table.c[k] + v for k, v in increments.items()}
+    set_.update(values)
+    if conn.execute(update(table).where(*where).values(**set_)).rowcount == 0:
+        conn.execute(table.insert().values(**keys, **increments, **values))
+
+
+def _apply(conn, restaurant_id, created_at, lines, sign):
+    """lines: (menu_item_id, name, price, quantity) позиций заказа."""
+    items = {}
+    for menu_item_id, name, price, quantity in lines:
+        qty, revenue, _ = items.get(menu_item_id, (0, 0.0, name))
+        items[menu_item_id] = (qty + quantity, revenue + (price or 0.0) * quantity, name)
+    if not items: return
+
+    keys = {"restaurant_id": restaurant_id, "hour": _hour(created_at)}
+    _upsert(conn, SalesRollup, keys, {
+        "order_count": sign,
+        "revenue": sign * sum(revenue for _, revenue, _ in items.values()),
+    })
+    for menu_item_id, (qty, revenue, name) in items.items():
+        # Название обновляем последним известным (блюдо могли переименовать)
+        _upsert(conn, SalesItemRollup, dict(keys, menu_item_id=menu_item_id), {
+            "quantity": sign * qty,
+            "revenue": sign * revenue,
+            "order_count": sign,
+        }, {"item_name": name} if sign > 0 and name else None)
+
+
+def _order_lines(order):
+    db = object_session(order)
+    lines = []
+    for oi in order.items:
+        menu_item = oi.menu_item
+        if menu_item is None and oi.menu_item_id and db is not None:
+            menu_item = db.get(MenuItem, oi.menu_item_id)  # Новая позиция: связь еще не загружена
+        lines.append([oi.menu_item_id, menu_item.name if menu_item else None,
+                      menu_item.price if menu_item else 0.0, oi.quantity])
+    return lines
+
+
+def apply_order(conn, order, sign=1):
+    """
+    Добавляет (sign=1) вклад заказа в предагрегаты и запоминает его в order.rollup_lines
+    или вычитает (sign=-1) запомненный вклад. Заказы, учтенные до появления снимка, вычитаются
+    по текущему составу.
+    """
+    if sign > 0:
+        lines = _order_lines(order)
+        order.rollup_lines = lines
+    else:
+        lines = order.rollup_lines if order.rollup_lines is not None else _order_lines(order)
+        order.rollup_lines = None
+    _apply(conn, order.restaurant_id, order.created_at, lines, sign)
+
+
+def apply_archived(conn, record):
+    """То же для заказа из архива (archive.iter_archived_orders): цены — на момент архивации."""
+    _apply(conn, record["restaurant_id"], datetime.datetime.fromisoformat(record["created_at"]), (
+        (i["menu_item_id"], i["name"], i["price"], i["quantity"]) for i in record["items"]
+    ), 1)
+
+
+@event.listens_for(SessionLocal, "before_flush")
+def _rollup_delivered(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Order): continue
+        delivered = obj.status == OrderStatus.SUCCESSFULLY_DELIVERED
+        if delivered and not obj.rolled_up:
+            apply_order(session.connection(), obj, 1)
+            obj.rolled_up = True
+        elif obj.rolled_up and not delivered:
+            apply_order(session.connection(), obj, -1)
+            obj.rolled_up = False
+
+
+def backfill(restaurant_id=None, rebuild=False, batch=BACKFILL_BATCH):
+    """Учитывает доставленные заказы без флага rolled_up. rebuild — пересчитать все с нуля."""
+    with SessionLocal() as db:
+        if rebuild:
+            scope = [] if restaurant_id is None else [SalesRollup.restaurant_id == restaurant_id]
+            db.execute(delete(SalesRollup).where(*scope))
+            scope = [] if restaurant_id is None else [SalesItemRollup.restaurant_id == restaurant_id]
+            db.execute(delete(SalesItemRollup).where(*scope))
+            scope = [] if restaurant_id is None else [Order.restaurant_id == restaurant_id]
+            db.execute(update(Order).where(*scope).values(rolled_up=False, rollup_lines=None))
+            # Заказы, уже перенесенные в архив, есть только в файлах — учитываем их оттуда.
+            # Сбой между записью в архив и удалением оставляет заказ и там, и в БД: такой
+            # учтет проход по БД ниже, из архива пропускаем
+            import archive
+            conn = db.connection()
+            delivered = []
+
+            def apply_delivered():
+                hot = {r[0] for r in db.query(Order.id).filter(Order.id.in_([rec["id"] for rec in delivered]))}
+                for rec in delivered:
+                    if rec["id"] not in hot: apply_archived(conn, rec)
+                delivered.clear()
+
+            for record in archive.iter_archived_orders(restaurant_id):
+                if record["status"] == OrderStatus.SUCCESSFULLY_DELIVERED.name:
+                    delivered.append(record)
+                    if len(delivered) >= batch: apply_delivered()
+            if delivered: apply_delivered()
+            db.commit()
+
+        total, last_id = 0, 0
+        while True:
+            query = db.query(Order).options(selectinload(Order.items).joinedload(OrderItem.menu_item)).filter(
+                Order.id > last_id,
+                Order.status == OrderStatus.SUCCESSFULLY_DELIVERED,
+                Order.rolled_up == False
+            )
+            if restaurant_id is not None: query = query.filter(Order.restaurant_id == restaurant_id)
+            orders = query.order_by(Order.id).limit(batch).all()
+            if not orders: break
+            conn = db.connection()
+            for order in orders:
+                apply_order(conn, order, 1)
+                order.rolled_up = True
+            db.commit()
+            total += len(orders)
+            last_id = orders[-1].id
+        return total
+
+
+# --- Чтение (только из предагрегатов) ---
+
+def _date_range():
+    """?from=YYYY-MM-DD&to=YYYY-MM-DD (включительно) -> (начало, конец) naive UTC. По умолчанию 30 дней."""
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    try:
+        date_to = datetime.date.fromisoformat(request.args["to"]) if request.args.get("to") else today
+        date_from = datetime.date.fromisoformat(request.args["from"]) if request.args.get("from") \
+            else date_to - datetime.timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    except ValueError:
+        return None
+    if date_from > date_to or (date_to - date_from).days >= MAX_RANGE_DAYS: return None
+    start = datetime.datetime.combine(date_from, datetime.time.min)
+    return start, datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time.min)
+
+
+def _restaurant_id():
+    if current_user.role == 'admin': return current_user.restaurant_id
+    if current_user.role == 'super_admin': return request.args.get("restaurant_id", type=int)
+    return None
+
+
+def _avg(revenue, orders):
+    return round(revenue / orders, 2) if orders else 0.0
+
+
+def _analytics_request():
+    """(restaurant_id, start, end) или готовый ответ с ошибкой."""
+    rid = _restaurant_id()
+    if not rid: return None, (jsonify({"error": "Доступ запрещен"}), 403)
+    period = _date_range()
+    if not period: return None, (jsonify({"error": "Неверный период (from/to: YYYY-MM-DD, не больше года)"}), 400)
+    return (rid,) + period, None
+
+
+@analytics_bp.route("/api/analytics/summary")
+@login_required
+def analytics_summary():
+    params, error = _analytics_request()
+    if error: return error
+    rid, start, end = params
+
+    with read_session() as db:
+        orders, revenue = db.execute(select(
+            func.coalesce(func.sum(SalesRollup.order_count), 0), func.coalesce(func.sum(SalesRollup.revenue), 0.0)
+        ).where(SalesRollup.restaurant_id == rid, SalesRollup.hour >= start, SalesRollup.hour < end)).one()
+    return jsonify({
+        "from": start.date().isoformat(), "to": (end - datetime.timedelta(days=1)).date().isoformat(),
+        "orders": orders, "revenue": round(revenue, 2), "average_ticket": _avg(revenue, orders),
+    })
+
+
+@analytics_bp.route("/api/analytics/sales")
+@login_required
+def analytics_sales():
+    """Ряд по часам или дням: ?granularity=day|hour."""
+    params, error = _analytics_request()
+    if error: return error
+    rid, start, end = params
+    granularity = request.args.get("granularity", "day")
+    if granularity not in ("day", "hour"): return jsonify({"error": "granularity: day | hour"}), 400
+
+    with read_session() as db:
+        rows = db.execute(select(SalesRollup.hour, SalesRollup.order_count, SalesRollup.revenue).where(
+            SalesRollup.restaurant_id == rid, SalesRollup.hour >= start, SalesRollup.hour < end
+        ).order_by(SalesRollup.hour)).all()
+
+    series = {}
+    for hour, orders, revenue in rows:
+        period = hour.isoformat() if granularity == "hour" else hour.date().isoformat()
+        acc = series.setdefault(period, [0, 0.0])
+        acc[0] += orders
+        acc[1] += revenue
+    return jsonify([{
+        "period": period, "orders": orders, "revenue": round(revenue, 2), "average_ticket": _avg(revenue, orders)
+    } for period, (orders, revenue) in series.items()])
+
+
+@analytics_bp.route("/api/analytics/top-items")
+@login_required
+def analytics_top_items():
+    """Топ блюд за период: ?by=revenue|quantity&limit=10."""
+    params, error = _analytics_request()
+    if error: return error
+    rid, start, end = params
+    by = request.args.get("by", "revenue")
+    if by not in ("revenue", "quantity"): return jsonify({"error": "by: revenue | quantity"}), 400
+    limit = min(max(request.args.get("limit", 10, type=int), 1), 100)
+
+    quantity = func.sum(SalesItemRollup.quantity).label("quantity")
+    revenue = func.sum(SalesItemRollup.revenue).label("revenue")
+    with read_session() as db:
+        rows = db.execute(select(
+            SalesItemRollup.menu_item_id, func.max(SalesItemRollup.item_name), quantity, revenue,
+            func.sum(SalesItemRollup.order_count)
+        ).where(
+            SalesItemRollup.restaurant_id == rid, SalesItemRollup.hour >= start, SalesItemRollup.hour < end
+        ).group_by(SalesItemRollup.menu_item_id).order_by((revenue if by == "revenue" else quantity).desc())
+                          .limit(limit)).all()
+    return jsonify([{
+        "menu_item_id": menu_item_id, "name": name or "Удаленное блюдо",
+        "quantity": qty, "revenue": round(rev, 2), "orders": orders
+    } for menu_item_id, name, qty, rev, orders in rows])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Предагрегаты продаж")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bf = sub.add_parser("backfill", help="Учесть доставленные заказы, которых еще нет в предагрегатах")
+    bf.add_argument("--restaurant-id", type=int)
+    bf.add_argument("--rebuild", action="store_true", help="Очистить предагрегаты и пересчитать все заказы")
+    bf.add_argument("--batch", type=int, default=BACKFILL_BATCH)
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        count = backfill(args.restaurant_id, args.rebuild, args.batch)
+        print(f"Учтено заказов: {count}")
@@ -3,6 +3,7 @@ import os
 import logging
 import logging.config
 import datetime
+import math
 import secrets
 import threading  # <--- ДОБАВЛЕНО
 from urllib.parse import unquote
@@ -11,7 +12,7 @@ from tasks import process_ai_message_task, check_reminders_task
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from dotenv import load_dotenv
 from werkzeug.security import generate_password_hash
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy import text
 from flask_socketio import SocketIO, emit, join_room, leave_room
 
@@ -24,7 +25,12 @@ from models import SessionLocal, Order, MenuItem, OrderItem, OrderStatus, ChatMe
     SliderItem, Restaurant, User, ServiceSignal, Table, AuditLog
 from utils_pdf import generate_qr_pdf
 from ai_kitchen import ai_bp
-from functools import wraps
+from telegram_webhook import telegram_bp
+from kitchen_display import kds_bp
+from analytics import analytics_bp
+from audit_api import audit_bp
+from export import export_bp
+from snapshots import snapshots_bp
 
 # ИМПОРТ СЕРВИСОВ (Refactoring)
 from services import (
@@ -34,42 +40,26 @@ from services import (
     find_item_by_name,
     execute_actions,
     resolve_table_by_token,
-    get_or_create_cart
+    get_or_create_cart,
+    find_active_order,
+    bump_menu_version,
+    bind_telegram_chat,
+    accept_chat_message,
+    is_drink_item
 )
-
-# --- RATE LIMITER (In-Memory) ---
-# Структура: {ip: {endpoint: [timestamp1, timestamp2, ...]}}
-request_history = {}
-
-
-def check_rate_limit(limit=5, window=60):
-    """Ограничивает вызовы endpoint: limit раз в window секунд для одного IP"""
-
-    def decorator(f):
-        @wraps(f)
-        def wrapped(*args, **kwargs):
-            ip = request.remote_addr
-            endpoint = request.endpoint
-            now = time.time()
-
-            if ip not in request_history:
-                request_history[ip] = {}
-            if endpoint not in request_history[ip]:
-                request_history[ip][endpoint] = []
-
-            # Очистка старых записей
-            request_history[ip][endpoint] = [t for t in request_history[ip][endpoint] if now - t < window]
-
-            if len(request_history[ip][endpoint]) >= limit:
-                return jsonify({"error": "Too many requests. Chill out."}), 429
-
-            request_history[ip][endpoint].append(now)
-            return f(*args, **kwargs)
-
-        return wrapped
-
-    return decorator
-
+import waiter_hints
+import telegram_outbox
+import auth_cache
+import floor_view
+import kitchen_display
+import audit_writer
+import archive
+import db_profile
+import db_routing
+import db_instrumentation
+from db_routing import read_session, session_for_request
+from rate_limit import check_rate_limit, login_guard
+from idempotency import idempotent
 
 # --- Инициализация ---
 load_dotenv()
@@ -77,6 +67,8 @@ load_dotenv()
 # LOGGING CONFIG (Structured)
 LOG_CONFIG = {
     'version': 1,
+    # Логгеры модулей (rate_limit, floor_view, db_instrumentation...) создаются при импорте выше
+    'disable_existing_loggers': False,
     'formatters': {
         'default': {'format': '[%(asctime)s] %(levelname)s in %(module)s: %(message)s',}
     },
@@ -91,12 +83,21 @@ logging.config.dictConfig(LOG_CONFIG)
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 app.register_blueprint(ai_bp)
+app.register_blueprint(telegram_bp)
+app.register_blueprint(kds_bp)
+app.register_blueprint(analytics_bp)
+app.register_blueprint(audit_bp)
+app.register_blueprint(export_bp)
+app.register_blueprint(snapshots_bp)
 
 # Делаем путь абсолютным относительно файла app.py
 app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static', 'uploads')
 
 # Инициализация сокетов (async_mode='eventlet' обязателен для продакшена)
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+kitchen_display.init_socketio(socketio)
+db_routing.init_app(app)
+db_instrumentation.init_app(app)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev_secret_key_change_in_prod_12345")
 
 # --- SECURITY CONFIG ---
@@ -126,9 +127,8 @@ login_manager.login_view = 'login'
 
 @login_manager.user_loader
 def load_user(user_id):
-    with SessionLocal() as db:
-        # FIX: Eagerly load 'restaurant' to prevent DetachedInstanceError
-        return db.query(User).options(joinedload(User.restaurant)).get(int(user_id))
+    # Кэш неизменяемых Principal: без запроса к БД на каждый опрос админки/официанта
+    return auth_cache.load_principal(user_id)
 
 
 def get_status_enum_by_value(value_str):
@@ -150,34 +150,26 @@ def landing():
     return render_template('login.html')
 
 
-# In-memory хранилище попыток входа {ip: {'count': int, 'time': float}}
-login_attempts = {}
-
-
 @app.route('/login', methods=['GET', 'POST'])
 def login():
-    # Anti-Bruteforce Check
+    # Anti-Bruteforce Check (счетчики неудач по IP и по паре логин+IP — rate_limit.login_guard)
     client_ip = request.remote_addr
-    now = time.time()
-
-    # Сброс счетчика, если прошло больше 5 минут
-    if client_ip in login_attempts:
-        if now - login_attempts[client_ip]['time'] > 300:
-            del login_attempts[client_ip]
 
     if request.method == 'POST':
-        # Блокировка после 5 неудачных попыток
-        if client_ip in login_attempts and login_attempts[client_ip]['count'] >= 5:
-            return render_template('login.html', error="Слишком много попыток. Подождите 5 минут.")
-
         username = request.form.get('username')
         password = request.form.get('password')
 
+        # Блокировка после нескольких неудачных попыток (ведро пополняется постепенно — ждать недолго)
+        wait = math.ceil(login_guard.retry_after(client_ip, username))
+        if wait:
+            wait_text = f"{wait} сек." if wait < 60 else f"{math.ceil(wait / 60)} мин."
+            return render_template('login.html', error=f"Слишком много попыток. Попробуйте через {wait_text}")
+
         with SessionLocal() as db:
             user = db.query(User).options(joinedload(User.restaurant)).filter_by(username=username).first()
             if user and user.check_password(password):
                 # Успех - очищаем счетчик
-                if client_ip in login_attempts: del login_attempts[client_ip]
+                login_guard.reset(client_ip, username)
 
                 login_user(user)
 
@@ -188,10 +180,7 @@ def login():
                 return "Роль не распознана", 400
 
             # Неудача - увеличиваем счетчик
-            attempt = login_attempts.get(client_ip, {'count': 0, 'time': now})
-            attempt['count'] += 1
-            attempt['time'] = now  # Обновляем время последней попытки
-            login_attempts[client_ip] = attempt
+            login_guard.register_failure(client_ip, username)
 
             return render_template('login.html', error="Неверные учетные данные")
     return render_template('login.html')
@@ -247,6 +236,7 @@ def super_admin_panel():
                     db.query(User).filter(User.restaurant_id == rest.id).delete()
                     db.delete(rest)
                     db.commit()
+                    auth_cache.invalidate_restaurant(rest_id)
                     msg = "Ресторан удален."
 
         # Получаем список всех ресторанов для дашборда
@@ -254,11 +244,35 @@ def super_admin_panel():
         return render_template('super_admin.html', msg=msg, restaurants=restaurants)
 
 
+@app.route('/api/super/metrics/telegram')
+@login_required
+def telegram_outbox_metrics():
+    """Очередь исходящих сообщений в Telegram: глубина, задержка доставки, повторы"""
+    if current_user.role != 'super_admin': return jsonify({"error": "Access Denied"}), 403
+    return jsonify(telegram_outbox.get_stats())
+
+
+@app.route('/api/super/metrics/audit')
+@login_required
+def audit_writer_metrics():
+    """Фоновая запись аудита: размер буфера, записано, вытеснено, ошибки"""
+    if current_user.role != 'super_admin': return jsonify({"error": "Access Denied"}), 403
+    return jsonify(audit_writer.get_stats())
+
+
+@app.route('/api/super/metrics/db')
+@login_required
+def db_metrics():
+    """Профиль движка БД: пул соединений, PRAGMA SQLite, чтения с реплики"""
+    if current_user.role != 'super_admin': return jsonify({"error": "Access Denied"}), 403
+    return jsonify(dict(db_profile.describe(models.engine), replica=db_routing.get_stats()))
+
+
 # --- CLIENT FACING ---
 
 @app.route("/r/<identifier>")
 def restaurant_index(identifier):
-    with SessionLocal() as db:
+    with read_session() as db:
         rest = None
         # Проверяем, это числовой ID или текстовый slug
         if identifier.isdigit():
@@ -272,8 +286,9 @@ def restaurant_index(identifier):
 
 @app.route("/api/r/<int:restaurant_id>/menu")
 def get_restaurant_menu(restaurant_id):
-    with SessionLocal() as db:
-        items = db.query(MenuItem).filter(MenuItem.restaurant_id == restaurant_id).all()
+    with read_session() as db:
+        items = db.query(MenuItem).options(selectinload(MenuItem.categories)) \
+            .filter(MenuItem.restaurant_id == restaurant_id).all()
         return jsonify([{
             "id": i.id, "name": i.name, "description": i.description,
             "price": i.price, "image_url": i.image_url,
@@ -284,13 +299,54 @@ def get_restaurant_menu(restaurant_id):
 
 @app.route("/api/r/<int:restaurant_id>/slider")
 def get_restaurant_slider(restaurant_id):
-    with SessionLocal() as db:
+    with read_session() as db:
         items = db.query(SliderItem).filter(SliderItem.restaurant_id == restaurant_id).all()
         return jsonify(
             [{"id": i.id, "title": i.title, "description": i.description, "image_url": i.image_url} for i in items])
 
 
 
+def _cart_state(cart, guest_token):
+    items_data = {}
+    for item in cart.items:
+        # Определяем, напиток ли это (для фронтенда)
+        is_drink = is_drink_item(item.menu_item)
+
+        # Формируем уникальный ключ для группировки в корзине не только по ID блюда, но и по автору?
+        # Для простоты пока оставим группировку по ID, но будем выводить список имен
+        # НО: в текущей архитектуре фронта cart - это словарь item_id -> data.
+        # Упростим: последнее имя добавившего или список.
+
+        # Лучше модифицировать объект, чтобы фронт мог отобразить "Вася, Петя"
+
+        if item.menu_item_id in items_data:
+            # ИСПРАВЛЕНО: Суммируем количество, если блюдо уже есть в словаре
+            items_data[item.menu_item_id]["quantity"] += item.quantity
+        else:
+            items_data[item.menu_item_id] = {
+                "id": item.menu_item_id,
+                "name": item.menu_item.name,
+                "price": item.menu_item.price,
+                "quantity": item.quantity,
+                "image_url": item.menu_item.image_url,
+                "is_drink": is_drink,
+                "added_by": item.added_by
+            }
+
+    # Проверяем, является ли текущий юзер владельцем
+    is_owner = (cart.owner_token == guest_token) if cart.owner_token else True
+
+    # Возвращаем также статус заказа, чтобы фронт знал, можно ли менять еду
+    return {
+        "order_id": cart.id,  # ID для отмены
+        "items": items_data,
+        "status": cart.status.value,
+        "status_key": cart.status.name,
+        "owner_name": cart.owner_name,  # Имя владельца заказа
+        "is_owner": is_owner  # Можно ли этому юзеру жать кнопку "Заказать"
+    }
+
+
 @app.route("/api/cart", methods=['GET'])
 def get_cart_state():
     rest_id = request.args.get('restaurant_id')
@@ -303,52 +359,22 @@ def get_cart_state():
 
     if not rest_id or not table_token: return jsonify({"error": "Missing params"}), 400
 
+    # Существующую корзину читаем через read_session(); если ее нет (или реплика еще не видит) — основная база
+    with read_session() as db:
+        table_obj, error = resolve_table_by_token(db, rest_id, table_token)
+        cart = find_active_order(db, int(rest_id), table_obj, selectinload(Order.items).joinedload(
+            OrderItem.menu_item).selectinload(MenuItem.categories)) if not error else None
+        if cart: return jsonify(_cart_state(cart, guest_token))
+
     with SessionLocal() as db:
         cart, error = get_or_create_cart(db, rest_id, table_token, guest_token, guest_name)
         if error: return jsonify({"error": error}), 404
-
-        items_data = {}
-        for item in cart.items:
-            # Определяем, напиток ли это (для фронтенда)
-            is_drink = any(c.name.lower() in ['напитки', 'drinks', 'bar'] for c in item.menu_item.categories)
-
-            # Формируем уникальный ключ для группировки в корзине не только по ID блюда, но и по автору?
-            # Для простоты пока оставим группировку по ID, но будем выводить список имен
-            # НО: в текущей архитектуре фронта cart - это словарь item_id -> data.
-            # Упростим: последнее имя добавившего или список.
-
-            # Лучше модифицировать объект, чтобы фронт мог отобразить "Вася, Петя"
-
-            if item.menu_item_id in items_data:
-                # ИСПРАВЛЕНО: Суммируем количество, если блюдо уже есть в словаре
-                items_data[item.menu_item_id]["quantity"] += item.quantity
-            else:
-                items_data[item.menu_item_id] = {
-                    "id": item.menu_item_id,
-                    "name": item.menu_item.name,
-                    "price": item.menu_item.price,
-                    "quantity": item.quantity,
-                    "image_url": item.menu_item.image_url,
-                    "is_drink": is_drink,
-                    "added_by": item.added_by
-                }
-
-        # Проверяем, является ли текущий юзер владельцем
-        is_owner = (cart.owner_token == guest_token) if cart.owner_token else True
-
-        # Возвращаем также статус заказа, чтобы фронт знал, можно ли менять еду
-        return jsonify({
-            "order_id": cart.id,  # ID для отмены
-            "items": items_data,
-            "status": cart.status.value,
-            "status_key": cart.status.name,
-            "owner_name": cart.owner_name,  # Имя владельца заказа
-            "is_owner": is_owner  # Можно ли этому юзеру жать кнопку "Заказать"
-        })
+        return jsonify(_cart_state(cart, guest_token))
 
 
 @app.route("/api/cart/update", methods=['POST'])
-@check_rate_limit(limit=100, window=60)
+@idempotent
+@check_rate_limit(limit=100, window=60, scopes=("ip", "guest"))
 def update_cart_item():
     data = request.json
     rest_id = int(data.get('restaurant_id'))
@@ -372,7 +398,7 @@ def update_cart_item():
 
         # 1. Определение типа продукта и прав доступа
         # Используем Eager Loading в модели или доступ через свойство, тут categories уже должны быть доступны
-        is_drink = any(c.name.lower() in ['напитки', 'drinks', 'bar', 'бар'] for c in menu_item.categories)
+        is_drink = is_drink_item(menu_item)
         status = cart.status
 
         # 2. ЖЕСТКИЕ ПРАВИЛА ЖИЗНЕННОГО ЦИКЛА
@@ -402,6 +428,7 @@ def update_cart_item():
 
         # 3. Выполнение изменения (Atomic Logic)
         audit_detail = f"{action.upper()} {menu_item.name}"
+        new_qty = None
 
         if action == 'add':
             # ИСПРАВЛЕНО: Приводим ID к числу и ищем только НЕОПЛАЧЕННУЮ позицию
@@ -422,6 +449,7 @@ def update_cart_item():
                 cart.items.append(new_item)
 
             audit_detail += f" (New Qty: {current_qty + 1})"
+            new_qty = current_qty + 1
 
 
 
@@ -436,12 +464,14 @@ def update_cart_item():
                     existing.quantity -= 1
 
                     audit_detail += f" (New Qty: {existing.quantity})"
+                    new_qty = existing.quantity
 
                 else:
 
                     db.delete(existing)
 
                     audit_detail += " (Deleted)"
+                    new_qty = 0
 
             else:
 
@@ -453,9 +483,11 @@ def update_cart_item():
 
         recalculate_order_total(db, cart)
 
-        log_audit(db, rest_id, 'cart_update', audit_detail, 'guest', guest_token, cart.id)
+        log_audit(db, rest_id, 'cart_update', audit_detail, 'guest', guest_token, cart.id,
+                  payload={"action": action, "menu_item_id": int(item_id), "quantity": new_qty})
 
         db.commit()
+        waiter_hints.mark_dirty(rest_id)
 
         # Уведомляем клиента
         socketio.emit('cart_updated', {'total': cart.total_price}, room=table_token)
@@ -516,7 +548,7 @@ def reset_table_order():
             if can_reset:
                 old_order.status = OrderStatus.CANCELED
                 log_audit(db, rest_id, 'order_reset', f"Reset by {guest_name} (Stale: {is_stale})", 'guest',
-                          guest_token, old_order.id)
+                          guest_token, old_order.id, payload={"guest_name": guest_name, "stale": bool(is_stale)})
                 db.flush()
 
         # Создаем новый
@@ -531,6 +563,7 @@ def reset_table_order():
         )
         db.add(new_order)
         db.commit()
+        waiter_hints.mark_dirty(rest_id)
 
         return jsonify({"success": True})
 
@@ -556,6 +589,7 @@ def cancel_order_endpoint():
 
         order.status = OrderStatus.CANCELED
         db.commit()
+        waiter_hints.mark_dirty(order.restaurant_id)
 
         # Уведомляем админ-панель об отмене заказа для проигрывания звука
         socketio.emit('status_change', {
@@ -567,7 +601,8 @@ def cancel_order_endpoint():
 
 
 @app.route("/orders/", methods=['POST'])
-@check_rate_limit(limit=3, window=60)  # Защита от спама заказами
+@idempotent
+@check_rate_limit(limit=3, window=60, scopes=("ip", "table", "guest"))  # Защита от спама заказами
 def create_order_api():
     data = request.json
     restaurant_id = data.get('restaurant_id')
@@ -662,9 +697,11 @@ def create_order_api():
             order.status = OrderStatus.REQUIRES_PAYMENT
             order.phone_number = data.get('phone_number')
 
-            log_audit(db, restaurant_id, 'order_created', f"Total: {total}", 'guest', guest_token, order.id)
+            log_audit(db, restaurant_id, 'order_created', f"Total: {total}", 'guest', guest_token, order.id,
+                      payload={"total": total, "table_number": order.table_number})
 
             db.commit()
+            waiter_hints.mark_dirty(restaurant_id)
             # Генерируем сигнал о ПЕРВИЧНОЙ отправке заказа (со звуком)
             socketio.emit('new_order', {'order_id': order.id, 'table': table_token or table_number},
                           room=f"rest_{restaurant_id}")
@@ -674,7 +711,8 @@ def create_order_api():
 # --- SERVICE SIGNALS ---
 
 @app.route("/api/signal/call", methods=['POST'])
-@check_rate_limit(limit=1, window=300)  # 1 вызов в 5 минут
+@idempotent
+@check_rate_limit(limit=1, window=300, scopes=("ip", "table"))  # 1 вызов в 5 минут со стола
 def call_waiter_signal():
     data = request.json
     table_token = data.get('table_token')
@@ -692,6 +730,7 @@ def call_waiter_signal():
         if not exists:
             db.add(ServiceSignal(restaurant_id=data['restaurant_id'], table_number=table_obj.number))
             db.commit()
+            waiter_hints.mark_dirty(data['restaurant_id'])
             # Моментальный сигнал официанту
             socketio.emit('new_signal', {'table': table_obj.number}, room=f"rest_{data['restaurant_id']}")
     return jsonify({"status": "ok"})
@@ -708,9 +747,11 @@ def resolve_signal():
 
             log_audit(db, current_user.restaurant_id, 'signal_resolved',
                       f"Table {sig.table_number}",
-                      current_user.role, current_user.id)
+                      current_user.role, current_user.id,
+                      payload={"signal_id": sig.id, "table_number": sig.table_number})
 
             db.commit()
+            waiter_hints.mark_dirty(current_user.restaurant_id)
         else:
             return jsonify({"error": "Forbidden"}), 403
     return jsonify({"success": True})
@@ -725,32 +766,10 @@ def bind_telegram():
     chat_id = data.get('chat_id')
 
     with SessionLocal() as db:
-        # 1. Ищем стол по токену
-        table = db.query(Table).filter_by(public_token=token).first()
+        table = bind_telegram_chat(db, token, chat_id)
         if not table:
             return jsonify({"error": "Invalid token"}), 404
 
-        # 2. Ищем активный заказ на этом столе
-        order = db.query(Order).filter(
-            Order.table_id == table.id,
-            Order.status == OrderStatus.BASKET_ASSEMBLY
-        ).first()
-
-        # 3. Если заказа нет - создаем
-        if not order:
-            order = Order(
-                restaurant_id=table.restaurant_id,
-                table_id=table.id,
-                table_number=table.number,
-                status=OrderStatus.BASKET_ASSEMBLY,
-                is_bot_active=True
-            )
-            db.add(order)
-
-        # 4. Привязываем Telegram
-        order.telegram_chat_id = str(chat_id)
-        db.commit()
-
         return jsonify({"success": True, "restaurant_name": table.restaurant.name, "table": table.number})
 
 
@@ -767,42 +786,13 @@ def chat_endpoint():
     table_token = data.get('table_token')  # Используем токен, а не номер!
 
     with SessionLocal() as db:
-        order = None
-
-        if is_telegram:
-            # Ищем по привязке Telegram
-            order = db.query(Order).filter(
-                Order.telegram_chat_id == chat_id,
-                Order.status == OrderStatus.BASKET_ASSEMBLY
-            ).order_by(Order.id.desc()).first()
-        elif table_token:
-            # Ищем по токену стола (Веб)
-            table_obj = db.query(Table).filter_by(public_token=table_token).first()
-            if table_obj:
-                order = db.query(Order).filter(
-                    Order.table_id == table_obj.id,
-                    Order.status == OrderStatus.BASKET_ASSEMBLY
-                ).first()
-                if not order:  # Создаем черновик для веб-чата
-                    order = Order(
-                        restaurant_id=table_obj.restaurant_id,
-                        table_id=table_obj.id,
-                        table_number=table_obj.number,
-                        status=OrderStatus.BASKET_ASSEMBLY,
-                        is_bot_active=True
-                    )
-                    db.add(order)
-                    db.commit()
+        order, status = accept_chat_message(db, user_msg, telegram_chat_id=chat_id if is_telegram else None,
+                                            table_token=table_token)
 
-        if not order:
+        if status == 'no_order':
             return jsonify({"response": "Сначала отсканируйте QR код (для Telegram нажмите /start)."})
 
-        # Сохраняем сообщение юзера
-        db.add(ChatMessage(order_id=order.id, sender='user', content=user_msg))
-        order.last_activity = datetime.datetime.now(datetime.timezone.utc)
-        db.commit()
-
-        if not order.is_bot_active:
+        if status == 'waiting_for_admin':
             return jsonify({"status": "waiting_for_admin"})
 
 
@@ -813,7 +803,10 @@ def chat_endpoint():
                     "user_text": user_msg,
                     "order_id": order.id,
                     "restaurant_id": order.restaurant_id,
-                    "is_telegram": is_telegram
+                    "is_telegram": is_telegram,
+                    # Веб-чат получает ответ по токенам через Socket.IO (комната стола)
+                    "notify": (lambda event, payload: socketio.emit(event, payload, room=table_token))
+                              if not is_telegram and table_token else None
                 }
             )
         thread.start()
@@ -841,19 +834,11 @@ def restaurant_admin_entry(secret_link):
 @login_required
 def get_admin_orders():
     if current_user.role not in ['admin', 'waiter']: return 403
-    with SessionLocal() as db:
-        # FIX: Eager load waiter to prevent DetachedInstanceError
-        orders = db.query(Order).options(joinedload(Order.waiter), joinedload(Order.items).joinedload(OrderItem.menu_item)).filter(Order.restaurant_id == current_user.restaurant_id).order_by(
-            Order.id.desc()).limit(50).all()
-        res = []
-        for o in orders:
-            res.append({
-                "id": o.id, "table_number": o.table_number, "phone_number": o.phone_number,
-                "total_price": o.total_price, "status": o.status.value,
-                "waiter_name": o.waiter.username if o.waiter else None,
-                "items": [{"name": i.menu_item.name, "quantity": i.quantity} for i in o.items]
-            })
-        return jsonify(res)
+    # ?since=<водяной знак> — только изменившиеся заказы; без него — полный список, как раньше
+    since = floor_view.parse_watermark(request.args.get('since'))
+    if since:
+        return jsonify(floor_view.recent_orders_changes(current_user.restaurant_id, since))
+    return jsonify(floor_view.recent_orders(current_user.restaurant_id))
 
 
 @app.route('/api/orders/<int:order_id>/status', methods=['PUT'])
@@ -877,9 +862,11 @@ def update_order_status(order_id):
 
             log_audit(db, current_user.restaurant_id, 'status_change',
                       f"{old_status} -> {new_status_enum.value}",
-                      current_user.role, current_user.id, order.id)
+                      current_user.role, current_user.id, order.id,
+                      payload={"from": old_status, "to": new_status_enum.value})
 
             db.commit()
+            waiter_hints.mark_dirty(current_user.restaurant_id)
             # Уведомляем персонал
             socketio.emit('status_change', {'order_id': order.id, 'status': order.status.value},
                           room=f"rest_{current_user.restaurant_id}")
@@ -894,7 +881,7 @@ def update_order_status(order_id):
 @login_required
 def get_order_chat(order_id):
     if current_user.role not in ['admin', 'waiter']: return 403
-    with SessionLocal() as db:
+    with read_session() as db:
         order = db.query(Order).get(order_id)
         if not order or order.restaurant_id != current_user.restaurant_id: return 404
 
@@ -951,7 +938,7 @@ def toggle_bot(order_id):
 @login_required
 def staff_management(user_id=None):
     if current_user.role != 'admin': return 403
-    with SessionLocal() as db:
+    with session_for_request() as db:
         if request.method == 'GET':
             staff = db.query(User).filter(User.restaurant_id == current_user.restaurant_id, User.role == 'waiter').all()
             return jsonify([{"id": u.id, "username": u.username, "is_active": u.is_active} for u in staff])
@@ -973,6 +960,7 @@ def staff_management(user_id=None):
             if 'password' in data and data['password']: u.set_password(data['password'])
             if 'is_active' in data: u.is_active = data['is_active']
             db.commit()
+            auth_cache.invalidate_user(u.id)
             return jsonify({"success": True})
 
         if request.method == 'DELETE':
@@ -980,6 +968,7 @@ def staff_management(user_id=None):
             if u and u.restaurant_id == current_user.restaurant_id:
                 db.delete(u)
                 db.commit()
+                auth_cache.invalidate_user(user_id)
                 return jsonify({"success": True})
         return 404
 
@@ -1001,7 +990,7 @@ def save_upload(file):
 @login_required
 def manage_categories(cat_id=None):
     if current_user.role != 'admin': return 403
-    with SessionLocal() as db:
+    with session_for_request() as db:
         if request.method == 'GET':
             cats = db.query(Category).filter_by(restaurant_id=current_user.restaurant_id).order_by(
                 Category.sort_order).all()
@@ -1013,6 +1002,7 @@ def manage_categories(cat_id=None):
             new_cat = Category(name=data['name'], sort_order=data.get('sort_order', 0),
                                restaurant_id=current_user.restaurant_id)
             db.add(new_cat)
+            bump_menu_version(db, current_user.restaurant_id)
             db.commit()
             return jsonify({"success": True})
 
@@ -1024,11 +1014,13 @@ def manage_categories(cat_id=None):
             cat.name = data.get('name', cat.name)
             cat.sort_order = data.get('sort_order', cat.sort_order)
             cat.is_active = data.get('is_active', cat.is_active)
+            bump_menu_version(db, current_user.restaurant_id)
             db.commit()
             return jsonify({"success": True})
 
         if request.method == 'DELETE':
             db.delete(cat)
+            bump_menu_version(db, current_user.restaurant_id)
             db.commit()
             return jsonify({"success": True})
 
@@ -1038,10 +1030,10 @@ def manage_categories(cat_id=None):
 @login_required
 def manage_menu(item_id=None):
     if current_user.role != 'admin': return 403
-    with SessionLocal() as db:
+    with session_for_request() as db:
         if request.method == 'GET':
-            items = db.query(MenuItem).filter_by(restaurant_id=current_user.restaurant_id).order_by(
-                MenuItem.sort_order).all()
+            items = db.query(MenuItem).options(selectinload(MenuItem.categories)) \
+                .filter_by(restaurant_id=current_user.restaurant_id).order_by(MenuItem.sort_order).all()
             return jsonify([{
                 "id": i.id, "name": i.name, "description": i.description,
                 "price": i.price, "image_url": i.image_url, "sort_order": i.sort_order,
@@ -1073,6 +1065,7 @@ def manage_menu(item_id=None):
                     new_item.categories.append(cat)
 
             db.add(new_item)
+            bump_menu_version(db, current_user.restaurant_id)
             db.commit()
             return jsonify({"success": True})
 
@@ -1100,12 +1093,14 @@ def manage_menu(item_id=None):
                         cat = db.query(Category).get(cid)
                         if cat: item.categories.append(cat)
 
+                bump_menu_version(db, current_user.restaurant_id)
                 db.commit()
                 return jsonify({"success": True})
             return 400
 
         if request.method == 'DELETE':
             db.delete(item)
+            bump_menu_version(db, current_user.restaurant_id)
             db.commit()
         return jsonify({"success": True})
 
@@ -1115,7 +1110,7 @@ def manage_menu(item_id=None):
 @login_required
 def manage_slider(slide_id=None):
     if current_user.role != 'admin': return 403
-    with SessionLocal() as db:
+    with session_for_request() as db:
         if request.method == 'GET':
             slides = db.query(SliderItem).filter_by(restaurant_id=current_user.restaurant_id).all()
             return jsonify(
@@ -1148,43 +1143,13 @@ def manage_slider(slide_id=None):
 @login_required
 def get_table_statuses():
     if current_user.role != 'admin': return 403
-    with SessionLocal() as db:
-        tables = db.query(models.Table).filter_by(restaurant_id=current_user.restaurant_id).order_by(
-            models.Table.number).all()
-        result = []
-        for t in tables:
-            active_order = db.query(Order).filter(
-                Order.table_id == t.id,
-                Order.status.notin_([OrderStatus.CANCELED, OrderStatus.SUCCESSFULLY_DELIVERED])
-            ).first()
-
-            # Получаем все позиции заказа с именами гостей
-            items_detail = []
-            if active_order:
-                for oi in active_order.items:
-                    items_detail.append({
-                        "id": oi.id,
-                        "name": oi.menu_item.name,
-                        "quantity": oi.quantity,
-                        "price": oi.menu_item.price,
-                        "added_by": oi.added_by or "Гость",
-                        "is_paid": oi.is_paid
-                    })
-
-            result.append({
-                "id": t.id,
-                "number": t.number,
-                "active": active_order is not None,
-                "order_id": active_order.id if active_order else None,
-                "status": active_order.status.value if active_order else "Свободен",
-                "created_at": active_order.created_at.strftime("%H:%M") if active_order else None,
-                "items": items_detail  # Добавлено: состав корзины
-            })
-        return jsonify(result)
+    # Снимок зала в памяти (floor_view): пересобирается только после изменений, а не на каждый опрос
+    return jsonify(floor_view.table_statuses(current_user.restaurant_id))
 
 
 @app.route('/api/admin/orders/pay_cash', methods=['POST'])
 @login_required
+@idempotent
 def pay_order_cash():
     if current_user.role != 'admin': return 403
     data = request.json
@@ -1198,6 +1163,8 @@ def pay_order_cash():
         if item_ids:
             # Частичная оплата конкретных позиций
             db.query(OrderItem).filter(OrderItem.id.in_(item_ids)).update({"is_paid": True}, synchronize_session=False)
+            # Массовый UPDATE позиций не поднимает updated_at заказа сам
+            order.updated_at = datetime.datetime.now(datetime.timezone.utc)
         else:
             # Оплата всего стола
             db.query(OrderItem).filter(OrderItem.order_id == order_id).update({"is_paid": True},
@@ -1205,6 +1172,7 @@ def pay_order_cash():
             order.status = OrderStatus.SUCCESSFULLY_DELIVERED
 
         db.commit()
+        waiter_hints.mark_dirty(order.restaurant_id)
         return jsonify({"success": True})
 
 @app.route('/api/admin/tables/<int:table_id>/reset', methods=['POST'])
@@ -1222,8 +1190,10 @@ def reset_table_admin(table_id):
         if active_order:
             active_order.status = OrderStatus.CANCELED
             log_audit(db, current_user.restaurant_id, 'admin_table_reset',
-                      f"Table {table.number} reset by admin", 'admin', current_user.id, active_order.id)
+                      f"Table {table.number} reset by admin", 'admin', current_user.id, active_order.id,
+                      payload={"table_id": table.id, "table_number": table.number})
             db.commit()
+            waiter_hints.mark_dirty(current_user.restaurant_id)
         return jsonify({"success": True})
 
 
@@ -1232,7 +1202,7 @@ def reset_table_admin(table_id):
 def update_settings():
     if current_user.role != 'admin': return 403
 
-    with SessionLocal() as db:
+    with session_for_request() as db:
         rest = db.query(Restaurant).get(current_user.restaurant_id)
         if not rest: return 404
 
@@ -1295,58 +1265,19 @@ def waiter_api_tables():
     if current_user.role != 'waiter': return 403
 
     try:
-        with SessionLocal() as db:
-            # AUTO-HEAL удален. Данные должны быть консистентны благодаря миграциям и Enum.
-
-            orders = db.query(Order).options(
-                joinedload(Order.items).joinedload(OrderItem.menu_item)
-            ).filter(
-                Order.restaurant_id == current_user.restaurant_id,
-                Order.status.notin_([OrderStatus.CANCELED, OrderStatus.SUCCESSFULLY_DELIVERED]),
-                Order.table_number.isnot(None)
-            ).all()
-
-            orders_info = []
-            now = datetime.datetime.now(datetime.timezone.utc)
-
-            for o in orders:
-                if o.last_activity:
-                    last_act = o.last_activity if o.last_activity.tzinfo else o.last_activity.replace(
-                        tzinfo=datetime.timezone.utc)
-                else:
-                    last_act = now
-
-                diff = int((now - last_act).total_seconds() / 60)
-
-                items_list = []
-                for i in o.items:
-                    if i.menu_item:
-                        items_list.append(f"{i.menu_item.name} x{i.quantity}")
-                    else:
-                        items_list.append(f"Удаленное блюдо x{i.quantity}")
-
-                orders_info.append({
-                    "id": o.id,
-                    "table": o.table_number,
-                    "status": o.status.value,
-                    "total": o.total_price,
-                    "minutes": diff,
-                    "items": items_list
-                })
-
-            ai_hints = []
-            try:
-                # Убрали asyncio.run, так как функция теперь синхронная
-                ai_hints = assistant.analyze_tables_for_waiter(orders_info)
-            except Exception as e:
-                pass
-            signals = db.query(ServiceSignal).filter(
-                ServiceSignal.restaurant_id == current_user.restaurant_id,
-                ServiceSignal.is_active == True
-            ).all()
-            signals_data = [{"id": s.id, "table": s.table_number} for s in signals]
+        # Подсказки считает фоновый планировщик (waiter_hints), здесь только читаем общий кэш
+        hints = waiter_hints.get_hints(current_user.restaurant_id)
 
-            return jsonify({"orders": orders_info, "hints": ai_hints, "signals": signals_data})
+        # ?since=<водяной знак> — только изменившиеся заказы + карта активных
+        since = floor_view.parse_watermark(request.args.get('since'))
+        if since:
+            changes = floor_view.waiter_floor_changes(current_user.restaurant_id, since)
+            return jsonify(dict(changes, hints=hints))
+
+        # AUTO-HEAL удален. Данные должны быть консистентны благодаря миграциям и Enum.
+        watermark = floor_view.next_watermark()
+        orders_info, signals_data = floor_view.waiter_floor_info(current_user.restaurant_id)
+        return jsonify({"orders": orders_info, "hints": hints, "signals": signals_data, "watermark": watermark})
 
     except Exception as e:
         print(f"CRITICAL WAITER API ERROR: {e}")
@@ -1407,6 +1338,27 @@ def background_scheduler():
             print(f"Scheduler Error: {e}")
         # Используем socketio.sleep для корректной передачи управления в eventlet
         socketio.sleep(120)
+
+
+# ФОНОВЫЙ ПЕРЕСЧЕТ ПОДСКАЗОК ОФИЦИАНТАМ (общий для всех официантов ресторана)
+def waiter_hints_scheduler():
+    while True:
+        try:
+            waiter_hints.refresh_due_hints()
+        except Exception as e:
+            print(f"Hints Scheduler Error: {e}")
+        # Короткий тик: изменения зала (mark_dirty) подхватываются за пару секунд
+        socketio.sleep(2)
+
+# АРХИВАЦИЯ СТАРЫХ ЗАКРЫТЫХ ЗАКАЗОВ (включается ARCHIVE_ENABLED=1, см. archive.py)
+def archive_scheduler():
+    while True:
+        try:
+            archive.run_archive()
+        except Exception as e:
+            print(f"Archive Scheduler Error: {e}")
+        socketio.sleep(archive.ARCHIVE_INTERVAL)
+
 @app.route("/api/chat/history", methods=["GET"])
 def chat_history_public():
     restaurant_id = request.args.get("restaurant_id")
@@ -1415,7 +1367,7 @@ def chat_history_public():
     if not restaurant_id or not table_token:
         return jsonify({"messages": []})
 
-    with SessionLocal() as db:
+    with read_session() as db:
         table_obj = db.query(Table).filter_by(public_token=table_token).first()
         if not table_obj or str(table_obj.restaurant_id) != str(restaurant_id):
             return jsonify({"messages": []})
@@ -1457,6 +1409,13 @@ def on_leave(data):
 if __name__ == "__main__":
     # Планировщик запускаем через встроенный механизм SocketIO
     socketio.start_background_task(background_scheduler)
+    socketio.start_background_task(waiter_hints_scheduler)
+    if archive.ARCHIVE_ENABLED:
+        socketio.start_background_task(archive_scheduler)
+    # Снимки зала собираем заранее, чтобы первые опросы персонала не ждали БД
+    floor_view.warm_up()
+    # SIGTERM -> штатный выход: буфер аудита дописывается в atexit
+    audit_writer.install_signal_handlers()
 
     # ВАЖНО: debug=False для продакшена, используем socketio.run
     socketio.run(app, host="0.0.0.0", port=5000, debug=False, allow_unsafe_werkzeug=True)
\ No newline at end of file
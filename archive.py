@@ -0,0 +1,270 @@
+"""
+Архив закрытых заказов: горячие таблицы держат только свежие данные.
+
+Закрытые заказы (доставлен / отменен), которые не менялись дольше ARCHIVE_AFTER_DAYS,
+вместе с позициями, чатом и аудитом переносятся в сжатые файлы по месяцам создания:
+    {ARCHIVE_DIR}/restaurant_{id}/orders-YYYY-MM.jsonl.gz   — заказ на строку
+    {ARCHIVE_DIR}/restaurant_{id}/audit-YYYY-MM.jsonl.gz    — аудит без заказа (вызовы и т.п.)
+и удаляются из БД. Пачка сначала дописывается в файл (новый gzip-member, fsync), потом
+удаляется одной транзакцией; если процесс упал между этими шагами, заказ попадет в архив
+повторно — читатели отбрасывают дубли по id.
+
+Доставленные заказы перед удалением учитываются в аналитике (analytics), поэтому отчеты
+не меняются. Экспорт и пересчет аналитики читают архив через iter_archived_orders().
+
+Запуск: python archive.py run [--days N] [--restaurant-id N] [--dry-run]
+или фоновая задача в app.py при ARCHIVE_ENABLED=1 (раз в ARCHIVE_INTERVAL секунд).
+"""
+import os
+import json
+import gzip
+import argparse
+import datetime
+import logging
+from contextlib import contextmanager
+
+from sqlalchemy import delete
+from sqlalchemy.orm import selectinload, joinedload
+
+from models import SessionLocal, Order, OrderItem, OrderStatus, ChatMessage, AuditLog, ConversationState
+import analytics
+
+try:
+    import fcntl
+except ImportError:  # Windows: без межпроцессной блокировки
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 90))
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "0") == "1"
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", 6 * 3600))
+ARCHIVE_BATCH = 500
+CLOSED_STATUSES = (OrderStatus.CANCELED, OrderStatus.SUCCESSFULLY_DELIVERED)
+
+
+def _iso(dt):
+    return dt.isoformat() if dt else None
+
+
+def _naive_utc(dt):
+    if dt is None or dt.tzinfo is None: return dt
+    return dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _month(dt):
+    return (_naive_utc(dt) or datetime.datetime(1970, 1, 1)).strftime("%Y-%m")
+
+
+def _path(restaurant_id, kind, month):
+    return os.path.join(ARCHIVE_DIR, f"restaurant_{restaurant_id}", f"{kind}-{month}.jsonl.gz")
+
+
+def _audit_record(log):
+    return {
+        "id": log.id, "restaurant_id": log.restaurant_id, "order_id": log.order_id,
+        "timestamp": _iso(log.timestamp), "actor_type": log.actor_type, "actor_id": log.actor_id,
+        "action": log.action, "details": log.details, "payload": log.payload,
+    }
+
+
+def order_record(order, audit=()):
+    """Заказ со всем, что к нему относится, в виде одной JSON-строки архива."""
+    return {
+        "id": order.id,
+        "restaurant_id": order.restaurant_id,
+        "table_id": order.table_id,
+        "table_number": order.table_number,
+        "phone_number": order.phone_number,
+        "owner_name": order.owner_name,
+        "telegram_chat_id": order.telegram_chat_id,
+        "status": order.status.name,
+        "status_label": order.status.value,
+        "total_price": order.total_price,
+        "waiter_id": order.waiter_id,
+        "waiter_name": order.waiter.username if order.waiter else None,
+        "created_at": _iso(_naive_utc(order.created_at)),
+        "updated_at": _iso(_naive_utc(order.updated_at)),
+        "items": [{
+            "id": i.id,
+            "menu_item_id": i.menu_item_id,
+            "name": i.menu_item.name if i.menu_item else None,
+            "price": i.menu_item.price if i.menu_item else None,
+            "quantity": i.quantity,
+            "added_by": i.added_by,
+            "is_paid": i.is_paid,
+        } for i in order.items],
+        "chat": [{
+            "sender": m.sender, "type": m.message_type, "content": m.content, "timestamp": _iso(m.timestamp)
+        } for m in sorted(order.chat_messages, key=lambda m: m.id)],
+        "audit": [_audit_record(log) for log in audit],
+    }
+
+
+def _append(groups):
+    """groups: {(restaurant_id, kind, month): [record]} -> дописывает файлы и сбрасывает их на диск."""
+    for (restaurant_id, kind, month), records in groups.items():
+        path = _path(restaurant_id, kind, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="ab") as gz:
+                for record in records:
+                    gz.write(json.dumps(record, ensure_ascii=False).encode() + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+@contextmanager
+def _exclusive():
+    """Один архиватор на каталог (воркеры с ARCHIVE_ENABLED не мешают друг другу). False — уже занято."""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    with open(os.path.join(ARCHIVE_DIR, ".lock"), "w") as lock:
+        if fcntl:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+        yield True
+
+
+def _archive_orders(db, cutoff, restaurant_id, batch, dry_run):
+    total = 0
+    while True:
+        query = db.query(Order).options(
+            selectinload(Order.items).joinedload(OrderItem.menu_item),
+            selectinload(Order.chat_messages),
+            joinedload(Order.waiter)
+        ).filter(Order.status.in_(CLOSED_STATUSES), Order.updated_at < cutoff)
+        if restaurant_id is not None: query = query.filter(Order.restaurant_id == restaurant_id)
+        if dry_run: return query.count()
+        orders = query.order_by(Order.id).limit(batch).all()
+        if not orders: return total
+
+        ids = [o.id for o in orders]
+        audit = {}
+        for log in db.query(AuditLog).filter(AuditLog.order_id.in_(ids)).order_by(AuditLog.id):
+            audit.setdefault(log.order_id, []).append(log)
+
+        groups = {}
+        for o in orders:
+            groups.setdefault((o.restaurant_id, "orders", _month(o.created_at)), []).append(
+                order_record(o, audit.get(o.id, ())))
+        _append(groups)
+
+        conn = db.connection()
+        for o in orders:
+            # Доставленный заказ, еще не попавший в аналитику, учитываем до удаления
+            if o.status == OrderStatus.SUCCESSFULLY_DELIVERED and not o.rolled_up:
+                analytics.apply_order(conn, o, 1)
+        db.expunge_all()
+        for model in (AuditLog, ConversationState, ChatMessage, OrderItem):
+            db.execute(delete(model).where(model.order_id.in_(ids)))
+        db.execute(delete(Order).where(Order.id.in_(ids)))
+        db.commit()
+        total += len(ids)
+
+
+def _archive_audit(db, cutoff, restaurant_id, batch, dry_run):
+    """Аудит без заказа (вызовы официанта, сброс столов без заказа) — в audit-YYYY-MM."""
+    total = 0
+    while True:
+        query = db.query(AuditLog).filter(AuditLog.order_id.is_(None), AuditLog.timestamp < cutoff)
+        if restaurant_id is not None: query = query.filter(AuditLog.restaurant_id == restaurant_id)
+        if dry_run: return query.count()
+        logs = query.order_by(AuditLog.id).limit(batch).all()
+        if not logs: return total
+
+        groups = {}
+        for log in logs:
+            groups.setdefault((log.restaurant_id, "audit", _month(log.timestamp)), []).append(_audit_record(log))
+        _append(groups)
+        ids = [log.id for log in logs]
+        db.expunge_all()
+        db.execute(delete(AuditLog).where(AuditLog.id.in_(ids)))
+        db.commit()
+        total += len(ids)
+
+
+def run_archive(days=ARCHIVE_AFTER_DAYS, restaurant_id=None, batch=ARCHIVE_BATCH, dry_run=False):
+    """Переносит старые закрытые заказы и аудит в архив. Возвращает {"orders": n, "audit": n} или None, если занято."""
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+    with _exclusive() as acquired:
+        if not acquired: return None
+        with SessionLocal() as db:
+            result = {
+                "orders": _archive_orders(db, cutoff, restaurant_id, batch, dry_run),
+                "audit": _archive_audit(db, cutoff, restaurant_id, batch, dry_run),
+            }
+    if not dry_run and any(result.values()):
+        logger.warning(f"Archived: {result}")
+    return result
+
+
+# --- Чтение ---
+
+def _months(restaurant_id, kind, date_from, date_to):
+    directory = os.path.join(ARCHIVE_DIR, f"restaurant_{restaurant_id}")
+    if not os.path.isdir(directory): return []
+    first = date_from.strftime("%Y-%m") if date_from else None
+    last = date_to.strftime("%Y-%m") if date_to else None
+    paths = []
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith(f"{kind}-") and name.endswith(".jsonl.gz")): continue
+        month = name[len(kind) + 1:-len(".jsonl.gz")]
+        if (first and month < first) or (last and month > last): continue
+        paths.append(os.path.join(directory, name))
+    return paths
+
+
+def archived_months(restaurant_id, kind="orders"):
+    """Месяцы ("YYYY-MM"), за которые у ресторана есть архивные файлы."""
+    return [os.path.basename(p)[len(kind) + 1:-len(".jsonl.gz")] for p in _months(restaurant_id, kind, None, None)]
+
+
+def _restaurant_ids():
+    if not os.path.isdir(ARCHIVE_DIR): return []
+    return sorted(int(name.split("_", 1)[1]) for name in os.listdir(ARCHIVE_DIR)
+                  if name.startswith("restaurant_") and name.split("_", 1)[1].isdigit())
+
+
+def _iter_records(kind, time_field, restaurant_id, date_from, date_to):
+    rids = _restaurant_ids() if restaurant_id is None else [restaurant_id]
+    date_from, date_to = _naive_utc(date_from), _naive_utc(date_to)
+    for rid in rids:
+        for path in _months(rid, kind, date_from, date_to):
+            seen = set()  # Повторная запись после сбоя между файлом и удалением из БД
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    if record["id"] in seen: continue
+                    seen.add(record["id"])
+                    ts = datetime.datetime.fromisoformat(record[time_field]) if record.get(time_field) else None
+                    if ts and ((date_from and ts < date_from) or (date_to and ts >= date_to)): continue
+                    yield record
+
+
+def iter_archived_orders(restaurant_id=None, date_from=None, date_to=None):
+    """Заказы из архива (dict, как order_record) с created_at в [date_from, date_to), по месяцам."""
+    return _iter_records("orders", "created_at", restaurant_id, date_from, date_to)
+
+
+def iter_archived_audit(restaurant_id=None, date_from=None, date_to=None):
+    """Аудит без заказа из архива (аудит заказов лежит в самих заказах, поле audit)."""
+    return _iter_records("audit", "timestamp", restaurant_id, date_from, date_to)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Архивация старых закрытых заказов")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="Перенести старые заказы и аудит в архив")
+    run.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS)
+    run.add_argument("--restaurant-id", type=int)
+    run.add_argument("--batch", type=int, default=ARCHIVE_BATCH)
+    run.add_argument("--dry-run", action="store_true", help="Только посчитать, что будет перенесено")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        result = run_archive(args.days, args.restaurant_id, args.batch, args.dry_run)
+        print("Архиватор уже запущен другим процессом" if result is None else result)
@@ -1,6 +1,7 @@
 import os
 import logging
 import json
+import re
 import time # Используем time вместо asyncio
 from openai import OpenAI # Используем синхронный клиент
 from dotenv import load_dotenv
@@ -10,6 +11,16 @@ load_dotenv()
 
 
 # client удален отсюда
+# OPENAI_BASE_URL позволяет направить запросы на локальную заглушку (stub_server.py) для нагрузочных тестов
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+# Последние реплики, которые идут в промпт дословно (более старые — в виде краткого пересказа)
+MAX_HISTORY_MESSAGES = int(os.getenv("AI_HISTORY_MESSAGES", 10))
+
+
+def _get_client():
+    # СОЗДАЕМ СИНХРОННОГО КЛИЕНТА
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL)
+
 
 # --- Менеджер Напоминаний (Упрощенная заглушка, т.к. tasks.py обрабатывает это в фоне) ---
 class ReminderManager:
@@ -35,7 +46,8 @@ def _get_system_prompt(menu_list_str, cart_context):
         f"МЕНЮ (ID: Название - Цена):\n{menu_list_str}\n"
         f"КОРЗИНА СЕЙЧАС: {cart_context}\n\n"
 
-        f"Ты должен вернуть JSON с объектом: {{ \"actions\": [...], \"response\": \"...\", \"recommendations\": [...] }}\n"
+        # "response" идет первым: при стриминге гость видит текст, не дожидаясь генерации 'actions'
+        f"Ты должен вернуть JSON с объектом: {{ \"response\": \"...\", \"actions\": [...], \"recommendations\": [...] }}\n"
         f"Поле 'actions' — это список изменений БД (строго по приказу).\n"
         f"Поле 'recommendations' — список предложений (id блюда + кол-во).\n\n"
 
@@ -60,10 +72,7 @@ def _get_system_prompt(menu_list_str, cart_context):
     )
 
 
-def process_message(user_text, cart, menu_items, chat_history=None):
-    # СОЗДАЕМ СИНХРОННОГО КЛИЕНТА
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
+def _build_messages(user_text, cart, menu_items, chat_history=None, summary=None):
     menu_names = [f"{m['id']}: {m['name']} ({m['price']}тг)" for m in menu_items]
     menu_str = "\n".join(menu_names)
 
@@ -73,9 +82,27 @@ def process_message(user_text, cart, menu_items, chat_history=None):
     system_prompt = _get_system_prompt(menu_str, cart_ctx)
 
     messages = [{"role": "system", "content": system_prompt}]
+    if summary:
+        messages.append({"role": "system", "content": f"КРАТКО О ДИАЛОГЕ РАНЕЕ:\n{summary}"})
     if chat_history:
-        messages.extend(chat_history[-6:])
+        messages.extend(chat_history[-MAX_HISTORY_MESSAGES:])
     messages.append({"role": "user", "content": user_text})
+    return messages
+
+
+def _parse_ai_json(content):
+    data = json.loads(content)
+
+    if not isinstance(data.get('actions'), list): data['actions'] = []
+    if not isinstance(data.get('recommendations'), list): data['recommendations'] = []
+
+    return data
+
+
+def process_message(user_text, cart, menu_items, chat_history=None, summary=None):
+    client = _get_client()
+
+    messages = _build_messages(user_text, cart, menu_items, chat_history, summary)
 
     try:
         # Убрали await
@@ -86,19 +113,126 @@ def process_message(user_text, cart, menu_items, chat_history=None):
             temperature=0.7
         )
         content = response.choices[0].message.content
-        data = json.loads(content)
+        return _parse_ai_json(content)
+    except Exception as e:
+        logging.error(f"AI Error: {e}")
+        return {"response": "Сорян, я немного подвис. Повтори? 😵", "actions": []}
+
 
-        if not isinstance(data.get('actions'), list): data['actions'] = []
-        if not isinstance(data.get('recommendations'), list): data['recommendations'] = []
+class ResponseFieldStreamer:
+    """
+    Достает значение поля "response" из JSON, который приходит кусками (stream=True).
+    feed() возвращает новый кусок текста для гостя (уже без JSON-экранирования).
+    """
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+    _START = re.compile(r'"response"\s*:\s*"')
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = None  # Позиция внутри строки-значения (None — еще не нашли начало)
+        self.done = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.done: return ""
+
+        if self.pos is None:
+            m = self._START.search(self.buffer)
+            if not m: return ""
+            self.pos = m.end()
+
+        out = []
+        buf, i = self.buffer, self.pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch == '\\':
+                if i + 1 >= len(buf): break  # Ждем следующий кусок
+                esc = buf[i + 1]
+                if esc == 'u':
+                    if i + 6 > len(buf): break
+                    try:
+                        code = int(buf[i + 2:i + 6], 16)
+                    except ValueError:
+                        i += 6
+                        continue
+                    if 0xD800 <= code <= 0xDBFF:
+                        # Эмодзи приходят суррогатной парой (\ud83d\ude0e)
+                        if i + 12 > len(buf): break
+                        try:
+                            low = int(buf[i + 8:i + 12], 16)
+                            code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                            i += 6
+                        except ValueError:
+                            pass
+                    out.append(chr(code))
+                    i += 6
+                    continue
+                out.append(self._ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            out.append(ch)
+            i += 1
+        self.pos = i
+        return "".join(out)
+
+
+def process_message_stream(user_text, cart, menu_items, chat_history=None, on_delta=None, summary=None):
+    """
+    То же, что process_message, но с stream=True: текст ответа отдается в on_delta(str)
+    по мере генерации. Итоговый dict (actions и т.д.) возвращается, когда JSON собран целиком.
+    """
+    client = _get_client()
+
+    messages = _build_messages(user_text, cart, menu_items, chat_history, summary)
+    streamer = ResponseFieldStreamer()
 
-        return data
+    try:
+        stream = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=messages,
+            response_format={"type": "json_object"},
+            temperature=0.7,
+            stream=True
+        )
+        for chunk in stream:
+            if not chunk.choices: continue
+            piece = chunk.choices[0].delta.content
+            if not piece: continue
+            delta = streamer.feed(piece)
+            if delta and on_delta:
+                try:
+                    on_delta(delta)
+                except Exception as e:
+                    logging.error(f"AI Stream Callback Error: {e}")
+
+        return _parse_ai_json(streamer.buffer)
     except Exception as e:
-        logging.error(f"AI Error: {e}")
+        logging.error(f"AI Stream Error: {e}")
         return {"response": "Сорян, я немного подвис. Повтори? 😵", "actions": []}
 
 
+def summarize_dialog(previous_summary, messages):
+    """Сворачивает старые реплики диалога (вместе с прошлым пересказом) в короткий пересказ."""
+    client = _get_client()
+    dialog = "\n".join(f"{'Гость' if m['role'] == 'user' else 'Nomi'}: {m['content']}" for m in messages)
+    prompt = (
+        f"Сожми диалог официанта Nomi с гостем в пересказ до 600 символов. "
+        f"Сохрани: предпочтения и ограничения гостя (аллергии, острое, бюджет, сколько человек), "
+        f"о чем договорились, что предлагали и от чего отказались.\n\n"
+        f"ПРЕДЫДУЩИЙ ПЕРЕСКАЗ:\n{previous_summary or '—'}\n\nНОВЫЕ РЕПЛИКИ:\n{dialog}"
+    )
+    res = client.chat.completions.create(
+        model="gpt-4o-mini", messages=[{"role": "system", "content": prompt}], temperature=0.2
+    )
+    return res.choices[0].message.content
+
+
 def generate_reminder(cart_context):
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))  # СОЗДАЕМ СИНХРОННОГО КЛИЕНТА
+    client = _get_client()
     prompt = f"Пользователь собрал корзину: {cart_context}, но молчит 2 минуты. Напиши короткое дерзкое напоминание оформить заказ."
     try:
         # Убрали await
@@ -111,7 +245,7 @@ def generate_reminder(cart_context):
 
 
 def get_upsell_recommendations(cart_dict, menu_items):
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))  # СОЗДАЕМ СИНХРОННОГО КЛИЕНТА
+    client = _get_client()
     # ... (логика upsell без изменений) ...
     # Копирую логику из вашего файла, чтобы не потерялась
     id_map = {str(m['id']): m for m in menu_items}
@@ -164,7 +298,7 @@ def get_upsell_recommendations(cart_dict, menu_items):
 
 
 def analyze_tables_for_waiter(orders_data):
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))  # СОЗДАЕМ СИНХРОННОГО КЛИЕНТА
+    client = _get_client()
     # ... (логика waiter без изменений, просто возвращаем пустой список если ошибка)
     if not orders_data: return []
     context_str = "\n".join(
@@ -0,0 +1,97 @@
+"""
+Просмотр журнала аудита для админки.
+
+GET /api/audit — события ресторана от новых к старым. Фильтры: actor_type, actor_id, action,
+order_id, from / to (ISO-дата или дата-время, UTC). Пагинация keyset: next_cursor из ответа
+передается как ?cursor= и превращается в условие (timestamp, id) < (ts, id), поэтому любая
+страница — это короткий проход по индексу (restaurant_id, timestamp) или (order_id, timestamp),
+без OFFSET по месяцам истории.
+"""
+import json
+import base64
+import datetime
+
+from flask import Blueprint, request, jsonify
+from flask_login import login_required, current_user
+from sqlalchemy import and_, or_
+
+from models import AuditLog
+from db_routing import read_session
+
+audit_bp = Blueprint('audit', __name__)
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def _parse_time(value):
+    """ISO-дата или дата-время -> naive UTC. Пусто -> None. Ошибка -> ValueError."""
+    if not value: return None
+    dt = datetime.datetime.fromisoformat(value)
+    if dt.tzinfo is not None: dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def encode_cursor(timestamp, row_id):
+    raw = json.dumps([timestamp.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    ts, row_id = json.loads(raw)
+    return _parse_time(ts), int(row_id)
+
+
+def _entry(log):
+    return {
+        "id": log.id,
+        "timestamp": log.timestamp.isoformat() if log.timestamp else None,
+        "order_id": log.order_id,
+        "actor_type": log.actor_type,
+        "actor_id": log.actor_id,
+        "action": log.action,
+        "details": log.details,
+        "payload": log.payload,
+    }
+
+
+@audit_bp.route("/api/audit")
+@login_required
+def audit_list():
+    if current_user.role == 'admin':
+        rid = current_user.restaurant_id
+    elif current_user.role == 'super_admin':
+        rid = request.args.get("restaurant_id", type=int)
+    else:
+        rid = None
+    if not rid: return jsonify({"error": "Доступ запрещен"}), 403
+
+    args = request.args
+    try:
+        date_from = _parse_time(args.get("from"))
+        date_to = _parse_time(args.get("to"))
+        cursor = decode_cursor(args["cursor"]) if args.get("cursor") else None
+    except (ValueError, TypeError):
+        return jsonify({"error": "Неверный from/to или cursor"}), 400
+    limit = min(max(args.get("limit", DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+
+    with read_session() as db:
+        query = db.query(AuditLog).filter(AuditLog.restaurant_id == rid)
+        if args.get("order_id"): query = query.filter(AuditLog.order_id == args.get("order_id", type=int))
+        for field in ("actor_type", "actor_id", "action"):
+            if args.get(field): query = query.filter(getattr(AuditLog, field) == args[field])
+        if date_from: query = query.filter(AuditLog.timestamp >= date_from)
+        if date_to: query = query.filter(AuditLog.timestamp < date_to)
+        if cursor:
+            ts, row_id = cursor
+            query = query.filter(or_(AuditLog.timestamp < ts, and_(AuditLog.timestamp == ts, AuditLog.id < row_id)))
+
+        rows = query.order_by(AuditLog.timestamp.desc(), AuditLog.id.desc()).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        "items": [_entry(log) for log in rows],
+        "next_cursor": encode_cursor(rows[-1].timestamp, rows[-1].id) if has_more else None,
+    })
@@ -0,0 +1,204 @@
+"""
+Асинхронная запись AuditLog пачками.
+
+log_audit больше не добавляет строку в транзакцию запроса: событие копится в session.info
+и после коммита кладется в кольцевой буфер (откат транзакции событие отбрасывает — как раньше
+строка откатывалась вместе с ней). Фоновый поток сбрасывает буфер многострочными INSERT
+раз в AUDIT_FLUSH_INTERVAL_MS или сразу, как накопится AUDIT_BATCH_SIZE событий.
+Стоимость аудита в запросе — добавление в deque.
+
+При остановке процесса буфер дописывается (atexit; для SIGTERM — install_signal_handlers()).
+Если БД долго недоступна и буфер переполнен, старые события вытесняются (счетчик dropped).
+Если пачку отвергла сама БД (ограничение, слишком длинное значение), она дописывается по строке:
+теряются только отвергнутые строки.
+AUDIT_ASYNC=0 — писать синхронно в транзакции запроса, как раньше.
+"""
+import os
+import sys
+import time
+import atexit
+import signal
+import logging
+import threading
+from collections import deque
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError, InterfaceError
+
+from models import SessionLocal, AuditLog, engine
+
+logger = logging.getLogger(__name__)
+
+AUDIT_ASYNC = os.getenv("AUDIT_ASYNC", "1") == "1"
+BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", 100000))
+BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", 500))
+FLUSH_INTERVAL = int(os.getenv("AUDIT_FLUSH_INTERVAL_MS", 200)) / 1000
+INSERT_CHUNK = 100  # Строк в одном INSERT ... VALUES (укладываемся в лимит параметров SQLite)
+MAX_FAILURES = 5  # Подряд неудачных сбросов, после которых пачка отбрасывается
+# БД недоступна (соединение, блокировка): пачку повторяем целиком, а не по строке
+UNAVAILABLE_ERRORS = (OperationalError, InterfaceError)
+
+
+class AuditWriter:
+    def __init__(self, buffer_size=BUFFER_SIZE, batch_size=BATCH_SIZE, interval=FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._buffer = deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()  # Один сброс за раз (фоновый поток или flush при остановке)
+        self._thread = None
+        self._failures = 0
+        self._counters = {"enqueued": 0, "written": 0, "dropped": 0, "batches": 0, "errors": 0}
+
+    def enqueue(self, rows):
+        with self._cond:
+            overflow = len(self._buffer) + len(rows) - self._buffer.maxlen
+            if overflow > 0:
+                self._counters["dropped"] += overflow
+                logger.error(f"Audit buffer overflow: dropped {overflow} events")
+            self._buffer.extend(rows)
+            self._counters["enqueued"] += len(rows)
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._thread: return
+        with self._cond:
+            if self._thread: return
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._buffer) < self.batch_size:
+                    self._cond.wait(self.interval)
+            self._write_pending()
+
+    def _take(self):
+        with self._cond:
+            n = min(len(self._buffer), self.batch_size)
+            return [self._buffer.popleft() for _ in range(n)]
+
+    def _insert(self, rows):
+        with engine.begin() as conn:
+            for i in range(0, len(rows), INSERT_CHUNK):
+                conn.execute(AuditLog.__table__.insert().values(rows[i:i + INSERT_CHUNK]))
+
+    def _insert_rows(self, rows):
+        """
+        По строке в своей транзакции; отвергнутые БД строки отбрасываются.
+        Возвращает (записано, незаписанный остаток, ошибка), если по дороге БД стала недоступна.
+        """
+        written = 0
+        for k, row in enumerate(rows):
+            try:
+                self._insert([row])
+            except UNAVAILABLE_ERRORS as e:
+                return written, rows[k:], e
+            except Exception as e:
+                with self._cond:
+                    self._counters["dropped"] += 1
+                logger.error(f"Audit row rejected, dropped: {row.get('action')} ({e})")
+            else:
+                written += 1
+        return written, [], None
+
+    def _requeue(self, rows):
+        """Возвращает rows в начало буфера. Места нет — теряем самые старые из них, а не свежие из буфера."""
+        room = self._buffer.maxlen - len(self._buffer)
+        if room < len(rows):
+            self._counters["dropped"] += len(rows) - room
+            logger.error(f"Audit buffer overflow: dropped {len(rows) - room} events")
+            rows = rows[len(rows) - room:]
+        self._buffer.extendleft(reversed(rows))
+
+    def _write_pending(self):
+        """Пишет все, что накопилось, пачками по batch_size. Возвращает False, если БД ответила ошибкой."""
+        with self._write_lock:
+            while True:
+                batch = self._take()
+                if not batch: return True
+                written, rest, error = len(batch), [], None
+                try:
+                    self._insert(batch)
+                except UNAVAILABLE_ERRORS as e:
+                    written, rest, error = 0, batch, e
+                except Exception as e:
+                    # Одну из строк отвергла БД — не терять из-за нее всю пачку
+                    logger.error(f"Audit batch rejected, writing row by row: {e}")
+                    written, rest, error = self._insert_rows(batch)
+                if written:
+                    with self._cond:
+                        self._counters["written"] += written
+                        self._counters["batches"] += 1
+                if not rest:
+                    self._failures = 0
+                    continue
+
+                self._failures += 1
+                with self._cond:
+                    self._counters["errors"] += 1
+                    if self._failures >= MAX_FAILURES:
+                        self._counters["dropped"] += len(rest)
+                        self._failures = 0
+                        logger.error(f"Audit write failed, dropped {len(rest)} events: {error}")
+                    else:
+                        # Вернем в начало буфера и попробуем на следующем цикле
+                        self._requeue(rest)
+                        logger.error(f"Audit write failed, will retry: {error}")
+                return False
+
+    def flush(self, attempts=3):
+        """Синхронно дописывает буфер (остановка процесса, тесты)."""
+        for _ in range(attempts):
+            if self._write_pending(): return True
+            time.sleep(0.1)
+        return False
+
+    def get_stats(self):
+        with self._cond:
+            return dict(self._counters, buffered=len(self._buffer))
+
+
+writer = AuditWriter()
+atexit.register(writer.flush)
+
+
+def record(db, row):
+    """Событие аудита в рамках транзакции db: попадет в буфер после ее коммита."""
+    if not AUDIT_ASYNC:
+        db.add(AuditLog(**row))
+        return
+    db.info.setdefault("audit_pending", []).append(row)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _enqueue_committed(session):
+    rows = session.info.pop("audit_pending", None)
+    if rows: writer.enqueue(rows)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop("audit_pending", None)
+
+
+def install_signal_handlers():
+    """SIGTERM/SIGINT -> штатный выход, чтобы atexit успел дописать буфер. Только из главного потока."""
+
+    def handler(signum, frame):
+        writer.flush()
+        sys.exit(0)
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, handler)
+
+
+def flush():
+    return writer.flush()
+
+
+def get_stats():
+    return writer.get_stats()
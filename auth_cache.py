@@ -0,0 +1,96 @@
+"""
+Кэш пользователей для Flask-Login.
+
+load_user вызывается на каждый запрос авторизованного сотрудника, а админка и экран официанта
+опрашивают API каждые несколько секунд. Вместо User + joinedload(restaurant) из БД отдаем
+неизменяемый Principal из кэша процесса.
+
+Запись живет AUTH_CACHE_TTL секунд и хранит версию: invalidate_user / invalidate_restaurant
+поднимают версию, и следующая загрузка идет в БД. Неактивные пользователи не загружаются вовсе.
+
+Версии — в памяти процесса. Деактивация, смена пароля или удаление сотрудника действуют сразу
+в воркере, который их выполнил, а в остальных — не позже чем через AUTH_CACHE_TTL (по умолчанию
+5 с). Этого хватает, чтобы серия запросов одной страницы и частые опросы шли из кэша.
+"""
+import os
+import time
+import threading
+from collections import namedtuple
+
+from flask_login import UserMixin
+from sqlalchemy.orm import joinedload
+
+from models import SessionLocal, User
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 5))  # Граница рассинхрона между воркерами, сек
+
+RestaurantInfo = namedtuple("RestaurantInfo", "id name slug admin_secret_link")
+
+
+class Principal(UserMixin):
+    """Снимок пользователя для current_user. Только чтение: правки — через модель User в сессии БД."""
+    __slots__ = ("id", "username", "role", "restaurant_id", "restaurant")
+
+    def __init__(self, user):
+        set_ = object.__setattr__
+        set_(self, "id", user.id)
+        set_(self, "username", user.username)
+        set_(self, "role", user.role)
+        set_(self, "restaurant_id", user.restaurant_id)
+        r = user.restaurant
+        set_(self, "restaurant", RestaurantInfo(r.id, r.name, r.slug, r.admin_secret_link) if r else None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Principal is read-only")
+
+    def __repr__(self):
+        return f"<Principal {self.id} {self.role}>"
+
+
+_lock = threading.Lock()
+_cache = {}  # user_id -> (principal|None, version, expires_at)
+_user_versions = {}  # user_id -> version
+_restaurant_users = {}  # restaurant_id -> {user_id}
+_version = [0]
+
+
+def load_principal(user_id):
+    user_id = int(user_id)
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(user_id)
+        version = _user_versions.get(user_id, 0)
+        if entry and entry[1] == version and entry[2] > now:
+            return entry[0]
+
+    with SessionLocal() as db:
+        user = db.query(User).options(joinedload(User.restaurant)).get(user_id)
+        # Деактивированный сотрудник теряет доступ (None -> Flask-Login считает запрос анонимным)
+        principal = Principal(user) if user and user.is_active else None
+
+    with _lock:
+        # Пока ходили в БД, запись могли инвалидировать — тогда не кладем устаревшие данные
+        if _user_versions.get(user_id, 0) == version:
+            _cache[user_id] = (principal, version, now + AUTH_CACHE_TTL)
+            if principal and principal.restaurant_id:
+                _restaurant_users.setdefault(principal.restaurant_id, set()).add(user_id)
+    return principal
+
+
+def _bump(user_id):
+    _version[0] += 1
+    _user_versions[user_id] = _version[0]
+    _cache.pop(user_id, None)
+
+
+def invalidate_user(user_id):
+    """Изменение/удаление сотрудника, смена пароля."""
+    with _lock:
+        _bump(int(user_id))
+
+
+def invalidate_restaurant(restaurant_id):
+    """Удаление/изменение ресторана: сбрасываем всех его сотрудников."""
+    with _lock:
+        for user_id in _restaurant_users.pop(int(restaurant_id), set()):
+            _bump(user_id)
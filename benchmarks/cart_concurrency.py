@@ -0,0 +1,174 @@
+"""
+Конкурентная работа с корзиной: пропускная способность /api/cart/update при разных профилях БД.
+
+Каждый гость в своем потоке добавляет/убирает блюда (столы общие — гости одного стола
+пишут в один заказ), параллельно читатели листают журнал аудита админки. База — свежий
+SQLite-файл во временном каталоге, приложение вызывается в процессе (Flask test client),
+поэтому замеряется именно работа с БД, без сети.
+
+  python benchmarks/cart_concurrency.py --compare             # plain против tuned
+  DB_PROFILE=tuned python benchmarks/cart_concurrency.py --guests 16 --requests 2000
+
+--compare запускает по подпроцессу на профиль (движок создается при импорте models).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def percentile(values, p):
+    if not values: return None
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+def seed(tables):
+    from models import SessionLocal, Base, engine, Restaurant, Table, MenuItem, Category, User
+    Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        r = Restaurant(name="Bench", slug="bench", table_count=tables, admin_secret_link="bench")
+        db.add(r)
+        db.flush()
+        drinks = Category(name="Напитки", restaurant_id=r.id)
+        food = Category(name="Пицца", restaurant_id=r.id)
+        db.add_all([drinks, food])
+        db.flush()
+        item_ids = []
+        for name, price, category in [("Пепперони", 2500, food), ("Маргарита", 2200, food),
+                                      ("Кола", 500, drinks), ("Вода", 300, drinks)]:
+            m = MenuItem(name=name, price=price, restaurant_id=r.id)
+            m.categories.append(category)
+            db.add(m)
+            db.flush()
+            item_ids.append(m.id)
+        for i in range(1, tables + 1):
+            db.add(Table(restaurant_id=r.id, number=i, public_token=f"bench-{i}"))
+        admin = User(username="bench-admin", role="admin", restaurant_id=r.id)
+        admin.set_password("bench")
+        db.add(admin)
+        db.commit()
+        return r.id, item_ids
+
+
+def run_guest(client, n, rid, token, item_ids, budget, results, lock):
+    guest = f"guest-{n}"
+    sent = 0
+    while True:
+        with lock:
+            if budget[0] <= 0: return
+            budget[0] -= 1
+        sent += 1
+        if sent % 50 == 0: guest = f"guest-{n}-{sent}"  # Не упираемся в лимит 100/мин на гостя
+        started = time.perf_counter()
+        res = client.post("/api/cart/update", headers={"Guest-Token": guest}, json={
+            "restaurant_id": rid, "table_token": token, "item_id": random.choice(item_ids),
+            "action": "add" if random.random() < 0.7 else "remove"},
+            environ_base={"REMOTE_ADDR": f"10.{n % 256}.{sent // 256 % 256}.{sent % 256}"})
+        elapsed = time.perf_counter() - started
+        with lock:
+            if res.status_code == 200:
+                results["latency"].append(elapsed)
+            else:
+                results["errors"][str(res.status_code)] = results["errors"].get(str(res.status_code), 0) + 1
+
+
+def run_reader(client, stop, results, lock):
+    client.post("/login", data={"username": "bench-admin", "password": "bench"})
+    while not stop.is_set():
+        res = client.get("/api/audit?limit=50")
+        with lock:
+            results["reads"] += 1 if res.status_code == 200 else 0
+
+
+def bench(args):
+    import app as appmod
+    import audit_writer
+    import db_profile
+    from models import engine
+
+    random.seed(args.seed)
+    rid, item_ids = seed(args.tables)
+    results = {"latency": [], "errors": {}, "reads": 0}
+    lock = threading.Lock()
+    budget = [args.requests]
+    stop = threading.Event()
+
+    readers = [threading.Thread(target=run_reader, args=(appmod.app.test_client(), stop, results, lock))
+               for _ in range(args.readers)]
+    guests = [threading.Thread(target=run_guest, args=(
+        appmod.app.test_client(), n, rid, f"bench-{n % args.tables + 1}", item_ids, budget, results, lock))
+        for n in range(args.guests)]
+
+    started = time.perf_counter()
+    for t in readers + guests: t.start()
+    for t in guests: t.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for t in readers: t.join()
+    audit_writer.flush()
+
+    latency = results["latency"]
+    return {
+        "profile": db_profile.DB_PROFILE,
+        "journal_mode": db_profile.describe(engine).get("journal_mode"),
+        "guests": args.guests, "readers": args.readers, "requests": args.requests,
+        "ok": len(latency), "errors": results["errors"], "reads": results["reads"],
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(latency) / elapsed, 1) if elapsed else 0,
+        "p50_ms": round(statistics.median(latency) * 1000, 1) if latency else None,
+        "p95_ms": round(percentile(latency, 95) * 1000, 1) if latency else None,
+        "p99_ms": round(percentile(latency, 99) * 1000, 1) if latency else None,
+    }
+
+
+def compare(args):
+    rows = []
+    for profile in ("plain", "tuned"):
+        env = dict(os.environ, DB_PROFILE=profile, IDEMPOTENCY_BACKEND="memory", RATE_LIMIT_BACKEND="memory")
+        cmd = [sys.executable, os.path.abspath(__file__), "--json", "--guests", str(args.guests),
+               "--readers", str(args.readers), "--requests", str(args.requests),
+               "--tables", str(args.tables), "--seed", str(args.seed)]
+        out = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True).stdout
+        rows.append(json.loads(out.strip().splitlines()[-1]))
+    for r in rows:
+        print(f"{r['profile']:>6} ({r['journal_mode']}): {r['throughput_rps']:>7} rps  p50 {r['p50_ms']} ms  "
+              f"p95 {r['p95_ms']} ms  p99 {r['p99_ms']} ms  ok {r['ok']}/{r['requests']}  errors {r['errors']}  "
+              f"reads {r['reads']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Конкурентные изменения корзины: профили БД")
+    parser.add_argument("--guests", type=int, default=16, help="Потоков-гостей")
+    parser.add_argument("--readers", type=int, default=4, help="Потоков, читающих журнал аудита")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--tables", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--compare", action="store_true", help="Прогнать DB_PROFILE=plain и tuned")
+    parser.add_argument("--json", action="store_true", help="Вывести итог в JSON")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args)
+        return
+
+    # Всегда свежая база во временном каталоге: restaurant.db бенчмарк не трогает
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+        os.chdir(tmp)
+        sys.path.insert(0, ROOT)
+        summary = bench(args)
+    print(json.dumps(summary, ensure_ascii=False) if args.json else json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
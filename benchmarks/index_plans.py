@@ -0,0 +1,169 @@
+"""
+Планы и время горячих запросов до и после миграции 007 (составные и частичные индексы).
+
+Схема поднимается Alembic до 006, заполняется синтетикой (рестораны, столы, заказы, позиции,
+чат, вызовы), горячие запросы прогоняются с EXPLAIN и замером; затем upgrade до 007 и повтор.
+
+  python benchmarks/index_plans.py                          # временный SQLite, 200k заказов
+  python benchmarks/index_plans.py --orders 1000000
+  python benchmarks/index_plans.py --database-url postgresql://.../empty_db
+
+--database-url — только пустая база: скрипт сам создает схему и данные.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+CLOSED = ("CANCELED", "SUCCESSFULLY_DELIVERED")
+STATUSES = ["BASKET_ASSEMBLY", "IN_PROGRESS", "DELIVERY"] + ["SUCCESSFULLY_DELIVERED"] * 12 + ["CANCELED"] * 2
+
+# Запросы в том виде, в каком их строят services.py / floor_view.py / app.py
+QUERIES = {
+    "active order by table": (
+        "SELECT id FROM orders WHERE restaurant_id = :rid AND table_id = :table_id "
+        "AND status NOT IN ('CANCELED', 'SUCCESSFULLY_DELIVERED') LIMIT 1"),
+    "draft by table": (
+        "SELECT id FROM orders WHERE table_id = :table_id AND status = 'BASKET_ASSEMBLY' LIMIT 1"),
+    "open orders of restaurant": (
+        "SELECT id FROM orders WHERE restaurant_id = :rid AND status NOT IN ('CANCELED', 'SUCCESSFULLY_DELIVERED')"),
+    "draft by telegram chat": (
+        "SELECT id FROM orders WHERE telegram_chat_id = :chat AND status = 'BASKET_ASSEMBLY' ORDER BY id DESC LIMIT 1"),
+    "chat history": (
+        "SELECT sender, content FROM chat_messages WHERE order_id = :order_id ORDER BY timestamp"),
+    "unpaid cart line": (
+        "SELECT id FROM order_items WHERE order_id = :order_id AND menu_item_id = :menu_item_id AND is_paid = false"),
+    "items of order": (
+        "SELECT id, quantity FROM order_items WHERE order_id = :order_id"),
+    "active menu": (
+        "SELECT id, name FROM menu_items WHERE restaurant_id = :rid AND is_active = true ORDER BY sort_order"),
+    "active signals": (
+        "SELECT id FROM service_signals WHERE restaurant_id = :rid AND is_active = true"),
+}
+
+
+def migrate(revision):
+    from alembic import command
+    from alembic.config import Config
+    cfg = Config(os.path.join(ROOT, "alembic.ini"))
+    cfg.set_main_option("script_location", os.path.join(ROOT, "migrations"))
+    command.upgrade(cfg, revision)
+
+
+def fill(engine, args):
+    from sqlalchemy import text
+    rnd = random.Random(args.seed)
+    now = datetime.datetime(2026, 6, 1)
+    tables_per = args.tables
+    with engine.begin() as conn:
+        for rid in range(1, args.restaurants + 1):
+            conn.execute(text("INSERT INTO restaurants (id, name, slug, table_count, admin_secret_link, menu_version) "
+                              "VALUES (:id, :name, :slug, :n, :secret, 0)"),
+                         dict(id=rid, name=f"R{rid}", slug=f"r{rid}", n=tables_per, secret=f"s{rid}"))
+        conn.execute(text("INSERT INTO tables (id, restaurant_id, number, public_token, is_active) "
+                          "VALUES (:id, :rid, :number, :token, true)"),
+                     [dict(id=(rid - 1) * tables_per + n, rid=rid, number=n, token=f"t{rid}-{n}")
+                      for rid in range(1, args.restaurants + 1) for n in range(1, tables_per + 1)])
+        conn.execute(text("INSERT INTO menu_items (id, name, price, restaurant_id, is_active, sort_order) "
+                          "VALUES (:id, :name, :price, :rid, :active, :sort)"),
+                     [dict(id=(rid - 1) * 60 + k, name=f"Item {k}", price=100 + k, rid=rid, active=k % 7 != 0, sort=k)
+                      for rid in range(1, args.restaurants + 1) for k in range(1, 61)])
+        conn.execute(text("INSERT INTO service_signals (restaurant_id, table_number, is_active, created_at) "
+                          "VALUES (:rid, :n, :active, :ts)"),
+                     [dict(rid=rnd.randint(1, args.restaurants), n=rnd.randint(1, tables_per),
+                           active=rnd.random() < 0.01, ts=now) for _ in range(args.orders // 10)])
+
+    batch = 20000
+    order_id = item_id = 0
+    for start in range(0, args.orders, batch):
+        orders, items, chat = [], [], []
+        for _ in range(min(batch, args.orders - start)):
+            order_id += 1
+            rid = rnd.randint(1, args.restaurants)
+            table = rnd.randint(1, tables_per)
+            created = now - datetime.timedelta(minutes=args.orders - order_id)
+            orders.append(dict(id=order_id, rid=rid, table_id=(rid - 1) * tables_per + table, table_number=table,
+                               status=rnd.choice(STATUSES), total=0.0, ts=created,
+                               chat=f"tg{rnd.randint(1, args.orders // 20)}" if rnd.random() < 0.1 else None))
+            for _ in range(rnd.randint(1, 5)):
+                item_id += 1
+                items.append(dict(id=item_id, order_id=order_id, menu_item_id=(rid - 1) * 60 + rnd.randint(1, 60),
+                                  qty=rnd.randint(1, 3), paid=rnd.random() < 0.5))
+            for k in range(rnd.randint(0, 4)):
+                chat.append(dict(order_id=order_id, sender="user" if k % 2 == 0 else "bot", content="...",
+                                 ts=created + datetime.timedelta(seconds=k)))
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO orders (id, restaurant_id, table_id, table_number, status, total_price, created_at, "
+                "updated_at, telegram_chat_id, is_bot_active, reminder_sent, rolled_up) "
+                "VALUES (:id, :rid, :table_id, :table_number, :status, :total, :ts, :ts, :chat, true, false, true)"),
+                orders)
+            conn.execute(text("INSERT INTO order_items (id, order_id, menu_item_id, quantity, is_paid) "
+                              "VALUES (:id, :order_id, :menu_item_id, :qty, :paid)"), items)
+            if chat:
+                conn.execute(text("INSERT INTO chat_messages (order_id, sender, message_type, content, timestamp) "
+                                  "VALUES (:order_id, :sender, 'text', :content, :ts)"), chat)
+    return order_id
+
+
+def run_queries(engine, args, max_order):
+    from sqlalchemy import text
+    rnd = random.Random(args.seed + 1)
+    sqlite = engine.dialect.name == "sqlite"
+    results = {}
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE"))
+        for name, sql in QUERIES.items():
+            samples = [dict(rid=rnd.randint(1, args.restaurants), table_id=rnd.randint(1, args.restaurants * args.tables),
+                            chat=f"tg{rnd.randint(1, max(1, args.orders // 20))}", order_id=rnd.randint(1, max_order),
+                            menu_item_id=rnd.randint(1, args.restaurants * 60)) for _ in range(args.repeat)]
+            params = {k: v for k, v in samples[0].items() if f":{k}" in sql}
+            plan_sql = ("EXPLAIN QUERY PLAN " if sqlite else "EXPLAIN ") + sql
+            plan = [str(row[-1]) for row in conn.execute(text(plan_sql), params)]
+            started = time.perf_counter()
+            for p in samples:
+                conn.execute(text(sql), {k: v for k, v in p.items() if f":{k}" in sql}).fetchall()
+            results[name] = (plan, (time.perf_counter() - started) / args.repeat * 1000)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Горячие запросы до и после индексов миграции 007")
+    parser.add_argument("--database-url", help="Пустая база (по умолчанию — временный SQLite)")
+    parser.add_argument("--orders", type=int, default=200000)
+    parser.add_argument("--restaurants", type=int, default=20)
+    parser.add_argument("--tables", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=200, help="Запусков каждого запроса")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tmp.name}/bench.db"
+    os.chdir(tmp.name)
+    sys.path.insert(0, ROOT)
+    from models import engine
+
+    migrate("006")
+    started = time.perf_counter()
+    max_order = fill(engine, args)
+    print(f"Данные: {args.orders} заказов за {time.perf_counter() - started:.1f} с ({engine.dialect.name})")
+
+    before = run_queries(engine, args, max_order)
+    migrate("007")
+    after = run_queries(engine, args, max_order)
+
+    for name in QUERIES:
+        (plan_before, ms_before), (plan_after, ms_after) = before[name], after[name]
+        print(f"\n{name}: {ms_before:.3f} ms -> {ms_after:.3f} ms")
+        print("  до:    " + " | ".join(plan_before))
+        print("  после: " + " | ".join(plan_after))
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Нагрузочный прогон чата: гости пишут в /api/chat, замеряем время до ответа бота в истории.
+
+Запуск офлайн (без трат на API):
+  python stub_server.py --latency lognormal:900:0.4 --seed 1 &
+  OPENAI_BASE_URL=http://127.0.0.1:8800/v1 OPENAI_API_KEY=stub python app.py &
+  python benchmarks/replay_load.py --restaurant-id 1 --concurrency 20 --requests 200
+
+Сообщения берутся из --messages (txt по строке или JSONL с полем "message"), либо из записей
+stub_server.py --record (поле request.messages) — так прогон повторяет реальный трафик.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import statistics
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+DEFAULT_MESSAGES = [
+    "добавь 2 пепперони", "убери колу", "сколько с меня", "что посоветуешь к пиву?",
+    "нас 4 человека, что взять?", "хочу что-нибудь острое", "очисти корзину", "есть десерты?",
+]
+
+
+def load_messages(path):
+    if not path: return DEFAULT_MESSAGES
+    messages = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            if not line.startswith("{"):
+                messages.append(line)
+                continue
+            rec = json.loads(line)
+            if "message" in rec:
+                messages.append(rec["message"])
+            elif rec.get("service") == "openai":
+                # Запись stub_server: берем последнюю реплику гостя
+                msgs = rec.get("request", {}).get("messages", [])
+                text = next((m["content"] for m in reversed(msgs) if m.get("role") == "user"), None)
+                if text: messages.append(text)
+    return messages or DEFAULT_MESSAGES
+
+
+def load_table_tokens(restaurant_id):
+    from models import SessionLocal, Table
+    with SessionLocal() as db:
+        return [t.public_token for t in db.query(Table).filter_by(restaurant_id=restaurant_id, is_active=True).all()]
+
+
+def percentile(values, p):
+    if not values: return None
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+def run_guest(args, token, messages, budget, results, lock):
+    session = requests.Session()
+    history_url = f"{args.base_url}/api/chat/history"
+    while True:
+        with lock:
+            if budget[0] <= 0: return
+            budget[0] -= 1
+        text = random.choice(messages)
+
+        def bot_count():
+            r = session.get(history_url, params={"restaurant_id": args.restaurant_id, "table_token": token}, timeout=10)
+            return sum(1 for m in r.json().get("messages", []) if m["sender"] == "bot")
+
+        try:
+            before = bot_count()
+            started = time.perf_counter()
+            res = session.post(f"{args.base_url}/api/chat", timeout=10, json={
+                "message": text, "restaurant_id": args.restaurant_id, "table_token": token})
+            accepted = time.perf_counter() - started
+            if res.status_code != 200:
+                with lock: results["errors"] += 1
+                continue
+
+            deadline = started + args.timeout
+            while time.perf_counter() < deadline:
+                if bot_count() > before: break
+                time.sleep(args.poll_interval)
+            else:
+                with lock: results["timeouts"] += 1
+                continue
+
+            with lock:
+                results["accept"].append(accepted)
+                results["reply"].append(time.perf_counter() - started)
+        except requests.RequestException:
+            with lock: results["errors"] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон AI-чата")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--restaurant-id", type=int, required=True)
+    parser.add_argument("--concurrency", type=int, default=10, help="Одновременных гостей (по одному на стол)")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--messages", help="txt/JSONL с сообщениями или запись stub_server --record")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--poll-interval", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Вывести итог в JSON")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    messages = load_messages(args.messages)
+    tokens = load_table_tokens(args.restaurant_id)[:args.concurrency]
+    if not tokens:
+        sys.exit("Нет активных столов у ресторана")
+
+    results = {"accept": [], "reply": [], "errors": 0, "timeouts": 0}
+    lock = threading.Lock()
+    budget = [args.requests]
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=run_guest, args=(args, t, messages, budget, results, lock)) for t in tokens]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - started
+
+    reply = results["reply"]
+    summary = {
+        "guests": len(tokens), "requests": args.requests, "completed": len(reply),
+        "errors": results["errors"], "timeouts": results["timeouts"],
+        "elapsed_s": round(elapsed, 2), "throughput_rps": round(len(reply) / elapsed, 2) if elapsed else 0,
+        "accept_p50_ms": round(statistics.median(results["accept"]) * 1000, 1) if results["accept"] else None,
+        "reply_p50_ms": round(percentile(reply, 50) * 1000, 1) if reply else None,
+        "reply_p95_ms": round(percentile(reply, 95) * 1000, 1) if reply else None,
+        "reply_p99_ms": round(percentile(reply, 99) * 1000, 1) if reply else None,
+    }
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False))
+    else:
+        for k, v in summary.items(): print(f"{k:>16}: {v}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Состояние диалога с AI по заказу (таблица conversation_states).
+
+Вместо того чтобы на каждое сообщение перечитывать заказ, позиции, последние ChatMessage и все меню,
+ход AI начинается с одного запроса: заказ + состояние диалога + версия меню ресторана.
+Корзина берется из Order.cart_digest, меню — из кэша services.get_menu_snapshot по версии.
+Длинные диалоги не обрезаются, а сворачиваются в краткий пересказ (summary).
+"""
+import os
+import json
+import logging
+import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from models import Order, ChatMessage, Restaurant, ConversationState
+from services import get_cart_digest
+import assistant
+
+logger = logging.getLogger(__name__)
+
+RECENT_MAX = assistant.MAX_HISTORY_MESSAGES  # Сколько последних реплик держим дословно
+RECENT_KEEP = int(os.getenv("AI_RECENT_KEEP", 4))  # Сколько остается после сворачивания в summary
+SUMMARY_MAX_CHARS = int(os.getenv("AI_SUMMARY_MAX_CHARS", 1500))
+
+
+def load_turn_context(db, order_id, user_text=None):
+    """
+    Один запрос на ход: (order, state, menu_version). Если состояния еще нет (первый ход
+    или старый заказ) — создаем его из последних сообщений чата и сразу коммитим: два сообщения
+    подряд не должны создавать его дважды.
+    Возвращает (order, state, cart_dict, history, menu_version) или None.
+    """
+    row = db.query(Order, ConversationState, Restaurant.menu_version) \
+        .join(Restaurant, Restaurant.id == Order.restaurant_id) \
+        .outerjoin(ConversationState, ConversationState.order_id == Order.id) \
+        .filter(Order.id == order_id).first()
+    if not row: return None
+    order, state, menu_version = row
+
+    if state is None:
+        history_objs = db.query(ChatMessage).filter(ChatMessage.order_id == order.id) \
+            .order_by(ChatMessage.timestamp.desc()).limit(RECENT_MAX + 1).all()
+        # Текущее сообщение гостя уже сохранено в /api/chat — в историю его не дублируем
+        if history_objs and history_objs[0].sender == 'user' and history_objs[0].content == user_text:
+            history_objs = history_objs[1:]
+        history = [{"role": "assistant" if m.sender == 'bot' else "user", "content": m.content}
+                   for m in reversed(history_objs[:RECENT_MAX])]
+        state = ConversationState(order_id=order.id, recent_messages=json.dumps(history, ensure_ascii=False),
+                                  turn_count=0, menu_version=menu_version)
+        db.add(state)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Параллельный первый ход успел создать состояние — берем его
+            db.rollback()
+            state = db.get(ConversationState, order_id)
+            if state is None: return None  # Заказ удалили
+            history = json.loads(state.recent_messages or "[]")
+    else:
+        history = json.loads(state.recent_messages or "[]")
+
+    return order, state, get_cart_digest(order), history, menu_version
+
+
+def record_turn(db, state, user_text, bot_text, menu_version):
+    """
+    Добавляет реплики хода в состояние. Возвращает реплики, которые пора свернуть в summary
+    (пачкой раз в несколько ходов, чтобы не звать LLM на каждое сообщение), или [].
+    Состояние перечитывается с блокировкой строки в транзакции записи: параллельный ход того же
+    заказа мог дописать свои реплики, пока шел вызов LLM. Коммит — на вызывающем.
+    """
+    db.refresh(state, with_for_update=True)
+    messages = json.loads(state.recent_messages or "[]")
+    messages.append({"role": "user", "content": user_text})
+    messages.append({"role": "assistant", "content": bot_text})
+
+    overflow = []
+    if len(messages) > RECENT_MAX:
+        overflow, messages = messages[:-RECENT_KEEP], messages[-RECENT_KEEP:]
+
+    state.recent_messages = json.dumps(messages, ensure_ascii=False)
+    state.turn_count = (state.turn_count or 0) + 1
+    state.menu_version = menu_version
+    state.updated_at = datetime.datetime.now(datetime.timezone.utc)
+    return overflow
+
+
+def _fallback_summary(previous, messages):
+    lines = [f"{'Гость' if m['role'] == 'user' else 'Nomi'}: {m['content'][:120]}" for m in messages]
+    return "\n".join(filter(None, [previous] + lines))
+
+
+def fold_into_summary(state, overflow):
+    """Сворачивает старые реплики в пересказ. Размер summary ограничен SUMMARY_MAX_CHARS."""
+    if not overflow: return
+    summary = None
+    try:
+        summary = assistant.summarize_dialog(state.summary, overflow)
+    except Exception as e:
+        logger.error(f"Summary Error: {e}")
+    if not summary:
+        summary = _fallback_summary(state.summary, overflow)
+    # Держим свежий конец пересказа
+    state.summary = summary[-SUMMARY_MAX_CHARS:]
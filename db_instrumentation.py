@@ -0,0 +1,128 @@
+"""
+Учет SQL-запросов: сколько запросов и времени БД ушло на HTTP-запрос, N+1 и медленные запросы.
+
+Хуки before/after_cursor_execute на всех Engine (основная база и реплика). Внутри HTTP-запроса
+запросы копятся в сборщике текущего контекста (contextvars — фоновые потоки не смешиваются):
+  - одинаковый SQL (форма с ?-параметрами) >= DB_N_PLUS_ONE_THRESHOLD раз за запрос —
+    предупреждение "N+1" с эндпоинтом и текстом запроса;
+  - в debug (или DB_INSTRUMENTATION_HEADERS=1) — заголовки ответа X-DB-Queries и X-DB-Time (мс).
+Медленный запрос (>= DB_SLOW_QUERY_MS) логируется с параметрами всегда, в том числе вне HTTP.
+
+Для проверок в скриптах и тестах:
+    with assert_max_queries(3):
+        client.get("/api/r/1/menu")
+DB_INSTRUMENTATION=0 — не вешать хуки.
+"""
+import os
+import time
+import logging
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+DB_INSTRUMENTATION = os.getenv("DB_INSTRUMENTATION", "1") == "1"
+DB_INSTRUMENTATION_HEADERS = os.getenv("DB_INSTRUMENTATION_HEADERS", "0") == "1"
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 200))
+DB_N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", 5))
+PARAMS_LOG_LIMIT = 500  # Символов параметров в логе медленного запроса
+
+_collectors = contextvars.ContextVar("db_collectors", default=())
+
+
+class QueryCollector:
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements = Counter()
+
+    def add(self, statement, elapsed):
+        self.count += 1
+        self.time += elapsed
+        self.statements[statement] += 1
+
+    def repeated(self, threshold=DB_N_PLUS_ONE_THRESHOLD):
+        """[(statement, раз)] — формы SQL, выполненные threshold и более раз."""
+        return [(s, n) for s, n in self.statements.most_common() if n >= threshold]
+
+
+@contextmanager
+def collect():
+    """Сборщик запросов на время блока (вложенные блоки считают каждый свое)."""
+    collector = QueryCollector()
+    token = _collectors.set(_collectors.get() + (collector,))
+    try:
+        yield collector
+    finally:
+        _collectors.reset(token)
+
+
+@contextmanager
+def assert_max_queries(n):
+    """AssertionError, если в блоке выполнено больше n SQL-запросов (список запросов — в сообщении)."""
+    with collect() as collector:
+        yield collector
+    if collector.count > n:
+        lines = "\n".join(f"  {times}x {statement}" for statement, times in collector.statements.most_common())
+        raise AssertionError(f"Expected at most {n} queries, got {collector.count}:\n{lines}")
+
+
+def _short(statement):
+    return " ".join(statement.split())[:300]
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    for collector in _collectors.get():
+        collector.add(statement, elapsed)
+    if elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        logger.warning(f"Slow query {elapsed * 1000:.0f} ms: {_short(statement)} "
+                       f"params={repr(parameters)[:PARAMS_LOG_LIMIT]}")
+
+
+def _on_error(context):
+    # after_cursor_execute после ошибки не вызывается — снимаем отметку времени здесь
+    stack = context.connection.info.get("query_started") if context.connection is not None else None
+    if stack: stack.pop()
+
+
+def _start_request():
+    g.db_queries = QueryCollector()
+    g.db_collect_token = _collectors.set(_collectors.get() + (g.db_queries,))
+
+
+def _finish_request(response):
+    collector = g.get("db_queries")
+    if collector is None: return response
+    for statement, times in collector.repeated():
+        logger.warning(f"N+1 in {request.method} {request.endpoint}: {times}x {_short(statement)}")
+    if DB_INSTRUMENTATION_HEADERS or current_app.debug:
+        response.headers["X-DB-Queries"] = str(collector.count)
+        response.headers["X-DB-Time"] = f"{collector.time * 1000:.1f}"
+    return response
+
+
+def _end_request(exc):
+    # teardown вызывается и после необработанного исключения, когда after_request уже не придет
+    token = g.pop("db_collect_token", None)
+    if token is not None: _collectors.reset(token)
+
+
+def init_app(app):
+    if not DB_INSTRUMENTATION: return
+    event.listen(Engine, "before_cursor_execute", _before_execute)
+    event.listen(Engine, "after_cursor_execute", _after_execute)
+    event.listen(Engine, "handle_error", _on_error)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
@@ -0,0 +1,98 @@
+"""
+Профили движка БД: параметры create_engine и настройки соединения по типу базы.
+
+SQLite (по умолчанию в проде):
+  journal_mode=WAL       — читатели не ждут писателя, писатель не ждет читателей;
+  synchronous=NORMAL     — в WAL fsync только на чекпоинте (коммит не теряет целостность);
+  busy_timeout           — конкурирующий писатель ждет замок, а не падает с "database is locked";
+  mmap_size, cache_size  — страницы читаются через mmap и кэшируются в соединении;
+  temp_store=MEMORY      — временные таблицы сортировок/GROUP BY в памяти.
+Postgres: пул (pool_size / max_overflow / pool_timeout), pre-ping от «мертвых» соединений после
+рестарта базы или балансировщика, pool_recycle и statement_timeout на уровне соединения.
+
+DB_PROFILE=plain — create_engine со значениями по умолчанию, как было раньше (для сравнения,
+см. benchmarks/cart_concurrency.py). Остальные параметры — переменные окружения ниже.
+"""
+import os
+
+from sqlalchemy import event
+
+DB_PROFILE = os.getenv("DB_PROFILE", "tuned")
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 64 * 1024))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 10))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 15000))
+
+
+def _is_sqlite(url):
+    return str(url).startswith("sqlite")
+
+
+def _is_postgres(url):
+    return str(url).startswith("postgres")
+
+
+def engine_kwargs(url):
+    """Аргументы create_engine для url с учетом DB_PROFILE."""
+    # check_same_thread нужен ТОЛЬКО для SQLite
+    connect_args = {"check_same_thread": False} if _is_sqlite(url) else {}
+    if DB_PROFILE == "plain":
+        return {"connect_args": connect_args}
+
+    if _is_sqlite(url):
+        # Замок ждет SQLite (busy_timeout); таймаут драйвера выставляем тем же значением
+        connect_args["timeout"] = SQLITE_BUSY_TIMEOUT_MS / 1000
+        return {"connect_args": connect_args}
+
+    kwargs = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+        "connect_args": connect_args,
+    }
+    if _is_postgres(url) and DB_STATEMENT_TIMEOUT_MS:
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    return kwargs
+
+
+def sqlite_pragmas():
+    return [
+        "PRAGMA journal_mode=WAL",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+
+def configure(engine):
+    """Вешает настройку соединений на engine (для SQLite — PRAGMA на каждое новое соединение)."""
+    if DB_PROFILE == "plain" or not _is_sqlite(engine.url): return
+    if engine.url.database in (None, "", ":memory:"): return  # WAL к базе в памяти неприменим
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_conn, record):
+        cursor = dbapi_conn.cursor()
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def describe(engine):
+    """Фактические настройки (для /api/super/metrics и бенчмарка)."""
+    info = {"profile": DB_PROFILE, "dialect": engine.dialect.name, "pool": engine.pool.status()}
+    if _is_sqlite(engine.url):
+        with engine.connect() as conn:
+            for name in ("journal_mode", "synchronous", "busy_timeout", "mmap_size", "cache_size"):
+                info[name] = conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+    return info
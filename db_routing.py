@@ -0,0 +1,150 @@
+"""
+Маршрутизация чтения: GET-эндпоинты читают с реплики (READ_REPLICA_URL), запись — всегда SessionLocal.
+
+read_session() отдает сессию только для чтения (flush запрещен) на реплике, если:
+  - реплика настроена;
+  - ее отставание не больше READ_REPLICA_MAX_LAG секунд (проверка раз в READ_REPLICA_CHECK_INTERVAL,
+    ошибка соединения = реплика недоступна до следующей проверки);
+  - клиент недавно ничего не записывал (read-your-writes, см. ниже).
+Иначе та же сессия только для чтения, но на основной базе.
+
+Read-your-writes: запрос, закоммитивший изменения через SessionLocal, ставит куку db_sticky
+на READ_YOUR_WRITES_SECONDS — следующие чтения этого браузера (гость или персонал) идут на
+основную базу, пока реплика не догонит. Внутри самого запроса после записи — тоже основная.
+
+floor_view и KDS читают свой снимок с основной базы: он строится по событиям коммита.
+"""
+import os
+import time
+import logging
+import threading
+
+from flask import request, g, has_request_context
+from sqlalchemy import event, text
+
+from models import SessionLocal, ReadSessionLocal, engine, replica_engine
+
+logger = logging.getLogger(__name__)
+
+READ_REPLICA_MAX_LAG = float(os.getenv("READ_REPLICA_MAX_LAG", 5))
+READ_REPLICA_CHECK_INTERVAL = float(os.getenv("READ_REPLICA_CHECK_INTERVAL", 5))
+READ_YOUR_WRITES_SECONDS = int(os.getenv("READ_YOUR_WRITES_SECONDS", 5))
+STICKY_COOKIE = "db_sticky"
+
+# Отставание реплики Postgres: 0, если все принятое WAL уже применено (иначе простаивающий
+# мастер выглядел бы «отстающим»), иначе время с последней примененной транзакции
+PG_LAG_SQL = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+_state = {"checked": 0.0, "healthy": False, "lag": None}
+_check_lock = threading.Lock()
+_counters = {"replica": 0, "primary": 0, "sticky": 0, "unhealthy": 0}
+_counters_lock = threading.Lock()
+
+
+def _measure_lag():
+    with replica_engine.connect() as conn:
+        if replica_engine.dialect.name != "postgresql":
+            conn.execute(text("SELECT 1"))  # Отставание не измерить — только проверяем, что реплика отвечает
+            return 0.0
+        return float(conn.execute(PG_LAG_SQL).scalar() or 0.0)
+
+
+def replica_healthy():
+    """Реплика доступна и не отстает. Проверка кэшируется; пока ее делает один поток, остальные берут прошлый ответ."""
+    if replica_engine is None: return False
+    if time.monotonic() - _state["checked"] < READ_REPLICA_CHECK_INTERVAL or not _check_lock.acquire(blocking=False):
+        return _state["healthy"]
+    try:
+        try:
+            lag = _measure_lag()
+            healthy = lag <= READ_REPLICA_MAX_LAG
+            if not healthy: logger.warning(f"Read replica lag {lag:.1f}s, reading from primary")
+        except Exception as e:
+            lag, healthy = None, False
+            logger.error(f"Read replica check failed: {e}")
+        _state.update(checked=time.monotonic(), healthy=healthy, lag=lag)
+        return healthy
+    finally:
+        _check_lock.release()
+
+
+def _is_sticky():
+    if not has_request_context(): return False
+    if g.get("db_wrote"): return True
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def read_session():
+    """Сессия только для чтения: реплика, если можно, иначе основная база."""
+    if replica_engine is None:
+        _count("primary")
+        return ReadSessionLocal()
+    if _is_sticky():
+        _count("sticky")
+        return ReadSessionLocal(bind=engine)
+    if not replica_healthy():
+        _count("unhealthy")
+        return ReadSessionLocal(bind=engine)
+    _count("replica")
+    return ReadSessionLocal()
+
+
+def session_for_request():
+    """Для эндпоинтов с GET и записью в одной функции: GET читает через read_session(), остальное — SessionLocal."""
+    return read_session() if request.method in ("GET", "HEAD") else SessionLocal()
+
+
+@event.listens_for(ReadSessionLocal, "before_flush")
+def _forbid_writes(session, flush_context, instances):
+    if session.new or session.dirty or session.deleted:
+        raise RuntimeError("Read-only session: writes must go through SessionLocal")
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _mark_wrote(session, flush_context):
+    session.info["db_wrote"] = True
+
+
+def _mark_bulk_wrote(update_context):
+    update_context.session.info["db_wrote"] = True
+
+
+event.listen(SessionLocal, "after_bulk_update", _mark_bulk_wrote)
+event.listen(SessionLocal, "after_bulk_delete", _mark_bulk_wrote)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _remember_write(session):
+    if session.info.pop("db_wrote", False) and has_request_context():
+        g.db_wrote = True
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _forget_write(session):
+    session.info.pop("db_wrote", None)
+
+
+def init_app(app):
+    @app.after_request
+    def set_sticky_cookie(response):
+        if g.get("db_wrote"):
+            response.set_cookie(STICKY_COOKIE, str(int(time.time()) + READ_YOUR_WRITES_SECONDS),
+                                max_age=READ_YOUR_WRITES_SECONDS, httponly=True, samesite="Lax")
+        return response
+
+
+def get_stats():
+    with _counters_lock:
+        counters = dict(_counters)
+    return dict(counters, configured=replica_engine is not None, healthy=_state["healthy"], lag=_state["lag"])
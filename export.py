@@ -0,0 +1,178 @@
+"""
+Потоковая выгрузка заказов для бухгалтерии.
+
+GET /api/export/orders?from=YYYY-MM-DD&to=YYYY-MM-DD&format=csv|jsonl&gzip=1
+Заказы ресторана (по дате создания, to включительно) с позициями, оплатой и официантом.
+Ответ — генератор: заказы читаются из БД порциями по EXPORT_BATCH (yield_per, на Postgres —
+серверный курсор), пишутся в буфер и отдаются кусками по ~64 КБ, с gzip=1 сжимаются на лету.
+Память не зависит от периода. Сначала идут заказы из архива (archive.py), затем из БД.
+
+CSV — строка на позицию (поля заказа повторяются; заказ без позиций — одна строка с пустыми
+полями позиции). JSONL — заказ на строку, позиции вложенным списком.
+"""
+import io
+import csv
+import json
+import zlib
+import datetime
+from itertools import chain
+
+from flask import Blueprint, Response, request, jsonify
+from flask_login import login_required, current_user
+from sqlalchemy.orm import selectinload, joinedload
+
+from models import Order, OrderItem
+from db_routing import read_session
+import archive
+
+export_bp = Blueprint('export', __name__)
+
+EXPORT_BATCH = 500
+CHUNK_SIZE = 64 * 1024
+
+CSV_COLUMNS = [
+    "order_id", "created_at", "status", "table_number", "phone_number", "waiter", "total_price", "paid_amount",
+    "item_id", "menu_item_id", "item_name", "price", "quantity", "line_total", "is_paid", "added_by",
+]
+
+
+def _naive_utc(dt):
+    if dt is None or dt.tzinfo is None: return dt
+    return dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _order_dict(o):
+    """Заказ из БД в том же виде, что и запись архива (только нужные выгрузке поля)."""
+    return {
+        "id": o.id,
+        "created_at": _naive_utc(o.created_at).isoformat() if o.created_at else None,
+        "updated_at": _naive_utc(o.updated_at).isoformat() if o.updated_at else None,
+        "status_label": o.status.value,
+        "table_number": o.table_number,
+        "phone_number": o.phone_number,
+        "waiter_name": o.waiter.username if o.waiter else None,
+        "total_price": o.total_price,
+        "items": [{
+            "id": i.id,
+            "menu_item_id": i.menu_item_id,
+            "name": i.menu_item.name if i.menu_item else None,
+            "price": i.menu_item.price if i.menu_item else None,
+            "quantity": i.quantity,
+            "added_by": i.added_by,
+            "is_paid": i.is_paid,
+        } for i in o.items],
+    }
+
+
+def _export_record(order):
+    items = [dict(i, line_total=(i["price"] or 0.0) * i["quantity"]) for i in order["items"]]
+    return {
+        "order_id": order["id"],
+        "created_at": order["created_at"],
+        "status": order["status_label"],
+        "table_number": order["table_number"],
+        "phone_number": order["phone_number"],
+        "waiter": order["waiter_name"],
+        "total_price": order["total_price"],
+        "paid_amount": sum(i["line_total"] for i in items if i["is_paid"]),
+        "items": items,
+    }
+
+
+def iter_orders(restaurant_id, date_from=None, date_to=None, batch=EXPORT_BATCH):
+    """
+    Архивные, затем горячие заказы периода [date_from, date_to) — по одному, без загрузки всех сразу.
+    Заказ, оставшийся в БД после сбоя между записью в архив и удалением, отдается один раз.
+    """
+    archived = set()
+    for record in archive.iter_archived_orders(restaurant_id, date_from, date_to):
+        archived.add(record["id"])
+        yield record
+
+    with read_session() as db:
+        query = db.query(Order).options(
+            selectinload(Order.items).joinedload(OrderItem.menu_item),
+            joinedload(Order.waiter)
+        ).filter(Order.restaurant_id == restaurant_id)
+        if date_from: query = query.filter(Order.created_at >= date_from)
+        if date_to: query = query.filter(Order.created_at < date_to)
+        for o in query.order_by(Order.id).yield_per(batch):
+            if o.id not in archived: yield _order_dict(o)
+
+
+def _csv_lines(records):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def take():
+        value = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return value
+
+    writer.writerow(CSV_COLUMNS)
+    yield take()
+    for r in records:
+        head = [r["order_id"], r["created_at"], r["status"], r["table_number"], r["phone_number"], r["waiter"],
+                r["total_price"], r["paid_amount"]]
+        for i in r["items"] or [None]:
+            writer.writerow(head + ([i["id"], i["menu_item_id"], i["name"], i["price"], i["quantity"],
+                                     i["line_total"], i["is_paid"], i["added_by"]] if i else [""] * 8))
+        yield take()
+
+
+def _jsonl_lines(records):
+    for r in records:
+        yield json.dumps(r, ensure_ascii=False) + "\n"
+
+
+def _chunks(lines, compress):
+    """Склеивает строки в куски ~CHUNK_SIZE; compress — gzip на лету (wbits=31: заголовок gzip)."""
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    pending, size = [], 0
+    for line in chain(lines, [None]):
+        if line is not None:
+            data = line.encode("utf-8")
+            pending.append(data)
+            size += len(data)
+            if size < CHUNK_SIZE: continue
+        block = b"".join(pending)
+        pending, size = [], 0
+        if gz:
+            block = gz.compress(block) + (gz.flush() if line is None else b"")
+        if block: yield block
+
+
+def _parse_date(value):
+    return datetime.date.fromisoformat(value) if value else None
+
+
+@export_bp.route("/api/export/orders")
+@login_required
+def export_orders():
+    if current_user.role == 'admin':
+        rid = current_user.restaurant_id
+    elif current_user.role == 'super_admin':
+        rid = request.args.get("restaurant_id", type=int)
+    else:
+        rid = None
+    if not rid: return jsonify({"error": "Доступ запрещен"}), 403
+
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "jsonl"): return jsonify({"error": "format: csv | jsonl"}), 400
+    try:
+        day_from = _parse_date(request.args.get("from"))
+        day_to = _parse_date(request.args.get("to"))
+    except ValueError:
+        return jsonify({"error": "from/to: YYYY-MM-DD"}), 400
+    compress = request.args.get("gzip") == "1"
+
+    date_from = datetime.datetime.combine(day_from, datetime.time.min) if day_from else None
+    date_to = datetime.datetime.combine(day_to + datetime.timedelta(days=1), datetime.time.min) if day_to else None
+    records = (_export_record(o) for o in iter_orders(rid, date_from, date_to))
+    lines = _csv_lines(records) if fmt == "csv" else _jsonl_lines(records)
+
+    filename = f"orders_{rid}_{day_from or 'all'}_{day_to or 'now'}.{fmt}" + (".gz" if compress else "")
+    mimetype = "application/gzip" if compress else ("text/csv" if fmt == "csv" else "application/x-ndjson")
+    return Response(_chunks(lines, compress), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
@@ -0,0 +1,456 @@
+"""
+Материализованное представление зала в памяти процесса.
+
+План зала админки, экран официанта и список заказов раньше каждый раз собирались из БД —
+на каждый опрос с каждого устройства персонала. Теперь на ресторан держится один снимок:
+столы, активные и последние заказы с позициями, открытые вызовы. Записи компактные (__slots__),
+снимок после сборки не меняется — читатели берут ссылку без блокировок.
+
+Обновление транзакционное: события сессии (after_flush) собирают рестораны, чьи заказы,
+позиции, вызовы, столы, блюда, категории или сотрудники изменились, а after_commit помечает их снимки
+устаревшими (откат транзакции ничего не помечает). Если менялись только заказы/позиции/вызовы,
+следующее чтение догружает заказы с Order.updated_at новее водяного знака снимка; иначе
+снимок пересобирается целиком. 20 устройств стоят как одно.
+
+События коммита видит только процесс, который коммитил. Чтобы изменения из других воркеров
+(и Celery) не терялись, снимок старше FLOOR_SYNC_INTERVAL секунд при чтении догружается по тому же
+водяному знаку, вызовы перечитываются: заказы и вызовы других процессов видны не позже чем через
+FLOOR_SYNC_INTERVAL. Столы, меню и сотрудники из других процессов — не позже FULL_REBUILD_INTERVAL.
+
+Клиенты получают водяной знак (время ответа минус WATERMARK_SKEW): с ?since= эндпоинты
+возвращают только заказы с updated_at не раньше него.
+"""
+import os
+import time
+import logging
+import datetime
+import threading
+from itertools import chain
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import SessionLocal, Order, OrderItem, OrderStatus, ServiceSignal, Table, MenuItem, User, Restaurant, \
+    Category
+from services import is_drink_item
+
+RECENT_ORDERS = 50  # Сколько последних заказов (любого статуса) показывает /api/orders/
+# Запас на транзакции, закоммиченные позже, чем проставлен их updated_at: изменения последних
+# секунд отдаем повторно (клиент сливает по id), зато не теряем
+WATERMARK_SKEW = datetime.timedelta(seconds=3)
+FULL_REBUILD_INTERVAL = 300  # Полная пересборка не реже, сек (страховка от пропущенных изменений)
+# Догрузка по водяному знаку не реже, сек: граница устаревания для коммитов других процессов
+FLOOR_SYNC_INTERVAL = float(os.getenv("FLOOR_SYNC_INTERVAL", 2))
+CLOSED_STATUSES = (OrderStatus.CANCELED, OrderStatus.SUCCESSFULLY_DELIVERED)
+
+logger = logging.getLogger(__name__)
+
+
+# --- Записи ---
+
+class TableRec:
+    __slots__ = ("id", "number")
+
+    def __init__(self, id, number):
+        self.id = id
+        self.number = number
+
+
+class ItemRec:
+    __slots__ = ("id", "menu_item_id", "name", "price", "quantity", "added_by", "is_paid", "is_deleted", "station")
+
+    def __init__(self, oi):
+        self.id = oi.id
+        self.menu_item_id = oi.menu_item_id
+        self.is_deleted = oi.menu_item is None
+        self.name = oi.menu_item.name if oi.menu_item else "Удаленное блюдо"
+        self.price = oi.menu_item.price if oi.menu_item else None
+        self.quantity = oi.quantity
+        self.added_by = oi.added_by
+        self.is_paid = oi.is_paid
+        self.station = "bar" if is_drink_item(oi.menu_item) else "kitchen"
+
+
+def _naive_utc(dt):
+    if dt is None or dt.tzinfo is None: return dt
+    return dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class OrderRec:
+    __slots__ = ("id", "table_id", "table_number", "phone_number", "status", "total_price", "waiter_name",
+                 "created_at", "last_activity", "updated_at", "items", "is_active")
+
+    def __init__(self, o):
+        self.id = o.id
+        self.table_id = o.table_id
+        self.table_number = o.table_number
+        self.phone_number = o.phone_number
+        self.status = o.status
+        self.total_price = o.total_price
+        self.waiter_name = o.waiter.username if o.waiter else None
+        self.created_at = o.created_at
+        self.last_activity = o.last_activity
+        self.updated_at = _naive_utc(o.updated_at or o.created_at)
+        self.items = tuple(ItemRec(i) for i in sorted(o.items, key=lambda i: i.id))
+        self.is_active = o.status not in CLOSED_STATUSES
+
+
+class SignalRec:
+    __slots__ = ("id", "table_number", "created_at")
+
+    def __init__(self, s):
+        self.id = s.id
+        self.table_number = s.table_number
+        self.created_at = s.created_at
+
+
+class FloorView:
+    __slots__ = ("restaurant_id", "generation", "full_generation", "built_at", "synced_at",
+                 "tables", "orders", "active_ids", "recent_ids", "signals")
+
+    def __init__(self, restaurant_id, generation, full_generation):
+        self.restaurant_id = restaurant_id
+        self.generation = generation
+        self.full_generation = full_generation
+        self.built_at = time.monotonic()  # Время последней полной сборки
+        self.synced_at = _utcnow()  # Начало последнего чтения из БД (naive UTC, как updated_at)
+        self.tables = ()  # TableRec по номеру
+        self.orders = {}  # id -> OrderRec (активные + последние RECENT_ORDERS)
+        self.active_ids = ()  # Активные заказы по возрастанию id
+        self.recent_ids = ()  # Последние заказы по убыванию id
+        self.signals = ()
+
+    def _set_orders(self, orders, recent_ids):
+        # Храним только то, что показываем: активные и последние RECENT_ORDERS
+        recent_ids = sorted(recent_ids, reverse=True)[:RECENT_ORDERS]
+        keep = set(recent_ids)
+        self.orders = {oid: rec for oid, rec in orders.items() if rec.is_active or oid in keep}
+        self.active_ids = tuple(sorted(oid for oid, rec in self.orders.items() if rec.is_active))
+        self.recent_ids = tuple(oid for oid in recent_ids if oid in self.orders)
+
+
+# --- Сборка и кэш ---
+
+_lock = threading.Lock()
+_views = {}  # restaurant_id -> FloorView
+_generations = {}  # restaurant_id -> счетчик изменений
+_full_generations = {}  # restaurant_id -> счетчик изменений, требующих полной пересборки
+_build_locks = {}  # restaurant_id -> Lock (одна пересборка за раз)
+_listeners = []  # callback(restaurant_ids | None) после коммита с изменениями зала
+
+
+def _load_signals(db, restaurant_id):
+    return tuple(SignalRec(s) for s in db.query(ServiceSignal).filter(
+        ServiceSignal.restaurant_id == restaurant_id,
+        ServiceSignal.is_active == True
+    ).order_by(ServiceSignal.id).all())
+
+
+def _orders_query(db):
+    return db.query(Order).options(
+        joinedload(Order.waiter),
+        joinedload(Order.items).joinedload(OrderItem.menu_item).selectinload(MenuItem.categories))
+
+
+def _build(db, restaurant_id, generation, full_generation):
+    view = FloorView(restaurant_id, generation, full_generation)
+    view.tables = tuple(TableRec(t.id, t.number) for t in
+                        db.query(Table).filter_by(restaurant_id=restaurant_id).order_by(Table.number).all())
+
+    recent_ids = [r[0] for r in db.query(Order.id).filter(Order.restaurant_id == restaurant_id)
+                  .order_by(Order.id.desc()).limit(RECENT_ORDERS).all()]
+    orders = _orders_query(db).filter(
+        Order.restaurant_id == restaurant_id,
+        Order.status.notin_(CLOSED_STATUSES) | Order.id.in_(recent_ids or [0])
+    ).all()
+    view._set_orders({o.id: OrderRec(o) for o in orders}, recent_ids)
+    view.signals = _load_signals(db, restaurant_id)
+    return view
+
+
+def _refresh(db, old, generation):
+    """Догружает заказы, изменившиеся после водяного знака старого снимка. Столы и меню не трогаем."""
+    view = FloorView(old.restaurant_id, generation, old.full_generation)
+    view.built_at = old.built_at
+    view.tables = old.tables
+
+    changed = _orders_query(db).filter(
+        Order.restaurant_id == old.restaurant_id,
+        Order.updated_at >= old.synced_at - WATERMARK_SKEW
+    ).all()
+    orders = dict(old.orders)
+    orders.update((o.id, OrderRec(o)) for o in changed)
+    view._set_orders(orders, set(old.recent_ids) | {o.id for o in changed})
+    view.signals = _load_signals(db, old.restaurant_id)
+    return view
+
+
+def get_view(restaurant_id):
+    """
+    Актуальный снимок ресторана. Обновляется, если с прошлой сборки были коммиты в этом процессе
+    или с последней сверки с БД прошло FLOOR_SYNC_INTERVAL.
+    """
+    restaurant_id = int(restaurant_id)
+
+    def current():
+        view = _views.get(restaurant_id)
+        generation = _generations.get(restaurant_id, 0)
+        fresh = view is not None and view.generation == generation \
+            and time.monotonic() - view.built_at < FULL_REBUILD_INTERVAL \
+            and (_utcnow() - view.synced_at).total_seconds() < FLOOR_SYNC_INTERVAL
+        return view, generation, _full_generations.get(restaurant_id, 0), fresh
+
+    with _lock:
+        view, generation, full_generation, fresh = current()
+        if fresh: return view
+        build_lock = _build_locks.setdefault(restaurant_id, threading.Lock())
+
+    with build_lock:
+        with _lock:
+            view, generation, full_generation, fresh = current()
+            if fresh: return view  # Пока ждали, снимок обновил другой поток
+        with SessionLocal() as db:
+            if view is None or view.full_generation != full_generation \
+                    or time.monotonic() - view.built_at >= FULL_REBUILD_INTERVAL:
+                view = _build(db, restaurant_id, generation, full_generation)
+            else:
+                view = _refresh(db, view, generation)
+        with _lock:
+            # Если во время сборки был коммит, поколение уже выросло — следующее чтение обновит снова
+            _views[restaurant_id] = view
+        return view
+
+
+def invalidate(restaurant_id=None, full=True):
+    """full=False — менялись только заказы/позиции/вызовы: хватит догрузки по updated_at."""
+    with _lock:
+        rids = set(_generations) | set(_views) if restaurant_id is None else {int(restaurant_id)}
+        for rid in rids:
+            _generations[rid] = _generations.get(rid, 0) + 1
+            if full:
+                _full_generations[rid] = _full_generations.get(rid, 0) + 1
+
+
+def add_listener(callback):
+    """
+    callback(restaurant_ids) вызывается после коммита, изменившего зал (None — неизвестно какие
+    рестораны). Вызывается в потоке коммита: только уведомления, без обращений к БД.
+    """
+    _listeners.append(callback)
+
+
+def _notify(restaurant_ids):
+    for callback in _listeners:
+        try:
+            callback(restaurant_ids)
+        except Exception as e:
+            logger.error(f"Floor view listener error: {e}")
+
+
+def warm_up():
+    """Сборка снимков всех ресторанов при старте, чтобы первый опрос не ждал."""
+    with SessionLocal() as db:
+        rids = [r[0] for r in db.query(Restaurant.id).all()]
+    for rid in rids:
+        get_view(rid)
+
+
+# --- Отслеживание изменений ---
+
+_ORDER_LEVEL = (Order, OrderItem, ServiceSignal)  # Догружаются по updated_at
+_WATCHED = _ORDER_LEVEL + (Table, MenuItem, Category, User, Restaurant)  # Остальное — полная пересборка
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_changes(session, flush_context):
+    orders_dirty = session.info.setdefault("floor_view_orders", set())
+    full_dirty = session.info.setdefault("floor_view_full", set())
+    order_ids = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, OrderItem):
+            order = obj.__dict__.get("order")  # Без ленивой загрузки внутри flush
+            if order is not None: orders_dirty.add(order.restaurant_id)
+            elif obj.order_id: order_ids.add(obj.order_id)
+        elif isinstance(obj, _ORDER_LEVEL):
+            orders_dirty.add(obj.restaurant_id)
+        elif isinstance(obj, Restaurant):
+            full_dirty.add(obj.id)
+        elif isinstance(obj, _WATCHED):
+            full_dirty.add(obj.restaurant_id)
+    if order_ids:
+        rows = session.connection().execute(select(Order.restaurant_id).where(Order.id.in_(order_ids)))
+        orders_dirty.update(r[0] for r in rows)
+
+
+def _collect_bulk(context):
+    # query.update()/delete() не проходят через flush — ресторан неизвестен, помечаем все снимки
+    cls = context.mapper.class_
+    if cls in _ORDER_LEVEL:
+        context.session.info.setdefault("floor_view_all", "orders")
+    elif cls in _WATCHED:
+        context.session.info["floor_view_all"] = "full"
+
+
+event.listen(SessionLocal, "after_bulk_update", _collect_bulk)
+event.listen(SessionLocal, "after_bulk_delete", _collect_bulk)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _apply_changes(session):
+    orders_dirty = session.info.pop("floor_view_orders", set())
+    full_dirty = session.info.pop("floor_view_full", set())
+    everything = session.info.pop("floor_view_all", None)
+    if everything:
+        invalidate(full=everything == "full")
+    for rid in full_dirty:
+        if rid is not None: invalidate(rid)
+    for rid in orders_dirty - full_dirty:
+        if rid is not None: invalidate(rid, full=False)
+    if everything:
+        _notify(None)
+    elif orders_dirty or full_dirty:
+        _notify((orders_dirty | full_dirty) - {None})
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_changes(session):
+    for key in ("floor_view_orders", "floor_view_full", "floor_view_all"):
+        session.info.pop(key, None)
+
+
+# --- Представления для эндпоинтов ---
+
+def _minutes_since(dt, now):
+    if not dt: return 0
+    dt = dt if dt.tzinfo else dt.replace(tzinfo=datetime.timezone.utc)
+    return int((now - dt).total_seconds() / 60)
+
+
+def table_statuses(restaurant_id):
+    """
+    План зала для админки: все столы по номеру, у каждого — активный заказ с наименьшим id
+    (order_id, status, created_at "ЧЧ:ММ") и его позиции {id, name, quantity, price, added_by, is_paid};
+    у свободного стола active=False, status "Свободен", items [].
+    """
+    view = get_view(restaurant_id)
+    by_table = {}
+    for oid in view.active_ids:
+        rec = view.orders[oid]
+        if rec.table_id is not None and rec.table_id not in by_table:
+            by_table[rec.table_id] = rec  # Наименьший id — как в запросе
+
+    result = []
+    for t in view.tables:
+        o = by_table.get(t.id)
+        result.append({
+            "id": t.id,
+            "number": t.number,
+            "active": o is not None,
+            "order_id": o.id if o else None,
+            "status": o.status.value if o else "Свободен",
+            "created_at": o.created_at.strftime("%H:%M") if o else None,
+            "items": [{
+                "id": i.id,
+                "name": i.name,
+                "quantity": i.quantity,
+                "price": i.price,
+                "added_by": i.added_by or "Гость",
+                "is_paid": i.is_paid
+            } for i in o.items] if o else []
+        })
+    return result
+
+
+def parse_watermark(value):
+    """?since= -> naive UTC datetime. Пустое или битое значение -> None (клиент получит полный список)."""
+    if not value: return None
+    try:
+        return _naive_utc(datetime.datetime.fromisoformat(value))
+    except ValueError:
+        return None
+
+
+def next_watermark():
+    """
+    Водяной знак для ответа. Снимок актуален на момент чтения (иначе get_view обновил бы его),
+    а транзакция, которая закоммитится позже, получит updated_at не раньше now - WATERMARK_SKEW.
+    """
+    return (_utcnow() - WATERMARK_SKEW).isoformat()
+
+
+def _changed(view, oids, since):
+    if since is None: return list(oids)
+    return [oid for oid in oids if view.orders[oid].updated_at is None or view.orders[oid].updated_at >= since]
+
+
+def _waiter_order(o, now):
+    return {
+        "id": o.id,
+        "table": o.table_number,
+        "status": o.status.value,
+        "total": o.total_price,
+        "minutes": _minutes_since(o.last_activity, now),
+        "items": [f"{i.name} x{i.quantity}" for i in o.items]
+    }
+
+
+def _admin_order(o):
+    return {
+        "id": o.id, "table_number": o.table_number, "phone_number": o.phone_number,
+        "total_price": o.total_price, "status": o.status.value,
+        "waiter_name": o.waiter_name,
+        "items": [{"name": i.name, "quantity": i.quantity} for i in o.items]
+    }
+
+
+def waiter_floor_info(restaurant_id):
+    """
+    Экран официанта: (orders_info, signals_info). orders_info — активные заказы за столами
+    {id, table, status, total, minutes с последней активности, items ["Блюдо xN"]},
+    signals_info — открытые вызовы {id, table, minutes}.
+    """
+    view = get_view(restaurant_id)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    orders_info = [_waiter_order(view.orders[oid], now) for oid in view.active_ids
+                   if view.orders[oid].table_number is not None]
+    signals_info = [{"id": s.id, "table": s.table_number, "minutes": _minutes_since(s.created_at, now)}
+                    for s in view.signals]
+    return orders_info, signals_info
+
+
+def waiter_floor_changes(restaurant_id, since):
+    """
+    Экран официанта с ?since=: изменившиеся активные заказы, карта {id: минуты} всех активных
+    (по ней клиент убирает закрытые и обновляет таймеры), вызовы и новый водяной знак.
+    """
+    watermark = next_watermark()  # До чтения снимка: все, что закоммитят позже, будет новее
+    view = get_view(restaurant_id)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    active = [oid for oid in view.active_ids if view.orders[oid].table_number is not None]
+    return {
+        "orders": [_waiter_order(view.orders[oid], now) for oid in _changed(view, active, since)],
+        "active": {oid: _minutes_since(view.orders[oid].last_activity, now) for oid in active},
+        "signals": [{"id": s.id, "table": s.table_number, "minutes": _minutes_since(s.created_at, now)}
+                    for s in view.signals],
+        "watermark": watermark,
+    }
+
+
+def recent_orders(restaurant_id):
+    """Последние заказы для /api/orders/."""
+    view = get_view(restaurant_id)
+    return [_admin_order(view.orders[oid]) for oid in view.recent_ids]
+
+
+def recent_orders_changes(restaurant_id, since):
+    """/api/orders/?since=: только изменившиеся из последних заказов + новый водяной знак."""
+    watermark = next_watermark()
+    view = get_view(restaurant_id)
+    return {
+        "orders": [_admin_order(view.orders[oid]) for oid in _changed(view, view.recent_ids, since)],
+        "watermark": watermark,
+    }
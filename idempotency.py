@@ -0,0 +1,225 @@
+"""
+Idempotency-Key для пишущих эндпоинтов.
+
+Гости на плохом Wi-Fi повторяют /orders/, /api/cart/update, /api/signal/call, админ дважды
+жмет "оплачено наличными". Если клиент прислал заголовок Idempotency-Key, первый запрос
+выполняется и его ответ сохраняется на IDEMPOTENCY_TTL секунд; повтор с тем же ключом
+получает сохраненный ответ (заголовок Idempotent-Replayed: true), обработчик не вызывается.
+- тот же ключ, но другое тело запроса -> 422;
+- первый запрос еще выполняется -> 409 с Retry-After;
+- сохраняем только успешные ответы (2xx): ошибки (нет остатка, неверные данные, 409, 429, 5xx)
+  бывают временными, и повтор выполнится заново, а не получит ту же ошибку на весь TTL.
+Ключ действует в пределах эндпоинта и клиента (сотрудник / Guest-Token / IP).
+
+Хранилища (IDEMPOTENCY_BACKEND), как у rate_limit: memory — в процессе;
+sqlite — общий файл IDEMPOTENCY_SQLITE_PATH для всех воркеров на машине.
+Без заголовка запросы обрабатываются как раньше.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, jsonify, current_app
+from flask_login import current_user
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory")
+IDEMPOTENCY_SQLITE_PATH = os.getenv("IDEMPOTENCY_SQLITE_PATH", "idempotency.db")
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 3600))  # Сколько помним ответ
+IDEMPOTENCY_LOCK_TTL = 30  # Сколько держим "в работе" (на случай, если воркер упал посреди запроса)
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", 100000))
+MAX_KEY_LENGTH = 255
+
+# Результаты begin()
+NEW, IN_FLIGHT, MISMATCH, DONE = "new", "in_flight", "mismatch", "done"
+
+
+# --- Хранилища ---
+
+class MemoryStore:
+    """Записи в памяти процесса: key -> (fingerprint, response|None, expires_at). response=None — в работе."""
+
+    def __init__(self, max_keys=IDEMPOTENCY_MAX_KEYS):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # В порядке постановки: в начале самые старые
+        self._max_keys = max_keys
+
+    def _evict(self, now):
+        # Не больше нескольких ключей за вызов — стоимость остается O(1)
+        for _ in range(8):
+            if not self._entries: return
+            key, (_, _, expires_at) = next(iter(self._entries.items()))
+            if expires_at <= now or len(self._entries) > self._max_keys:
+                self._entries.popitem(last=False)
+            else:
+                return
+
+    def begin(self, key, fingerprint, now=None):
+        now = now or time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[2] > now:
+                if entry[0] != fingerprint: return MISMATCH, None
+                return (IN_FLIGHT, None) if entry[1] is None else (DONE, entry[1])
+            self._entries.pop(key, None)
+            self._entries[key] = (fingerprint, None, now + IDEMPOTENCY_LOCK_TTL)
+            self._evict(now)
+        return NEW, None
+
+    def complete(self, key, fingerprint, response, now=None):
+        now = now or time.time()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (fingerprint, response, now + IDEMPOTENCY_TTL)
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] is None:
+                del self._entries[key]
+
+
+class SQLiteStore:
+    """Общий для воркеров файл; begin — одна короткая транзакция BEGIN IMMEDIATE."""
+
+    def __init__(self, path=IDEMPOTENCY_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._calls = 0
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS idempotency_keys ("
+                         "key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, status INTEGER, "
+                         "content_type TEXT, body BLOB, expires_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at ON idempotency_keys (expires_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def begin(self, key, fingerprint, now=None):
+        now = now or time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT fingerprint, status, content_type, body FROM idempotency_keys "
+                               "WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            if row:
+                conn.execute("COMMIT")
+                if row[0] != fingerprint: return MISMATCH, None
+                return (IN_FLIGHT, None) if row[1] is None else (DONE, (row[1], row[2], row[3]))
+            conn.execute("INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, status, content_type, body, "
+                         "expires_at) VALUES (?, ?, NULL, NULL, NULL, ?)", (key, fingerprint, now + IDEMPOTENCY_LOCK_TTL))
+            self._calls += 1
+            if self._calls % 1000 == 0:
+                conn.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return NEW, None
+
+    def complete(self, key, fingerprint, response, now=None):
+        now = now or time.time()
+        status, content_type, body = response
+        self._conn().execute("INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, status, content_type, body, "
+                             "expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, fingerprint, status, content_type, body, now + IDEMPOTENCY_TTL))
+
+    def release(self, key):
+        self._conn().execute("DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL", (key,))
+
+
+def create_store(name=IDEMPOTENCY_BACKEND):
+    if name == "sqlite": return SQLiteStore()
+    return MemoryStore()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_store()
+    return _store
+
+
+# --- Flask ---
+
+def _client_id():
+    if current_user.is_authenticated: return f"user:{current_user.id}"
+    guest = request.headers.get("Guest-Token")
+    return f"guest:{guest}" if guest else f"ip:{request.remote_addr}"
+
+
+def _fingerprint():
+    h = hashlib.sha256()
+    h.update(request.method.encode())
+    h.update(request.full_path.encode())
+    h.update(b"\0")
+    h.update(request.get_data())
+    return h.hexdigest()
+
+
+def idempotent(f):
+    """Повтор запроса с тем же Idempotency-Key получает сохраненный ответ вместо повторного выполнения."""
+
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        idem_key = request.headers.get("Idempotency-Key")
+        if not idem_key:
+            return f(*args, **kwargs)
+        if len(idem_key) > MAX_KEY_LENGTH:
+            return jsonify({"error": "Idempotency-Key is too long"}), 400
+
+        store = get_store()
+        key = f"{request.endpoint}:{_client_id()}:{idem_key}"
+        fingerprint = _fingerprint()
+        try:
+            state, stored = store.begin(key, fingerprint)
+        except Exception as e:
+            # Хранилище недоступно — выполняем запрос как без ключа
+            logger.error(f"Idempotency store error: {e}")
+            return f(*args, **kwargs)
+
+        if state == MISMATCH:
+            return jsonify({"error": "Idempotency-Key уже использован с другим запросом"}), 422
+        if state == IN_FLIGHT:
+            res = jsonify({"error": "Запрос с этим Idempotency-Key еще выполняется"})
+            res.headers["Retry-After"] = "1"
+            return res, 409
+        if state == DONE:
+            status, content_type, body = stored
+            res = current_app.response_class(body, status=status, content_type=content_type)
+            res.headers["Idempotent-Replayed"] = "true"
+            return res
+
+        response = None
+        try:
+            response = current_app.make_response(f(*args, **kwargs))
+            return response
+        finally:
+            try:
+                if response is not None and 200 <= response.status_code < 300:
+                    store.complete(key, fingerprint, (response.status_code, response.content_type,
+                                                      response.get_data()))
+                else:
+                    store.release(key)
+            except Exception as e:
+                logger.error(f"Idempotency store error: {e}")
+
+    return wrapped
@@ -0,0 +1,300 @@
+"""
+Быстрый путь для простых команд чата без LLM.
+
+"добавь 2 пепперони", "убери колу", "очисти корзину", "сколько с меня" (и то же на казахском)
+разбираются локально по словарям глаголов, числительным и индексу названий меню.
+Результат — тот же dict, что возвращает assistant.process_message:
+{"response": ..., "actions": [...], "recommendations": []} + "confidence".
+Если уверенности мало (непонятные слова, неоднозначное блюдо) — возвращаем None, и сообщение уходит в LLM.
+"""
+import os
+import re
+
+MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", 0.9))
+# Блюдо нашлось только по началу слова ("сокол" ~ "сок"): такое решает LLM, а не быстрый путь
+PARTIAL_MATCH_CONFIDENCE = 0.5
+
+# --- Словари ---
+
+ADD_VERBS = {
+    'ru': {"добавь", "добавьте", "добавить", "добавим", "беру", "берем", "возьму", "возьмем", "давай", "давайте",
+           "дай", "дайте", "закажи", "закажу", "плюс"},
+    'kk': {"қос", "қосыңыз", "қосшы", "қосып", "қосу", "алам", "аламын", "аламыз", "берші", "беріңіз", "беріңізші"},
+}
+REMOVE_VERBS = {
+    'ru': {"убери", "уберите", "убрать", "удали", "удалите", "удалить", "минус", "отмени", "отмените"},
+    'kk': {"өшір", "өшіріңіз", "өшірші", "алып", "таста", "тастаңыз", "тасташ", "алыңыз"},
+}
+SET_VERBS = {
+    'ru': {"сделай", "сделайте", "поставь", "поставьте", "измени", "исправь"},
+    'kk': {"өзгерт", "өзгертіңіз"},
+}
+# Очистка корзины — только если фраза и есть все сообщение (без "кроме колы", "все лишнее" и т.п.)
+CLEAR_PHRASES = {
+    'ru': ("очисти корзину", "очистить корзину", "очистите корзину", "сбрось корзину", "удали все", "убери все",
+           "удалить все", "убрать все", "отмени все"),
+    'kk': ("себетті тазала", "себетті тазалаңыз", "тазала", "бәрін өшір", "барлығын өшір", "бәрін алып таста"),
+}
+CLEAR_EXCEPTIONS = ("кроме", "лишн", "басқа", "қоспағанда")
+POLITE_WORDS = {"пожалуйста", "плиз", "ну", "а", "өтінем", "өтінемін"}
+TOTAL_PHRASES = {
+    'ru': ("сколько с меня", "сколько с нас", "сколько к оплате", "сколько всего", "какая сумма", "итого",
+           "сколько стоит заказ", "какой счет"),
+    'kk': ("қанша төлеймін", "қанша төлейміз", "барлығы қанша", "қанша болды", "есепшот", "қанша тұрады"),
+}
+
+NUMBER_WORDS = {
+    'ru': {"один": 1, "одна": 1, "одну": 1, "одно": 1, "два": 2, "две": 2, "пару": 2, "пара": 2, "три": 3,
+           "четыре": 4, "пять": 5, "шесть": 6, "семь": 7, "восемь": 8, "девять": 9, "десять": 10},
+    # Только для казахских сообщений: "он" по-русски — местоимение
+    'kk': {"бір": 1, "екі": 2, "үш": 3, "төрт": 4, "бес": 5, "алты": 6, "жеті": 7, "сегіз": 8, "тоғыз": 9,
+           "он": 10},
+}
+KK_LETTERS_RE = re.compile(r"[әғқңөұүһі]")
+
+# Падежные окончания: слова совпадают, если равны после отбрасывания окончания (основа не короче 3 букв)
+ENDINGS = (
+    # ru
+    "ами", "ями", "ого", "его", "ому", "ему", "ой", "ей", "ом", "ем", "ам", "ям", "ах", "ях", "ов", "ев",
+    "ы", "и", "а", "я", "у", "ю", "е", "о",
+    # kk
+    "дың", "дің", "тың", "тің", "ның", "нің", "дан", "ден", "тан", "тен", "нан", "нен", "мен", "пен", "бен",
+    "лар", "лер", "дар", "дер", "тар", "тер", "ды", "ді", "ты", "ті", "ны", "ні", "ға", "ге", "қа", "ке",
+    "на", "не", "да", "де", "та", "те", "ын", "ін",
+)
+
+# Слова, которые не влияют на смысл команды
+STOPWORDS = {
+    "пожалуйста", "плиз", "мне", "нам", "еще", "ещё", "тоже", "также", "в", "корзину", "из", "корзины", "шт",
+    "штук", "штуки", "штуку", "порции", "порцию", "порций", "а", "ну", "и", "с", "можно", "бы",
+    "маған", "бізге", "тағы", "өтінем", "өтінемін", "себетке", "себеттен", "дана", "және", "пен", "мен",
+}
+SEPARATORS = {"и", "және", "да", "плюс"}
+
+RESPONSES = {
+    'ru': {
+        'added': "Готово! Добавила в корзину: {items} 😎",
+        'removed': "Убрала из корзины: {items}.",
+        'set': "Поправила количество: {items}.",
+        'not_in_cart': "Этого нет в корзине: {items} 🤔",
+        'cleared': "Корзина очищена. Начнем заново? 🍕",
+        'total': "С вас {total} ₸:\n{items}",
+        'empty': "Корзина пока пуста. Что закажем? 🍕",
+    },
+    'kk': {
+        'added': "Дайын! Себетке қостым: {items} 😎",
+        'removed': "Себеттен алып тастадым: {items}.",
+        'set': "Санын өзгерттім: {items}.",
+        'not_in_cart': "Себетте жоқ: {items} 🤔",
+        'cleared': "Себет тазаланды. Қайта бастаймыз ба? 🍕",
+        'total': "Барлығы {total} ₸:\n{items}",
+        'empty': "Себет әзірге бос. Не тапсырыс береміз? 🍕",
+    },
+}
+
+_TOKEN_RE = re.compile(r"[0-9]+|[^\W\d_]+", re.UNICODE)
+
+
+def _normalize(text):
+    return text.lower().replace("ё", "е")
+
+
+def _tokens(text):
+    return _TOKEN_RE.findall(_normalize(text))
+
+
+def _stems(word):
+    """Слово и его основы без падежных окончаний из ENDINGS."""
+    return {word} | {word[:-len(e)] for e in ENDINGS if word.endswith(e) and len(word) - len(e) >= 3}
+
+
+def _word_match(a, b):
+    """
+    'exact' — то же слово; 'stem' — то же слово в другом падеже ('колу' ~ 'кола', 'пепперониді' ~ 'пепперони');
+    'partial' — только общее начало ('колбаски' ~ 'кола'), уверенности не хватает; None — разные слова.
+    """
+    if a == b: return 'exact'
+    if _stems(a) & _stems(b): return 'stem'
+    n = min(len(a), len(b))
+    if n >= 3 and a[:max(3, n - 2)] == b[:max(3, n - 2)]: return 'partial'
+    return None
+
+
+def _find_lang_verb(tokens, verbs):
+    for lang, words in verbs.items():
+        for idx, t in enumerate(tokens):
+            if t in words: return lang, idx
+    return None, None
+
+
+def _has_phrase(text, phrases):
+    for lang, items in phrases.items():
+        for p in items:
+            if re.search(rf"(?<!\w){re.escape(p)}(?!\w)", text): return lang
+    return None
+
+
+def _clear_lang(tokens):
+    """Язык, если все сообщение — просьба очистить корзину (вежливые слова не в счет), иначе None."""
+    if any(t.startswith(e) for t in tokens for e in CLEAR_EXCEPTIONS): return None
+    utterance = " ".join(t for t in tokens if t not in POLITE_WORDS)
+    for lang, items in CLEAR_PHRASES.items():
+        if utterance in items: return lang
+    return None
+
+
+def build_menu_index(menu_items):
+    """[(токены названия, item)] — длинные названия первыми, чтобы 'пицца пепперони' побеждала 'пепперони'."""
+    index = [(_tokens(m['name']), m) for m in menu_items]
+    index = [(toks, m) for toks, m in index if toks]
+    index.sort(key=lambda x: -len(x[0]))
+    return index
+
+
+def _match_segment(tokens, index, numbers):
+    """
+    Ищет в сегменте одно блюдо и количество (numbers — числительные языка сообщения).
+    Возвращает (item, quantity, неразобранные токены, partial) или (None, None, tokens, False);
+    partial — хотя бы одно слово названия совпало только по началу.
+    """
+    best, best_used, best_partial = None, None, False
+    for name_toks, item in index:
+        # Более короткие названия — подмножество уже найденного ('пепперони' внутри 'пицца пепперони')
+        if best is not None and len(name_toks) < len(best_used): break
+        used, partial = [], False
+        for nt in name_toks:
+            matches = [(i, _word_match(t, nt)) for i, t in enumerate(tokens) if i not in used]
+            pos = next((i for i, kind in matches if kind in ('exact', 'stem')), None)
+            if pos is None:
+                pos = next((i for i, kind in matches if kind == 'partial'), None)
+                partial = True
+            if pos is None: break
+            used.append(pos)
+        else:
+            if best is not None:
+                return None, None, tokens, False  # Неоднозначно: подходят два блюда
+            best, best_used, best_partial = item, used, partial
+
+    if best is None: return None, None, tokens, False
+
+    qty, rest = None, []
+    for i, t in enumerate(tokens):
+        if i in best_used: continue
+        if qty is None and t.isdigit() and 0 < int(t) <= 50:
+            qty = int(t)
+        elif qty is None and t in numbers:
+            qty = numbers[t]
+        else:
+            rest.append(t)
+    return best, qty, rest, best_partial
+
+
+def _split_segments(tokens):
+    segments, current = [], []
+    for t in tokens:
+        if t in SEPARATORS:
+            if current: segments.append(current)
+            current = []
+        else:
+            current.append(t)
+    if current: segments.append(current)
+    return segments
+
+
+def _format_items(pairs):
+    return ", ".join(f"{name} x{qty}" if qty else name for name, qty in pairs)
+
+
+def parse_intent(text, menu_items, cart=None):
+    """
+    text: сообщение гостя; menu_items: [{'id', 'name', 'price'}]; cart: {str(menu_item_id): qty}.
+    Возвращает ответ в формате assistant.process_message или None (низкая уверенность -> LLM).
+    """
+    if not text or len(text) > 200: return None
+    cart = cart or {}
+    norm = _normalize(text)
+
+    lang = _clear_lang(_tokens(text))
+    if lang:
+        return _result(RESPONSES[lang]['cleared'], [{"type": "clear_cart"}])
+
+    lang = _has_phrase(norm, TOTAL_PHRASES)
+    if lang:
+        return _total_answer(lang, menu_items, cart)
+
+    tokens = _tokens(text)
+    if not tokens: return None
+
+    verb = None
+    for vtype, verbs in (('add', ADD_VERBS), ('remove', REMOVE_VERBS), ('set', SET_VERBS)):
+        lang, idx = _find_lang_verb(tokens, verbs)
+        if lang:
+            verb = vtype
+            break
+    if not verb: return None
+
+    all_verbs = set().union(*ADD_VERBS.values(), *REMOVE_VERBS.values(), *SET_VERBS.values())
+    content = [t for t in tokens if t not in all_verbs]
+    index = build_menu_index(menu_items)
+    numbers = dict(NUMBER_WORDS['ru'])
+    if lang == 'kk' or KK_LETTERS_RE.search(norm): numbers.update(NUMBER_WORDS['kk'])
+
+    actions, named, missing = [], [], []
+    leftovers, total_tokens, partial = 0, 0, False
+    for seg in _split_segments(content):
+        seg = [t for t in seg if t not in STOPWORDS or t.isdigit()]
+        if not seg: continue
+        total_tokens += len(seg)
+        item, qty, rest, seg_partial = _match_segment(seg, index, numbers)
+        if not item: return None  # Блюдо не распознано — пусть разбирается LLM
+        leftovers += len(rest)
+        partial = partial or seg_partial
+
+        if verb == 'add':
+            actions.append({"type": "add_item", "item_name": item['name'], "quantity": qty or 1})
+            named.append((item['name'], qty or 1))
+        elif verb == 'set':
+            if qty is None: return None
+            actions.append({"type": "update_quantity", "item_name": item['name'], "quantity": qty})
+            named.append((item['name'], qty))
+        else:
+            in_cart = cart.get(str(item['id']))
+            if not in_cart:
+                missing.append((item['name'], None))
+                continue
+            if qty and qty < in_cart:
+                # "убери одну колу" — уменьшаем количество, а не удаляем позицию целиком
+                actions.append({"type": "update_quantity", "item_name": item['name'], "quantity": in_cart - qty})
+                named.append((item['name'], qty))
+            else:
+                actions.append({"type": "remove_item", "item_name": item['name']})
+                named.append((item['name'], None))
+
+    if not actions and not missing: return None
+
+    confidence = 1.0 - (leftovers / total_tokens if total_tokens else 1.0)
+    if partial: confidence *= PARTIAL_MATCH_CONFIDENCE
+    if confidence < MIN_CONFIDENCE: return None
+
+    key = {'add': 'added', 'remove': 'removed', 'set': 'set'}[verb]
+    parts = []
+    if named: parts.append(RESPONSES[lang][key].format(items=_format_items(named)))
+    if missing: parts.append(RESPONSES[lang]['not_in_cart'].format(items=_format_items(missing)))
+    return _result("\n".join(parts), actions, confidence)
+
+
+def _total_answer(lang, menu_items, cart):
+    by_id = {str(m['id']): m for m in menu_items}
+    lines, total = [], 0.0
+    for item_id, qty in cart.items():
+        m = by_id.get(str(item_id))
+        if not m or not qty: continue
+        total += (m.get('price') or 0) * qty
+        lines.append(f"- {m['name']} x{qty}")
+    if not lines:
+        return _result(RESPONSES[lang]['empty'], [])
+    return _result(RESPONSES[lang]['total'].format(total=f"{total:g}", items="\n".join(lines)), [])
+
+
+def _result(response, actions, confidence=1.0):
+    return {"response": response, "actions": actions, "recommendations": [], "confidence": confidence}
@@ -0,0 +1,235 @@
+"""
+Экран кухни (KDS): заказы в статусе "Готовится", разложенные по цехам.
+
+Каждый заказ дает до двух тикетов — бар (категории напитков, см. services.is_drink_item) и кухня.
+Тикеты строятся из снимка зала floor_view, а не из БД: пока нет коммитов, десятки экранов,
+опрашивающих раз в секунду, получают один и тот же закэшированный список. После коммита,
+меняющего заказы ресторана, в комнаты kds_{restaurant_id}_{station} уходит kds_update.
+
+Действия:
+- bump — цех отдал свой тикет, он уходит с экрана (recall — вернуть). Если в заказ потом
+  дозаказали позиции этого цеха, тикет появляется снова;
+- complete — заказ готов целиком: статус "Доставляется", как при смене статуса из админки.
+Отметки bump и время появления тикета хранятся в памяти процесса (как и снимок зала):
+при нескольких воркерах экраны одного ресторана должны ходить в один и тот же.
+"""
+import datetime
+import threading
+
+from flask import Blueprint, request, jsonify, render_template
+from flask_login import login_required, current_user
+
+from models import SessionLocal, Order, OrderStatus
+from services import log_audit
+import floor_view
+import waiter_hints
+
+kds_bp = Blueprint('kitchen_display', __name__)
+
+STATIONS = ("kitchen", "bar")
+BUMPED_SHOWN = 10  # Сколько последних отданных тикетов показываем для recall
+
+_lock = threading.Lock()
+_started = {}  # (restaurant_id, order_id) -> когда тикеты заказа впервые появились на экране
+_bumped = {}  # (restaurant_id, order_id, station) -> (состав тикета на момент bump, bumped_at)
+_cache = {}  # restaurant_id -> (снимок, версия отметок, {station: (tickets, bumped)})
+_version = [0]
+_socketio = None
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _build(restaurant_id, view):
+    """Под замком: тикеты по цехам из снимка. Заодно забывает заказы, которые уже не готовятся."""
+    now = _utcnow()
+    tickets = {station: [] for station in STATIONS}
+    bumped = {station: [] for station in STATIONS}
+    cooking = set()
+
+    for oid in view.active_ids:
+        rec = view.orders[oid]
+        if rec.status != OrderStatus.IN_PROGRESS: continue
+        cooking.add(oid)
+        started = _started.setdefault((restaurant_id, oid), rec.updated_at or now)
+        for station in STATIONS:
+            items = [i for i in rec.items if i.station == station]
+            if not items: continue
+            ticket = {
+                "id": f"{oid}-{station}",
+                "order_id": oid,
+                "station": station,
+                "table": rec.table_number,
+                "items": [{"name": i.name, "quantity": i.quantity} for i in items],
+                "started_at": started,
+            }
+            mark = _bumped.get((restaurant_id, oid, station))
+            if mark and mark[0] == tuple((i.id, i.quantity) for i in items):
+                bumped[station].append(dict(ticket, bumped_at=mark[1]))
+            else:
+                tickets[station].append(ticket)
+
+    for key in [k for k in _started if k[0] == restaurant_id and k[1] not in cooking]:
+        del _started[key]
+    for key in [k for k in _bumped if k[0] == restaurant_id and k[1] not in cooking]:
+        del _bumped[key]
+
+    result = {}
+    for station in STATIONS:
+        tickets[station].sort(key=lambda t: (t["started_at"], t["order_id"]))  # Самые старые первыми
+        bumped[station].sort(key=lambda t: t["bumped_at"], reverse=True)
+        result[station] = (tickets[station], bumped[station][:BUMPED_SHOWN])
+    return result
+
+
+def get_tickets(restaurant_id, station):
+    """(tickets, bumped) цеха. БД читается, только если снимок зала устарел."""
+    restaurant_id = int(restaurant_id)
+    view = floor_view.get_view(restaurant_id)
+    with _lock:
+        cached = _cache.get(restaurant_id)
+        if not cached or cached[0] is not view or cached[1] != _version[0]:
+            cached = _cache[restaurant_id] = (view, _version[0], _build(restaurant_id, view))
+    return cached[2][station]
+
+
+def _ticket_items(restaurant_id, order_id, station):
+    view = floor_view.get_view(restaurant_id)
+    rec = view.orders.get(order_id)
+    if not rec or rec.status != OrderStatus.IN_PROGRESS: return None
+    items = tuple((i.id, i.quantity) for i in rec.items if i.station == station)
+    return items or None
+
+
+def bump(restaurant_id, order_id, station):
+    items = _ticket_items(restaurant_id, order_id, station)
+    if items is None: return False
+    with _lock:
+        _bumped[(int(restaurant_id), order_id, station)] = (items, _utcnow())
+        _version[0] += 1
+    _emit(restaurant_id, (station,))
+    return True
+
+
+def recall(restaurant_id, order_id, station):
+    with _lock:
+        found = _bumped.pop((int(restaurant_id), order_id, station), None) is not None
+        _version[0] += 1
+    if found: _emit(restaurant_id, (station,))
+    return found
+
+
+# --- Socket.IO ---
+
+def room(restaurant_id, station):
+    return f"kds_{restaurant_id}_{station}"
+
+
+def _emit(restaurant_id, stations=STATIONS):
+    if _socketio is None: return
+    for station in stations:
+        _socketio.emit('kds_update', {'station': station}, room=room(restaurant_id, station))
+
+
+def _on_floor_change(restaurant_ids):
+    # Уведомляем только рестораны, чьи экраны уже открывались (есть в кэше)
+    with _lock:
+        known = set(_cache)
+    for rid in known if restaurant_ids is None else known & set(restaurant_ids):
+        _emit(rid)
+
+
+def init_socketio(socketio):
+    """Подключает рассылку kds_update в комнаты экранов после коммитов."""
+    global _socketio
+    _socketio = socketio
+    floor_view.add_listener(_on_floor_change)
+
+
+# --- Flask ---
+
+def _staff_restaurant():
+    if current_user.role not in ['admin', 'waiter']: return None
+    return current_user.restaurant_id
+
+
+def _ticket_json(ticket, now):
+    data = dict(ticket, started_at=ticket["started_at"].isoformat(),
+                age_seconds=max(0, int((now - ticket["started_at"]).total_seconds())))
+    if "bumped_at" in data: data["bumped_at"] = data["bumped_at"].isoformat()
+    return data
+
+
+@kds_bp.route("/kitchen")
+@login_required
+def kitchen_page():
+    rid = _staff_restaurant()
+    if not rid: return jsonify({"error": "Доступ запрещен"}), 403
+    station = request.args.get("station", "kitchen")
+    if station not in STATIONS: station = "kitchen"
+    return render_template("kitchen.html", restaurant_id=rid, station=station)
+
+
+@kds_bp.route("/api/kds/<station>")
+@login_required
+def kds_tickets(station):
+    rid = _staff_restaurant()
+    if not rid: return jsonify({"error": "Доступ запрещен"}), 403
+    if station not in STATIONS: return jsonify({"error": "Unknown station"}), 404
+
+    tickets, bumped = get_tickets(rid, station)
+    now = _utcnow()
+    return jsonify({
+        "station": station,
+        "room": room(rid, station),
+        "tickets": [_ticket_json(t, now) for t in tickets],
+        "bumped": [_ticket_json(t, now) for t in bumped],
+    })
+
+
+@kds_bp.route("/api/kds/<station>/<int:order_id>/bump", methods=["POST"])
+@login_required
+def kds_bump(station, order_id):
+    rid = _staff_restaurant()
+    if not rid: return jsonify({"error": "Доступ запрещен"}), 403
+    if station not in STATIONS: return jsonify({"error": "Unknown station"}), 404
+    if not bump(rid, order_id, station): return jsonify({"error": "Ticket not found"}), 404
+    return jsonify({"success": True})
+
+
+@kds_bp.route("/api/kds/<station>/<int:order_id>/recall", methods=["POST"])
+@login_required
+def kds_recall(station, order_id):
+    rid = _staff_restaurant()
+    if not rid: return jsonify({"error": "Доступ запрещен"}), 403
+    if station not in STATIONS: return jsonify({"error": "Unknown station"}), 404
+    if not recall(rid, order_id, station): return jsonify({"error": "Ticket not found"}), 404
+    return jsonify({"success": True})
+
+
+@kds_bp.route("/api/kds/orders/<int:order_id>/complete", methods=["POST"])
+@login_required
+def kds_complete(order_id):
+    rid = _staff_restaurant()
+    if not rid: return jsonify({"error": "Доступ запрещен"}), 403
+
+    with SessionLocal() as db:
+        order = db.query(Order).get(order_id)
+        if not order or order.restaurant_id != rid: return jsonify({"error": "Not found"}), 404
+        if order.status != OrderStatus.IN_PROGRESS:
+            return jsonify({"error": "Заказ не готовится", "status": order.status.value}), 409
+
+        order.status = OrderStatus.DELIVERY
+        log_audit(db, rid, 'status_change', f"{OrderStatus.IN_PROGRESS.value} -> {OrderStatus.DELIVERY.value}",
+                  current_user.role, current_user.id, order.id,
+                  payload={"from": OrderStatus.IN_PROGRESS.value, "to": OrderStatus.DELIVERY.value, "source": "kds"})
+        db.commit()  # Экраны кухни обновит рассылка после коммита
+        waiter_hints.mark_dirty(rid)
+
+        if _socketio is not None:
+            _socketio.emit('status_change', {'order_id': order.id, 'status': order.status.value},
+                           room=f"rest_{rid}")
+            if order.table:
+                _socketio.emit('status_change', {'status': order.status.value}, room=order.table.public_token)
+    return jsonify({"success": True})
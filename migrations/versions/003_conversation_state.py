@@ -0,0 +1,32 @@
+"""conversation state, cart digest and menu version
+
+Revision ID: 003
+Revises: 002
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '003'
+down_revision = '002'
+
+
+def upgrade() -> None:
+    op.add_column('restaurants', sa.Column('menu_version', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('orders', sa.Column('cart_digest', sa.Text(), nullable=True))
+
+    op.create_table('conversation_states',
+                    sa.Column('order_id', sa.Integer(), nullable=False),
+                    sa.Column('summary', sa.Text(), nullable=True),
+                    sa.Column('recent_messages', sa.Text(), nullable=True),
+                    sa.Column('turn_count', sa.Integer(), nullable=True),
+                    sa.Column('menu_version', sa.Integer(), nullable=True),
+                    sa.Column('updated_at', sa.DateTime(), nullable=True),
+                    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('order_id')
+                    )
+
+
+def downgrade() -> None:
+    op.drop_table('conversation_states')
+    op.drop_column('orders', 'cart_digest')
+    op.drop_column('restaurants', 'menu_version')
@@ -0,0 +1,20 @@
+"""orders.updated_at watermark index
+
+Revision ID: 004
+Revises: 003
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '004'
+down_revision = '003'
+
+
+def upgrade() -> None:
+    # Старые заказы: updated_at мог остаться пустым — берем время создания
+    op.execute(sa.text("UPDATE orders SET updated_at = created_at WHERE updated_at IS NULL"))
+    op.create_index('ix_orders_restaurant_id_updated_at', 'orders', ['restaurant_id', 'updated_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_orders_restaurant_id_updated_at', table_name='orders')
@@ -0,0 +1,46 @@
+"""sales rollups for analytics
+
+Revision ID: 005
+Revises: 004
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '005'
+down_revision = '004'
+
+
+def upgrade() -> None:
+    op.add_column('orders', sa.Column('rolled_up', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+    op.create_table('sales_rollups',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('restaurant_id', sa.Integer(), nullable=False),
+                    sa.Column('hour', sa.DateTime(), nullable=False),
+                    sa.Column('order_count', sa.Integer(), nullable=False),
+                    sa.Column('revenue', sa.Float(), nullable=False),
+                    sa.ForeignKeyConstraint(['restaurant_id'], ['restaurants.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('restaurant_id', 'hour', name='uq_sales_rollups_restaurant_hour')
+                    )
+    op.create_table('sales_item_rollups',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('restaurant_id', sa.Integer(), nullable=False),
+                    sa.Column('hour', sa.DateTime(), nullable=False),
+                    sa.Column('menu_item_id', sa.Integer(), nullable=False),
+                    sa.Column('item_name', sa.String(), nullable=True),
+                    sa.Column('quantity', sa.Integer(), nullable=False),
+                    sa.Column('revenue', sa.Float(), nullable=False),
+                    sa.Column('order_count', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['restaurant_id'], ['restaurants.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('restaurant_id', 'hour', 'menu_item_id',
+                                        name='uq_sales_item_rollups_restaurant_hour_item')
+                    )
+    # Заказы, доставленные до миграции, учитываются командой: python analytics.py backfill
+
+
+def downgrade() -> None:
+    op.drop_table('sales_item_rollups')
+    op.drop_table('sales_rollups')
+    op.drop_column('orders', 'rolled_up')
@@ -0,0 +1,27 @@
+"""audit log payload and composite indexes
+
+Revision ID: 006
+Revises: 005
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '006'
+down_revision = '005'
+
+
+def upgrade() -> None:
+    op.add_column('audit_logs', sa.Column('payload', sa.JSON(none_as_null=True), nullable=True))
+    op.create_index('ix_audit_logs_restaurant_id_timestamp', 'audit_logs', ['restaurant_id', 'timestamp'])
+    op.create_index('ix_audit_logs_order_id_timestamp', 'audit_logs', ['order_id', 'timestamp'])
+    # Одиночные индексы покрыты составными (тот же первый столбец) — лишняя запись на каждую строку
+    op.drop_index('ix_audit_logs_restaurant_id', table_name='audit_logs')
+    op.drop_index('ix_audit_logs_order_id', table_name='audit_logs')
+
+
+def downgrade() -> None:
+    op.create_index('ix_audit_logs_order_id', 'audit_logs', ['order_id'])
+    op.create_index('ix_audit_logs_restaurant_id', 'audit_logs', ['restaurant_id'])
+    op.drop_index('ix_audit_logs_order_id_timestamp', table_name='audit_logs')
+    op.drop_index('ix_audit_logs_restaurant_id_timestamp', table_name='audit_logs')
+    op.drop_column('audit_logs', 'payload')
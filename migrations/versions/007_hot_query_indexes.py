@@ -0,0 +1,46 @@
+"""composite and partial indexes for hot queries
+
+Revision ID: 007
+Revises: 006
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '007'
+down_revision = '006'
+
+
+def upgrade() -> None:
+    op.create_index('ix_orders_restaurant_id_status', 'orders', ['restaurant_id', 'status'])
+    op.create_index('ix_orders_table_id_status', 'orders', ['table_id', 'status'])
+    # Частичный: строки без Telegram в индекс не попадают (SQLite тоже умеет для "= ?")
+    op.create_index('ix_orders_telegram_chat_id_status', 'orders', ['telegram_chat_id', 'status'],
+                    postgresql_where=sa.text("telegram_chat_id IS NOT NULL"),
+                    sqlite_where=sa.text("telegram_chat_id IS NOT NULL"))
+    op.create_index('ix_chat_messages_order_id_timestamp', 'chat_messages', ['order_id', 'timestamp'])
+    # order_items.order_id раньше не индексировался вовсе — каждая корзина читалась полным сканом
+    op.create_index('ix_order_items_order_id_menu_item_id_is_paid', 'order_items',
+                    ['order_id', 'menu_item_id', 'is_paid'])
+    op.create_index('ix_menu_items_restaurant_id_is_active_sort_order', 'menu_items',
+                    ['restaurant_id', 'is_active', 'sort_order'])
+    op.create_index('ix_service_signals_restaurant_id_is_active', 'service_signals', ['restaurant_id', 'is_active'],
+                    postgresql_where=sa.text("is_active"))
+
+    # Одиночные индексы с тем же первым столбцом, что у составных, — лишняя запись на каждую строку
+    op.drop_index('ix_orders_restaurant_id', table_name='orders')
+    op.drop_index('ix_orders_table_id', table_name='orders')
+    op.drop_index('ix_orders_telegram_chat_id', table_name='orders')
+
+
+def downgrade() -> None:
+    op.create_index('ix_orders_telegram_chat_id', 'orders', ['telegram_chat_id'])
+    op.create_index('ix_orders_table_id', 'orders', ['table_id'])
+    op.create_index('ix_orders_restaurant_id', 'orders', ['restaurant_id'])
+
+    op.drop_index('ix_service_signals_restaurant_id_is_active', table_name='service_signals')
+    op.drop_index('ix_menu_items_restaurant_id_is_active_sort_order', table_name='menu_items')
+    op.drop_index('ix_order_items_order_id_menu_item_id_is_paid', table_name='order_items')
+    op.drop_index('ix_chat_messages_order_id_timestamp', table_name='chat_messages')
+    op.drop_index('ix_orders_telegram_chat_id_status', table_name='orders')
+    op.drop_index('ix_orders_table_id_status', table_name='orders')
+    op.drop_index('ix_orders_restaurant_id_status', table_name='orders')
@@ -0,0 +1,18 @@
+"""order rollup lines snapshot
+
+Revision ID: 008
+Revises: 007
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '008'
+down_revision = '007'
+
+
+def upgrade() -> None:
+    op.add_column('orders', sa.Column('rollup_lines', sa.JSON(none_as_null=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('orders', 'rollup_lines')
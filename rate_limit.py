@@ -0,0 +1,304 @@
+"""
+Rate limiting для публичных эндпоинтов и защита логина от перебора.
+
+Алгоритм — token bucket: на ключ хранится только (tokens, updated), проверка O(1).
+"limit раз в window секунд" = ведро емкостью limit, пополняется со скоростью limit/window.
+
+Хранилища (RATE_LIMIT_BACKEND):
+- memory — в процессе: шардированные замки, LRU-вытеснение простаивающих ключей;
+- sqlite — общий файл (RATE_LIMIT_SQLITE_PATH), лимиты держатся между воркерами на одной машине;
+- redis  — RATE_LIMIT_REDIS_URL, атомарный Lua-скрипт, ключи сами истекают (нужен пакет redis).
+Если общее хранилище недоступно, пропускаем запрос (fail open) — лимитер не должен ронять сервис.
+
+Ключи: IP, токен стола (table_token), токен гостя (заголовок Guest-Token).
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, jsonify
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", "ratelimit.db")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+MEMORY_SHARDS = 16
+MEMORY_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))  # На все шарды; защита от сканеров
+
+# Логин: неудачных попыток на пару (пользователь, IP) / со всего IP за окно.
+# Лимит IP выше: персонал ресторана часто выходит в сеть с одного адреса
+LOGIN_MAX_FAILURES = int(os.getenv("LOGIN_MAX_FAILURES", 5))
+LOGIN_IP_MAX_FAILURES = int(os.getenv("LOGIN_IP_MAX_FAILURES", 20))
+LOGIN_WINDOW = int(os.getenv("LOGIN_WINDOW", 300))
+
+
+def _refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + max(0.0, now - updated) * rate)
+
+
+def _retry_after(tokens, rate, cost):
+    return max(0.0, (cost - tokens) / rate)
+
+
+# --- Хранилища ---
+
+class MemoryBackend:
+    """
+    Ведра в памяти процесса. Ключи раскиданы по шардам, у каждого свой замок, чтобы потоки
+    не толкались на одном. Шард — OrderedDict в порядке последнего обращения: в начале всегда
+    самые старые ключи, их и вытесняем, когда ведро уже полное (ключ простаивает) или шард переполнен.
+    """
+
+    def __init__(self, shards=MEMORY_SHARDS, max_keys=MEMORY_MAX_KEYS):
+        self._shards = [(threading.Lock(), OrderedDict()) for _ in range(shards)]
+        self._max_per_shard = max(1, max_keys // shards)
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _evict(self, buckets, now):
+        # Не больше нескольких ключей за вызов — стоимость остается O(1)
+        for _ in range(8):
+            if not buckets: return
+            key, (tokens, updated, rate, burst) = next(iter(buckets.items()))
+            if len(buckets) > self._max_per_shard or _refill(tokens, updated, now, rate, burst) >= burst:
+                buckets.popitem(last=False)
+            else:
+                return
+
+    def hit(self, key, rate, burst, cost=1, now=None):
+        now = now or time.time()
+        lock, buckets = self._shard(key)
+        with lock:
+            state = buckets.pop(key, None)
+            tokens = burst if state is None else _refill(state[0], state[1], now, rate, burst)
+            allowed = tokens >= cost
+            if allowed: tokens -= cost
+            buckets[key] = (tokens, now, rate, burst)
+            self._evict(buckets, now)
+        return allowed, 0.0 if allowed else _retry_after(tokens, rate, cost)
+
+    def peek(self, key, rate, burst, cost=1, now=None):
+        now = now or time.time()
+        lock, buckets = self._shard(key)
+        with lock:
+            state = buckets.get(key)
+        tokens = burst if state is None else _refill(state[0], state[1], now, rate, burst)
+        return tokens >= cost, _retry_after(tokens, rate, cost)
+
+    def reset(self, key):
+        lock, buckets = self._shard(key)
+        with lock:
+            buckets.pop(key, None)
+
+
+class SQLiteBackend:
+    """
+    Общий для всех воркеров файл. Каждая проверка — одна короткая транзакция BEGIN IMMEDIATE.
+    full_at — момент, когда ведро снова полное: строки старше него можно удалять.
+    """
+
+    def __init__(self, path=RATE_LIMIT_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._calls = 0
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets ("
+                         "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_rate_buckets_full_at ON rate_buckets (full_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _evict(self, conn, now):
+        self._calls += 1
+        if self._calls % 1000 == 0:
+            conn.execute("DELETE FROM rate_buckets WHERE full_at < ?", (now,))
+
+    def hit(self, key, rate, burst, cost=1, now=None):
+        now = now or time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens = burst if row is None else _refill(row[0], row[1], now, rate, burst)
+            allowed = tokens >= cost
+            if allowed: tokens -= cost
+            conn.execute("INSERT OR REPLACE INTO rate_buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                         (key, tokens, now, now + (burst - tokens) / rate))
+            self._evict(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, 0.0 if allowed else _retry_after(tokens, rate, cost)
+
+    def peek(self, key, rate, burst, cost=1, now=None):
+        now = now or time.time()
+        row = self._conn().execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+        tokens = burst if row is None else _refill(row[0], row[1], now, rate, burst)
+        return tokens >= cost, _retry_after(tokens, rate, cost)
+
+    def reset(self, key):
+        self._conn().execute("DELETE FROM rate_buckets WHERE key = ?", (key,))
+
+
+_REDIS_HIT = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 't'))
+local updated = tonumber(redis.call('HGET', KEYS[1], 'u'))
+local now, rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+if tokens == nil then tokens = burst else tokens = math.min(burst, tokens + math.max(0, now - updated) * rate) end
+local allowed = 0
+if tokens >= cost then tokens = tokens - cost; allowed = 1 end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'u', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBackend:
+    """Ведро — хэш в Redis, обновляется атомарно Lua-скриптом; TTL = время до полного ведра."""
+
+    def __init__(self, url=RATE_LIMIT_REDIS_URL):
+        import redis  # Необязательная зависимость: нужна только для RATE_LIMIT_BACKEND=redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self._hit = self.client.register_script(_REDIS_HIT)
+
+    def hit(self, key, rate, burst, cost=1, now=None):
+        allowed, tokens = self._hit(keys=[f"rl:{key}"], args=[now or time.time(), rate, burst, cost])
+        tokens = float(tokens)
+        return bool(allowed), 0.0 if allowed else _retry_after(tokens, rate, cost)
+
+    def peek(self, key, rate, burst, cost=1, now=None):
+        tokens, updated = self.client.hmget(f"rl:{key}", "t", "u")
+        tokens = burst if tokens is None else _refill(float(tokens), float(updated), now or time.time(), rate, burst)
+        return tokens >= cost, _retry_after(tokens, rate, cost)
+
+    def reset(self, key):
+        self.client.delete(f"rl:{key}")
+
+
+def create_backend(name=RATE_LIMIT_BACKEND):
+    if name == "redis": return RedisBackend()
+    if name == "sqlite": return SQLiteBackend()
+    return MemoryBackend()
+
+
+class RateLimiter:
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = create_backend()
+        return self._backend
+
+    def hit(self, key, limit, window, cost=1):
+        """Возвращает (allowed, retry_after_seconds). limit запросов за window секунд."""
+        try:
+            return self.backend.hit(key, limit / window, limit, cost)
+        except Exception as e:
+            logger.error(f"Rate limiter error: {e}")
+            return True, 0.0
+
+    def peek(self, key, limit, window, cost=1):
+        try:
+            return self.backend.peek(key, limit / window, limit, cost)
+        except Exception as e:
+            logger.error(f"Rate limiter error: {e}")
+            return True, 0.0
+
+    def reset(self, key):
+        try:
+            self.backend.reset(key)
+        except Exception as e:
+            logger.error(f"Rate limiter error: {e}")
+
+
+limiter = RateLimiter()
+
+
+# --- Flask ---
+
+def _key_values(scope):
+    """Значение ключа для области: ip / table (table_token) / guest (Guest-Token)."""
+    if scope == "ip":
+        return request.remote_addr
+    if scope == "guest":
+        return request.headers.get("Guest-Token")
+    if scope == "table":
+        data = request.get_json(silent=True)
+        value = data.get("table_token") if isinstance(data, dict) else None
+        return value or request.args.get("table_token")
+    raise ValueError(f"Unknown rate limit scope: {scope}")
+
+
+def check_rate_limit(limit=5, window=60, scopes=("ip",)):
+    """
+    Ограничивает вызовы endpoint: limit раз в window секунд отдельно для каждого ключа из scopes
+    ("ip", "table", "guest"). Запрос проходит, только если не упирается ни в один из лимитов.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            for scope in scopes:
+                value = _key_values(scope)
+                if not value: continue
+                allowed, retry_after = limiter.hit(f"{request.endpoint}:{scope}:{value}", limit, window)
+                if not allowed:
+                    res = jsonify({"error": "Too many requests. Chill out."})
+                    res.headers["Retry-After"] = str(int(retry_after) + 1)
+                    return res, 429
+            return f(*args, **kwargs)
+
+        return wrapped
+
+    return decorator
+
+
+class LoginGuard:
+    """
+    Защита от перебора паролей: считаем неудачные попытки по паре (пользователь, IP) и по IP.
+    Счетчика на одно имя пользователя нет — иначе кто угодно мог бы заблокировать админа,
+    просто вводя его логин. Успешный вход сбрасывает счетчик пары.
+    """
+
+    def __init__(self, rate_limiter):
+        self.limiter = rate_limiter
+
+    def _keys(self, ip, username):
+        keys = [(f"login:ip:{ip}", LOGIN_IP_MAX_FAILURES)]
+        if username: keys.append((f"login:user:{username.lower()}:{ip}", LOGIN_MAX_FAILURES))
+        return keys
+
+    def retry_after(self, ip, username=None):
+        """Через сколько секунд можно пробовать снова; 0 — вход не заблокирован."""
+        waits = [wait for allowed, wait in (self.limiter.peek(key, limit, LOGIN_WINDOW)
+                                            for key, limit in self._keys(ip, username)) if not allowed]
+        return max(waits, default=0.0)
+
+    def register_failure(self, ip, username=None):
+        for key, limit in self._keys(ip, username):
+            self.limiter.hit(key, limit, LOGIN_WINDOW)
+
+    def reset(self, ip, username=None):
+        if username: self.limiter.reset(f"login:user:{username.lower()}:{ip}")
+
+
+login_guard = LoginGuard(limiter)
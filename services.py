@@ -1,34 +1,86 @@
 import datetime
-from sqlalchemy.orm import joinedload
-from models import Order, OrderItem, MenuItem, Table, AuditLog, OrderStatus, ServiceSignal
+import json
+import threading
+from models import Order, OrderItem, MenuItem, Table, OrderStatus, Restaurant, ChatMessage
+import audit_writer
 
 # --- HELPERS: CORE LOGIC ---
 
 def recalculate_order_total(db, order):
-    """Пересчитывает сумму заказа."""
+    """Пересчитывает сумму заказа (и компактный снимок корзины для AI)."""
     total = 0.0
+    digest = {}
     for item in order.items:
         total += item.menu_item.price * item.quantity
+        key = str(item.menu_item_id)
+        digest[key] = digest.get(key, 0) + item.quantity
     order.total_price = total
+    order.cart_digest = json.dumps(digest)
     return total
 
-def log_audit(db, rest_id, action, details, actor_type, actor_id, order_id=None):
-    """Записывает действие в AuditLog"""
-    log_entry = AuditLog(
-        restaurant_id=rest_id,
-        order_id=order_id,
-        actor_type=actor_type,
-        actor_id=str(actor_id),
-        action=action,
-        details=details
-    )
-    db.add(log_entry)
+def get_cart_digest(order):
+    """{str(menu_item_id): qty} без загрузки позиций, если снимок уже есть."""
+    if order.cart_digest is not None:
+        return json.loads(order.cart_digest)
+    digest = {}
+    for i in order.items:
+        digest[str(i.menu_item_id)] = digest.get(str(i.menu_item_id), 0) + i.quantity
+    return digest
+
+# --- Кэш меню для AI: {restaurant_id: (menu_version, [{'id', 'name', 'price'}])} ---
+_menu_cache = {}
+_menu_lock = threading.Lock()
+
+def get_menu_snapshot(db, restaurant_id, menu_version=None):
+    """Меню ресторана из кэша процесса. Перечитывается из БД только при смене Restaurant.menu_version."""
+    restaurant_id = int(restaurant_id)
+    if menu_version is None:
+        menu_version = db.query(Restaurant.menu_version).filter(Restaurant.id == restaurant_id).scalar() or 0
+
+    with _menu_lock:
+        cached = _menu_cache.get(restaurant_id)
+    if cached and cached[0] == menu_version:
+        return cached[1]
+
+    items = [{"id": i.id, "name": i.name, "price": i.price} for i in
+             db.query(MenuItem).filter(MenuItem.restaurant_id == restaurant_id).all()]
+    with _menu_lock:
+        _menu_cache[restaurant_id] = (menu_version, items)
+    return items
+
+def bump_menu_version(db, restaurant_id):
+    """Вызывать при любом изменении блюд/категорий (в той же транзакции)."""
+    db.query(Restaurant).filter(Restaurant.id == restaurant_id).update(
+        {Restaurant.menu_version: Restaurant.menu_version + 1}, synchronize_session=False)
+
+def log_audit(db, rest_id, action, details, actor_type, actor_id, order_id=None, payload=None):
+    """
+    Записывает действие в AuditLog: после коммита db строка уйдет в БД фоновым писателем (audit_writer).
+    details — текст для человека, payload — те же данные словарем (для фильтров и отчетов).
+    """
+    audit_writer.record(db, {
+        "restaurant_id": rest_id,
+        "order_id": order_id,
+        "actor_type": actor_type,
+        "actor_id": str(actor_id),
+        "action": action,
+        "details": details,
+        "payload": payload,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc),
+    })
 
 def get_cart_text(order):
     if not order or not order.items: return "Корзина пуста."
     summary = [f"- {i.menu_item.name} x{i.quantity}" for i in order.items]
     return "В КОРЗИНЕ:\n" + "\n".join(summary)
 
+DRINK_CATEGORIES = ('напитки', 'drinks', 'bar', 'бар')
+
+def is_drink_item(menu_item):
+    """Блюдо из барной категории: готовит бар, а не кухня; его можно дозаказать в готовящийся заказ."""
+    if not menu_item: return False
+    return any(c.name.lower() in DRINK_CATEGORIES for c in menu_item.categories)
+
 def find_item_by_name(db, name_query, restaurant_id):
     items = db.query(MenuItem).filter(MenuItem.restaurant_id == restaurant_id).all()
     for i in items:
@@ -44,16 +96,20 @@ def resolve_table_by_token(db, restaurant_id, table_token):
     if not table.is_active: return None, "Table inactive"
     return table, None
 
-def get_or_create_cart(db, restaurant_id, table_token, guest_token=None, guest_name=None):
-    table_obj, error = resolve_table_by_token(db, restaurant_id, table_token)
-    if error: return None, error
-
-    active_order = db.query(Order).filter(
+def find_active_order(db, restaurant_id, table_obj, *options):
+    """Незакрытый заказ стола или None (без записи — годится для сессии только для чтения)."""
+    return db.query(Order).options(*options).filter(
         Order.restaurant_id == restaurant_id,
         Order.table_id == table_obj.id,
         Order.status.notin_([OrderStatus.CANCELED, OrderStatus.SUCCESSFULLY_DELIVERED])
     ).first()
 
+def get_or_create_cart(db, restaurant_id, table_token, guest_token=None, guest_name=None):
+    table_obj, error = resolve_table_by_token(db, restaurant_id, table_token)
+    if error: return None, error
+
+    active_order = find_active_order(db, restaurant_id, table_obj)
+
     if not active_order:
         active_order = Order(
             restaurant_id=restaurant_id,
@@ -68,6 +124,69 @@ def get_or_create_cart(db, restaurant_id, table_token, guest_token=None, guest_n
         db.commit()
     return active_order, None
 
+def bind_telegram_chat(db, token, chat_id):
+    """Связывает Telegram chat_id с черновиком заказа стола (token = table.public_token). Возвращает стол или None."""
+    table = db.query(Table).filter_by(public_token=token).first()
+    if not table: return None
+
+    order = db.query(Order).filter(
+        Order.table_id == table.id,
+        Order.status == OrderStatus.BASKET_ASSEMBLY
+    ).first()
+
+    if not order:
+        order = Order(
+            restaurant_id=table.restaurant_id,
+            table_id=table.id,
+            table_number=table.number,
+            status=OrderStatus.BASKET_ASSEMBLY,
+            is_bot_active=True
+        )
+        db.add(order)
+
+    order.telegram_chat_id = str(chat_id)
+    db.commit()
+    return table
+
+def accept_chat_message(db, user_msg, telegram_chat_id=None, table_token=None):
+    """
+    Общий вход чата для /api/chat и Telegram webhook: находит черновик заказа
+    (по привязке Telegram или токену стола) и сохраняет сообщение гостя.
+    Возвращает (order, status): 'no_order' | 'waiting_for_admin' | 'queued' (пора запускать AI).
+    """
+    order = None
+    if telegram_chat_id:
+        order = db.query(Order).filter(
+            Order.telegram_chat_id == str(telegram_chat_id),
+            Order.status == OrderStatus.BASKET_ASSEMBLY
+        ).order_by(Order.id.desc()).first()
+    elif table_token:
+        table_obj = db.query(Table).filter_by(public_token=table_token).first()
+        if table_obj:
+            order = db.query(Order).filter(
+                Order.table_id == table_obj.id,
+                Order.status == OrderStatus.BASKET_ASSEMBLY
+            ).first()
+            if not order:  # Создаем черновик для веб-чата
+                order = Order(
+                    restaurant_id=table_obj.restaurant_id,
+                    table_id=table_obj.id,
+                    table_number=table_obj.number,
+                    status=OrderStatus.BASKET_ASSEMBLY,
+                    is_bot_active=True
+                )
+                db.add(order)
+                db.commit()
+
+    if not order: return None, 'no_order'
+
+    db.add(ChatMessage(order_id=order.id, sender='user', content=user_msg))
+    order.last_activity = datetime.datetime.now(datetime.timezone.utc)
+    db.commit()
+
+    if not order.is_bot_active: return order, 'waiting_for_admin'
+    return order, 'queued'
+
 def execute_actions(db, order, actions, restaurant_id):
     """
     Выполняет JSON-действия от AI.
@@ -78,6 +197,11 @@ def execute_actions(db, order, actions, restaurant_id):
     for action in actions:
         if isinstance(action, str): continue
         atype = action.get('type')
+        if atype == 'clear_cart':
+            # Без item_name: проверка имени ниже только для действий с позицией
+            db.query(OrderItem).filter(OrderItem.order_id == order.id).delete()
+            continue
+
         item_name = action.get('item_name') or action.get('remove_name') or action.get('add_name')
         if not item_name: continue
 
@@ -103,9 +227,6 @@ def execute_actions(db, order, actions, restaurant_id):
                 if existing: existing.quantity = qty
                 elif qty > 0: db.add(OrderItem(order_id=order.id, menu_item_id=item.id, quantity=qty))
 
-        elif atype == 'clear_cart':
-            db.query(OrderItem).filter(OrderItem.order_id == order.id).delete()
-
     db.commit()
     db.refresh(order)
     recalculate_order_total(db, order)
@@ -0,0 +1,340 @@
+"""
+Колоночные снимки данных для офлайн-анализа (Arrow IPC / Feather v2).
+
+Вместо копирования restaurant.db аналитики берут файлы:
+    {SNAPSHOT_DIR}/restaurant_{id}/orders/YYYY-MM.arrow       — заказ на строку
+    {SNAPSHOT_DIR}/restaurant_{id}/order_items/YYYY-MM.arrow  — позиция на строку
+    {SNAPSHOT_DIR}/restaurant_{id}/chat_stats/YYYY-MM.arrow   — сообщения по заказу
+    {SNAPSHOT_DIR}/restaurant_{id}/menu_items.arrow           — меню на момент снимка
+Месяц — по дате создания заказа; в месяц входят и заказы из архива (archive.py).
+Читаются без pandas и без загрузки в память:
+    pyarrow.feather.read_table(path, memory_map=True)
+Сжатие SNAPSHOT_COMPRESSION (zstd; "uncompressed" — чтение без копирования буферов).
+
+Инкрементальность: для каждого месяца в _manifest.json хранится подпись (число заказов,
+максимальный updated_at, число и максимальный id сообщений чата в БД — новые сообщения
+updated_at заказа не трогают). Месяц пересобирается, только если подпись изменилась или
+файла еще нет; закрытые месяцы повторно не пишутся.
+
+Нужен пакет pyarrow (необязательная зависимость). Запуск:
+    python snapshots.py [--restaurant-id N] [--force]
+или POST /api/snapshots из админки.
+"""
+import os
+import json
+import argparse
+import datetime
+import logging
+import threading
+
+from flask import Blueprint, jsonify, send_file
+from flask_login import login_required, current_user
+from sqlalchemy import func
+
+from sqlalchemy.orm import selectinload
+
+from models import Order, ChatMessage, MenuItem, Restaurant
+from db_routing import read_session
+import archive
+import export
+
+logger = logging.getLogger(__name__)
+
+snapshots_bp = Blueprint('snapshots', __name__)
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_COMPRESSION = os.getenv("SNAPSHOT_COMPRESSION", "zstd")
+MONTH_TABLES = ("orders", "order_items", "chat_stats")
+
+_running = set()  # Рестораны, для которых сейчас идет сборка
+_running_lock = threading.Lock()
+
+
+def _pyarrow():
+    try:
+        import pyarrow  # Необязательная зависимость: нужна только для снимков
+        import pyarrow.feather
+    except ImportError:
+        raise RuntimeError("Для снимков нужен пакет pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def _dir(restaurant_id):
+    return os.path.join(SNAPSHOT_DIR, f"restaurant_{restaurant_id}")
+
+
+def _month_bounds(month):
+    start = datetime.datetime.strptime(month, "%Y-%m")
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def _naive_utc(dt):
+    if dt is None or dt.tzinfo is None: return dt
+    return dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _ts(value):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def _load_manifest(restaurant_id):
+    try:
+        with open(os.path.join(_dir(restaurant_id), "_manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"months": {}}
+
+
+def _save_manifest(restaurant_id, manifest):
+    path = os.path.join(_dir(restaurant_id), "_manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def _write(pa, path, columns, schema):
+    """Пишет таблицу атомарно (tmp + rename), чтобы читатель не увидел полфайла."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.table({name: pa.array(columns[name], type=type_) for name, type_ in schema})
+    pa.feather.write_feather(table, path + ".tmp", compression=SNAPSHOT_COMPRESSION)
+    os.replace(path + ".tmp", path)
+    return table.num_rows
+
+
+def _month_key(created_at):
+    return (_naive_utc(created_at) or datetime.datetime(1970, 1, 1)).strftime("%Y-%m")
+
+
+def _month_signatures(db, restaurant_id):
+    """
+    {месяц: подпись} по горячим заказам: created_at и updated_at заказов, плюс число и
+    максимальный id сообщений чата по заказу (без текстов).
+    """
+    stats = {}
+    rows = db.query(Order.created_at, Order.updated_at).filter(Order.restaurant_id == restaurant_id) \
+        .execution_options(yield_per=5000)
+    for created_at, updated_at in rows:
+        month = _month_key(created_at)
+        count, last = stats.get(month, (0, None))
+        updated_at = _naive_utc(updated_at or created_at)
+        stats[month] = (count + 1, max(last, updated_at) if last and updated_at else last or updated_at)
+
+    chat = {}
+    rows = db.query(Order.created_at, func.count(ChatMessage.id), func.max(ChatMessage.id)) \
+        .join(ChatMessage, ChatMessage.order_id == Order.id) \
+        .filter(Order.restaurant_id == restaurant_id).group_by(Order.id) \
+        .execution_options(yield_per=5000)
+    for created_at, messages, last_id in rows:
+        month = _month_key(created_at)
+        count, max_id = chat.get(month, (0, 0))
+        chat[month] = (count + messages, max(max_id, last_id or 0))
+
+    signatures = {}
+    for month, (count, last) in stats.items():
+        messages, max_id = chat.get(month, (0, 0))
+        signatures[month] = f"{count}:{last.isoformat() if last else ''}:{messages}:{max_id}"
+    return signatures
+
+
+def _hot_chat_stats(db, restaurant_id, start, end):
+    """{order_id: {sender: (count, first, last)}} одним GROUP BY по горячим сообщениям месяца."""
+    rows = db.query(
+        ChatMessage.order_id, ChatMessage.sender, func.count(ChatMessage.id),
+        func.min(ChatMessage.timestamp), func.max(ChatMessage.timestamp)
+    ).join(Order, Order.id == ChatMessage.order_id).filter(
+        Order.restaurant_id == restaurant_id, Order.created_at >= start, Order.created_at < end
+    ).group_by(ChatMessage.order_id, ChatMessage.sender)
+    stats = {}
+    for order_id, sender, count, first, last in rows:
+        stats.setdefault(order_id, {})[sender] = (count, first, last)
+    return stats
+
+
+def _archived_chat_stats(record):
+    stats = {}
+    for m in record.get("chat", ()):
+        ts = _ts(m["timestamp"])
+        count, first, last = stats.get(m["sender"], (0, ts, ts))
+        stats[m["sender"]] = (count + 1, min(first, ts) if first and ts else first or ts,
+                              max(last, ts) if last and ts else last or ts)
+    return stats
+
+
+def _build_month(pa, db, restaurant_id, month):
+    start, end = _month_bounds(month)
+    orders = {k: [] for k in ("id", "created_at", "updated_at", "status", "table_number", "waiter_name",
+                              "total_price", "paid_amount", "item_count")}
+    items = {k: [] for k in ("id", "order_id", "created_at", "menu_item_id", "name", "price", "quantity",
+                             "line_total", "is_paid")}
+    chat = {k: [] for k in ("order_id", "created_at", "messages", "user_messages", "bot_messages",
+                            "first_message_at", "last_message_at")}
+    chat_stats = _hot_chat_stats(db, restaurant_id, start, end)
+
+    # Архив и горячие заказы месяца потоком (см. export.iter_orders); копим только колонки месяца
+    seen = set()
+    for record in export.iter_orders(restaurant_id, start, end):
+        if record["id"] in seen: continue
+        seen.add(record["id"])
+        created_at = _ts(record["created_at"])
+        line_totals = [(i["price"] or 0.0) * i["quantity"] for i in record["items"]]
+        orders["id"].append(record["id"])
+        orders["created_at"].append(created_at)
+        orders["updated_at"].append(_ts(record.get("updated_at")))
+        orders["status"].append(record["status_label"])
+        orders["table_number"].append(record["table_number"])
+        orders["waiter_name"].append(record["waiter_name"])
+        orders["total_price"].append(record["total_price"])
+        orders["paid_amount"].append(sum(t for t, i in zip(line_totals, record["items"]) if i["is_paid"]))
+        orders["item_count"].append(sum(i["quantity"] for i in record["items"]))
+        for i, line_total in zip(record["items"], line_totals):
+            items["id"].append(i["id"])
+            items["order_id"].append(record["id"])
+            items["created_at"].append(created_at)
+            items["menu_item_id"].append(i["menu_item_id"])
+            items["name"].append(i["name"])
+            items["price"].append(i["price"])
+            items["quantity"].append(i["quantity"])
+            items["line_total"].append(line_total)
+            items["is_paid"].append(bool(i["is_paid"]))
+
+        senders = _archived_chat_stats(record) if "chat" in record else chat_stats.get(record["id"], {})
+        if senders:
+            firsts = [_naive_utc(s[1]) for s in senders.values() if s[1]]
+            lasts = [_naive_utc(s[2]) for s in senders.values() if s[2]]
+            chat["order_id"].append(record["id"])
+            chat["created_at"].append(created_at)
+            chat["messages"].append(sum(s[0] for s in senders.values()))
+            chat["user_messages"].append(senders.get("user", (0,))[0])
+            chat["bot_messages"].append(senders.get("bot", (0,))[0])
+            chat["first_message_at"].append(min(firsts) if firsts else None)
+            chat["last_message_at"].append(max(lasts) if lasts else None)
+
+    ts, i64, f64, s = pa.timestamp("us"), pa.int64(), pa.float64(), pa.string()
+    base = _dir(restaurant_id)
+    return {
+        "orders": _write(pa, os.path.join(base, "orders", f"{month}.arrow"), orders, [
+            ("id", i64), ("created_at", ts), ("updated_at", ts), ("status", s), ("table_number", i64),
+            ("waiter_name", s), ("total_price", f64), ("paid_amount", f64), ("item_count", i64)]),
+        "order_items": _write(pa, os.path.join(base, "order_items", f"{month}.arrow"), items, [
+            ("id", i64), ("order_id", i64), ("created_at", ts), ("menu_item_id", i64), ("name", s), ("price", f64),
+            ("quantity", i64), ("line_total", f64), ("is_paid", pa.bool_())]),
+        "chat_stats": _write(pa, os.path.join(base, "chat_stats", f"{month}.arrow"), chat, [
+            ("order_id", i64), ("created_at", ts), ("messages", i64), ("user_messages", i64), ("bot_messages", i64),
+            ("first_message_at", ts), ("last_message_at", ts)]),
+    }
+
+
+def _write_menu(pa, db, restaurant_id):
+    menu = {k: [] for k in ("id", "name", "price", "is_active", "stock", "categories")}
+    for m in db.query(MenuItem).options(selectinload(MenuItem.categories)).filter(
+            MenuItem.restaurant_id == restaurant_id).order_by(MenuItem.id):
+        menu["id"].append(m.id)
+        menu["name"].append(m.name)
+        menu["price"].append(m.price)
+        menu["is_active"].append(bool(m.is_active))
+        menu["stock"].append(m.stock)
+        menu["categories"].append([c.name for c in m.categories])
+    return _write(pa, os.path.join(_dir(restaurant_id), "menu_items.arrow"), menu, [
+        ("id", pa.int64()), ("name", pa.string()), ("price", pa.float64()), ("is_active", pa.bool_()),
+        ("stock", pa.int64()), ("categories", pa.list_(pa.string()))])
+
+
+def build_snapshots(restaurant_id, force=False):
+    """Пишет новые и изменившиеся месячные разделы ресторана. Возвращает список записанных месяцев."""
+    pa = _pyarrow()
+    manifest = _load_manifest(restaurant_id)
+    written = []
+    with read_session() as db:
+        signatures = _month_signatures(db, restaurant_id)
+        for month in archive.archived_months(restaurant_id):
+            signatures.setdefault(month, "archive")  # Только архив: раздел не меняется, пока есть файл
+
+        for month in sorted(signatures):
+            known = manifest["months"].get(month)
+            exists = all(os.path.exists(os.path.join(_dir(restaurant_id), t, f"{month}.arrow")) for t in MONTH_TABLES)
+            if not force and exists and known and (known["signature"] == signatures[month]
+                                                   or signatures[month] == "archive"):
+                continue
+            rows = _build_month(pa, db, restaurant_id, month)
+            manifest["months"][month] = {"signature": signatures[month], "rows": rows,
+                                         "written_at": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+            _save_manifest(restaurant_id, manifest)  # После каждого месяца: прерванный запуск не теряет готовое
+            written.append(month)
+
+        manifest["menu_items"] = {"rows": _write_menu(pa, db, restaurant_id),
+                                  "written_at": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+    _save_manifest(restaurant_id, manifest)
+    return written
+
+
+def build_all(force=False):
+    with read_session() as db:
+        rids = [r[0] for r in db.query(Restaurant.id).all()]
+    return {rid: build_snapshots(rid, force) for rid in rids}
+
+
+# --- Flask ---
+
+def _run_in_background(restaurant_id):
+    try:
+        months = build_snapshots(restaurant_id)
+        logger.warning(f"Snapshots for restaurant {restaurant_id}: wrote {months}")
+    except Exception as e:
+        logger.error(f"Snapshot Error: {e}")
+    finally:
+        with _running_lock:
+            _running.discard(restaurant_id)
+
+
+@snapshots_bp.route("/api/snapshots", methods=["GET"])
+@login_required
+def snapshots_list():
+    if current_user.role != 'admin': return jsonify({"error": "Доступ запрещен"}), 403
+    rid = current_user.restaurant_id
+    with _running_lock:
+        running = rid in _running
+    return jsonify(dict(_load_manifest(rid), running=running))
+
+
+@snapshots_bp.route("/api/snapshots", methods=["POST"])
+@login_required
+def snapshots_run():
+    if current_user.role != 'admin': return jsonify({"error": "Доступ запрещен"}), 403
+    try:
+        _pyarrow()
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 501
+    rid = current_user.restaurant_id
+    with _running_lock:
+        if rid in _running: return jsonify({"error": "Снимок уже собирается"}), 409
+        _running.add(rid)
+    threading.Thread(target=_run_in_background, args=(rid,), daemon=True).start()
+    return jsonify({"success": True}), 202
+
+
+@snapshots_bp.route("/api/snapshots/<table>/<month>.arrow")
+@login_required
+def snapshots_download(table, month):
+    if current_user.role != 'admin': return jsonify({"error": "Доступ запрещен"}), 403
+    if table not in MONTH_TABLES: return jsonify({"error": "Unknown table"}), 404
+    try:
+        _month_bounds(month)
+    except ValueError:
+        return jsonify({"error": "Not found"}), 404
+    path = os.path.abspath(os.path.join(_dir(current_user.restaurant_id), table, f"{month}.arrow"))
+    if not os.path.exists(path): return jsonify({"error": "Not found"}), 404
+    return send_file(path, mimetype="application/vnd.apache.arrow.file", as_attachment=True,
+                     download_name=f"{table}_{current_user.restaurant_id}_{month}.arrow")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Колоночные снимки заказов по месяцам")
+    parser.add_argument("--restaurant-id", type=int)
+    parser.add_argument("--force", action="store_true", help="Пересобрать все месяцы")
+    args = parser.parse_args()
+
+    if args.restaurant_id:
+        print({args.restaurant_id: build_snapshots(args.restaurant_id, args.force)})
+    else:
+        print(build_all(args.force))
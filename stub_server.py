@@ -0,0 +1,303 @@
+"""
+Локальная заглушка внешних API для нагрузочного тестирования (без трат на OpenAI/Gemini и лимитов Telegram).
+
+Эндпоинты:
+  POST /v1/chat/completions                      — OpenAI-совместимый (в т.ч. stream=True, SSE)
+  POST /bot<token>/sendMessage                   — Telegram Bot API
+  POST /v1beta/models/<model>:generateContent    — Gemini (возвращает картинку)
+
+Подключение приложения (см. assistant.py, tasks.py, ai_kitchen.py):
+  OPENAI_BASE_URL=http://127.0.0.1:8800/v1  OPENAI_API_KEY=stub
+  TELEGRAM_API_URL=http://127.0.0.1:8800
+  GOOGLE_API_BASE_URL=http://127.0.0.1:8800  GOOGLE_API_KEY=stub
+
+Режимы:
+  python stub_server.py --latency lognormal:800:0.5 --error-rate 0.02
+  python stub_server.py --replay recordings.jsonl            # отвечаем записанными ответами
+  python stub_server.py --record recordings.jsonl \\
+        --upstream-openai https://api.openai.com              # прокси к реальному API + запись пар
+"""
+import os
+import io
+import json
+import time
+import math
+import random
+import base64
+import hashlib
+import logging
+import argparse
+import threading
+
+import requests
+from flask import Flask, request, jsonify, Response, stream_with_context
+
+logger = logging.getLogger(__name__)
+
+stub_app = Flask(__name__)
+
+# Настройки по умолчанию из ENV (перезаписываются аргументами командной строки)
+CONFIG = {
+    "latency": os.getenv("STUB_LATENCY", "fixed:0"),  # fixed:MS | uniform:MIN:MAX | normal:MEAN:STD | lognormal:MEDIAN:SIGMA
+    "error_rate": float(os.getenv("STUB_ERROR_RATE", 0)),
+    "telegram_429_rate": float(os.getenv("STUB_TELEGRAM_429_RATE", 0)),
+    "stream_chunk_ms": float(os.getenv("STUB_STREAM_CHUNK_MS", 15)),
+    "replay": os.getenv("STUB_REPLAY"),
+    "record": os.getenv("STUB_RECORD"),
+    "upstream": {
+        "openai": os.getenv("STUB_UPSTREAM_OPENAI"),
+        "telegram": os.getenv("STUB_UPSTREAM_TELEGRAM"),
+        "gemini": os.getenv("STUB_UPSTREAM_GEMINI"),
+    },
+    "seed": os.getenv("STUB_SEED"),
+}
+
+_rng = random.Random()
+_recordings = {}  # {ключ запроса: [ответы]} — при повторах ходим по кругу
+_replay_pos = {}
+_record_lock = threading.Lock()
+_stats = {"requests": 0, "errors": 0}
+
+
+# --- Задержки и ошибки ---
+
+def sample_latency_ms(spec=None):
+    kind, *params = (spec or CONFIG["latency"]).split(":")
+    p = [float(x) for x in params]
+    if kind == "fixed":
+        value = p[0] if p else 0
+    elif kind == "uniform":
+        value = _rng.uniform(p[0], p[1])
+    elif kind == "normal":
+        value = _rng.gauss(p[0], p[1])
+    elif kind == "lognormal":
+        value = _rng.lognormvariate(math.log(max(p[0], 1)), p[1])
+    else:
+        raise ValueError(f"Неизвестное распределение задержки: {kind}")
+    return max(value, 0)
+
+
+def _simulate_latency():
+    time.sleep(sample_latency_ms() / 1000)
+
+
+def _should_fail(rate=None):
+    return _rng.random() < (CONFIG["error_rate"] if rate is None else rate)
+
+
+# --- Запись / воспроизведение ---
+
+def request_key(service, path, payload):
+    """Ключ пары запрос-ответ. stream не влияет на ответ, поэтому в ключ не входит."""
+    body = {k: v for k, v in (payload or {}).items() if k != "stream"}
+    raw = json.dumps([service, path, body], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def load_recordings(path):
+    _recordings.clear()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip(): continue
+            rec = json.loads(line)
+            _recordings.setdefault(rec["key"], []).append(rec)
+    logger.info(f"Stub: загружено {sum(len(v) for v in _recordings.values())} записей из {path}")
+
+
+def _find_recording(key):
+    recs = _recordings.get(key)
+    if not recs: return None
+    pos = _replay_pos.get(key, 0)
+    _replay_pos[key] = pos + 1
+    return recs[pos % len(recs)]
+
+
+def _record(service, path, payload, status, response_body, latency_ms):
+    rec = {
+        "key": request_key(service, path, payload), "service": service, "path": path,
+        "request": payload, "status": status, "response": response_body,
+        "latency_ms": round(latency_ms, 1), "recorded_at": time.time(),
+    }
+    with _record_lock:
+        with open(CONFIG["record"], "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+
+def _proxy(service, key_path, key_payload, upstream_path, body):
+    """Проксируем в реальный API и записываем пару запрос-ответ (под тем же ключом, что ищет replay)."""
+    upstream = CONFIG["upstream"][service].rstrip("/")
+    fwd_headers = {k: v for k, v in request.headers.items()
+                   if k.lower() in ("authorization", "x-goog-api-key", "content-type")}
+    body = dict(body or {})
+    body.pop("stream", None)  # Записываем полный ответ; стрим при необходимости соберем сами
+    started = time.perf_counter()
+    res = requests.post(f"{upstream}{upstream_path}", json=body, headers=fwd_headers, params=request.args, timeout=120)
+    latency_ms = (time.perf_counter() - started) * 1000
+    try:
+        data = res.json()
+    except ValueError:
+        data = {"raw": res.text}
+    if CONFIG["record"]:
+        _record(service, key_path, key_payload, res.status_code, data, latency_ms)
+    return res.status_code, data
+
+
+def _resolve(service, path, payload, canned, upstream_path=None, upstream_body=None):
+    """Общий конвейер: прокси/запись -> воспроизведение -> заготовка, с задержкой и ошибками."""
+    _stats["requests"] += 1
+    if CONFIG["upstream"].get(service):
+        return _proxy(service, path, payload, upstream_path or path,
+                      payload if upstream_body is None else upstream_body)
+
+    _simulate_latency()
+    if _should_fail():
+        _stats["errors"] += 1
+        return 500, {"error": {"message": "Stub: simulated upstream error", "type": "server_error"}}
+
+    rec = _find_recording(request_key(service, path, payload)) if _recordings else None
+    if rec:
+        return rec["status"], rec["response"]
+    return 200, canned()
+
+
+# --- OpenAI ---
+
+def _canned_completion(payload):
+    messages = payload.get("messages") or []
+    user_text = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    if (payload.get("response_format") or {}).get("type") == "json_object":
+        content = json.dumps({
+            "response": f"Stub: приняла «{user_text[:60]}». Что-нибудь еще? 😎",
+            "actions": [], "recommendations": [],
+            "message": "", "products": [], "hints": [],
+        }, ensure_ascii=False)
+    else:
+        content = "Stub: эй, еда стынет! Оформляем? 👀"
+    return {
+        "id": f"chatcmpl-stub-{_rng.getrandbits(40):x}", "object": "chat.completion", "created": int(time.time()),
+        "model": payload.get("model", "stub"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _sse_from_completion(data, chunk_chars=4):
+    """Разбиваем готовый ответ на SSE-чанки формата chat.completion.chunk."""
+    content = data["choices"][0]["message"]["content"] or ""
+    base = {"id": data.get("id", "chatcmpl-stub"), "object": "chat.completion.chunk",
+            "created": data.get("created", int(time.time())), "model": data.get("model", "stub")}
+
+    def generate():
+        first = dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        yield f"data: {json.dumps(first, ensure_ascii=False)}\n\n"
+        for i in range(0, len(content), chunk_chars):
+            if CONFIG["stream_chunk_ms"]: time.sleep(CONFIG["stream_chunk_ms"] / 1000)
+            piece = dict(base, choices=[{"index": 0, "delta": {"content": content[i:i + chunk_chars]}, "finish_reason": None}])
+            yield f"data: {json.dumps(piece, ensure_ascii=False)}\n\n"
+        last = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        yield f"data: {json.dumps(last, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream")
+
+
+@stub_app.route("/v1/chat/completions", methods=["POST"])
+def openai_chat_completions():
+    payload = request.get_json(silent=True) or {}
+    status, data = _resolve("openai", "/v1/chat/completions", payload, lambda: _canned_completion(payload))
+    if status == 200 and payload.get("stream"):
+        return _sse_from_completion(data)
+    return jsonify(data), status
+
+
+# --- Telegram ---
+
+@stub_app.route("/bot<token>/sendMessage", methods=["POST"])
+def telegram_send_message(token):
+    payload = request.get_json(silent=True) or request.form.to_dict()
+
+    if not CONFIG["upstream"].get("telegram") and _should_fail(CONFIG["telegram_429_rate"]):
+        _stats["errors"] += 1
+        return jsonify({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                        "parameters": {"retry_after": 1}}), 429
+
+    def canned():
+        return {"ok": True, "result": {
+            "message_id": _rng.randint(1, 10 ** 9), "date": int(time.time()),
+            "chat": {"id": payload.get("chat_id"), "type": "private"}, "text": payload.get("text", ""),
+        }}
+
+    # Токен бота в ключ записи не попадает
+    status, data = _resolve("telegram", "/sendMessage", payload, canned, upstream_path=f"/bot{token}/sendMessage")
+    return jsonify(data), status
+
+
+# --- Gemini ---
+
+def _placeholder_png():
+    try:
+        from PIL import Image
+        buf = io.BytesIO()
+        Image.new("RGB", (64, 64), (200, 120, 60)).save(buf, format="PNG")
+        return buf.getvalue()
+    except ImportError:
+        # 1x1 PNG
+        return base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg==")
+
+
+@stub_app.route("/v1beta/models/<path:model_action>", methods=["POST"])
+def gemini_generate_content(model_action):
+    payload = request.get_json(silent=True) or {}
+    # Картинку из запроса в ключ не включаем: одинаковый промпт -> одинаковый ответ
+    key_payload = {"model": model_action, "prompt": [p.get("text") for c in payload.get("contents", [])
+                                                     for p in c.get("parts", []) if "text" in p]}
+
+    def canned():
+        return {"candidates": [{
+            "content": {"role": "model", "parts": [
+                {"inlineData": {"mimeType": "image/png", "data": base64.b64encode(_placeholder_png()).decode()}}
+            ]},
+            "finishReason": "STOP", "index": 0,
+        }]}
+
+    status, data = _resolve("gemini", "/generateContent", key_payload, canned,
+                            upstream_path=f"/v1beta/models/{model_action}", upstream_body=payload)
+    return jsonify(data), status
+
+
+@stub_app.route("/_stub/stats")
+def stub_stats():
+    return jsonify(_stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FoodStream: заглушка OpenAI/Telegram/Gemini")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", default=CONFIG["latency"],
+                        help="fixed:MS | uniform:MIN:MAX | normal:MEAN:STD | lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--error-rate", type=float, default=CONFIG["error_rate"])
+    parser.add_argument("--telegram-429-rate", type=float, default=CONFIG["telegram_429_rate"])
+    parser.add_argument("--stream-chunk-ms", type=float, default=CONFIG["stream_chunk_ms"])
+    parser.add_argument("--replay", default=CONFIG["replay"], help="JSONL с записанными парами")
+    parser.add_argument("--record", default=CONFIG["record"], help="Куда писать пары (режим прокси)")
+    parser.add_argument("--upstream-openai", default=CONFIG["upstream"]["openai"])
+    parser.add_argument("--upstream-telegram", default=CONFIG["upstream"]["telegram"])
+    parser.add_argument("--upstream-gemini", default=CONFIG["upstream"]["gemini"])
+    parser.add_argument("--seed", default=CONFIG["seed"], help="Фиксирует случайность для воспроизводимых прогонов")
+    args = parser.parse_args()
+
+    CONFIG.update(latency=args.latency, error_rate=args.error_rate, telegram_429_rate=args.telegram_429_rate,
+                  stream_chunk_ms=args.stream_chunk_ms, replay=args.replay, record=args.record, seed=args.seed)
+    CONFIG["upstream"].update(openai=args.upstream_openai, telegram=args.upstream_telegram, gemini=args.upstream_gemini)
+    sample_latency_ms()  # Проверяем формат --latency до старта
+
+    if args.seed is not None: _rng.seed(args.seed)
+    if args.replay: load_recordings(args.replay)
+
+    logging.basicConfig(level=logging.INFO)
+    stub_app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
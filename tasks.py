@@ -1,30 +1,28 @@
 import logging
 import datetime
 import json
-import requests # Используем requests для синхронной отправки
 from models import SessionLocal, Order, OrderStatus, ChatMessage, MenuItem, ServiceSignal
 import assistant
-import os
+import intent_parser
+import conversation
+import telegram_outbox
+from services import get_menu_snapshot
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-
 
 def send_telegram_sync(chat_id, text):
-    """Синхронная отправка сообщения в Telegram (через HTTP request)"""
-    if not chat_id or not TELEGRAM_TOKEN: return
-    try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-        requests.post(url, json={"chat_id": chat_id, "text": text, "parse_mode": "HTML"}, timeout=10)
-    except Exception as e:
-        logger.error(f"Telegram Send Error: {e}")
+    """Отправка сообщения в Telegram: ставим в очередь telegram_outbox (лимиты Bot API, повторы на 429/5xx)"""
+    if not chat_id: return
+    telegram_outbox.send_message(chat_id, text)
 
-def process_ai_message_task(chat_id, user_text, order_id, restaurant_id, is_telegram=False):
+def process_ai_message_task(chat_id, user_text, order_id, restaurant_id, is_telegram=False, notify=None):
     """
     Фоновая задача для обработки сообщения AI.
+    notify(event, payload) — отправка событий в комнату стола (Socket.IO). Если передан,
+    ответ стримится гостю по токенам ('chat_delta'), а не появляется целиком после генерации.
     """
     # flush=True заставляет текст появляться в консоли мгновенно
     print(f"--- [TASK] STARTING AI THREAD for Order {order_id} ---", flush=True)
@@ -33,36 +31,49 @@ def process_ai_message_task(chat_id, user_text, order_id, restaurant_id, is_tele
 
     try:
         with SessionLocal() as db:
-            order = db.query(Order).get(order_id)
-            if not order:
+            # Один запрос: заказ + состояние диалога + версия меню (корзина — из cart_digest)
+            context = conversation.load_turn_context(db, order_id, user_text)
+            if not context:
                 print("--- [TASK] ERROR: Order not found", flush=True)
                 return
+            order, state, cart_dict, history, menu_version = context
 
-            cart_dict = {str(i.menu_item_id): i.quantity for i in order.items}
-
-            history_objs = db.query(ChatMessage).filter(ChatMessage.order_id == order.id) \
-                .order_by(ChatMessage.timestamp.desc()).limit(6).all()
-            history = [{"role": "assistant" if m.sender == 'bot' else "user", "content": m.content}
-                       for m in reversed(history_objs)]
-
-            menu_items = [{"id": i.id, "name": i.name, "price": i.price} for i in
-                          db.query(MenuItem).filter(MenuItem.restaurant_id == restaurant_id).all()]
-
-            print(f"--- [TASK] Calling OpenAI... (User: {user_text})", flush=True)
+            menu_items = get_menu_snapshot(db, restaurant_id, menu_version)
 
             ai_response = {"response": "Извините, я задумалась...", "actions": []}
-            try:
-                # ВАЖНО: Тут может быть ошибка ключа API
-                # ВЫЗЫВАЕМ СИНХРОННО (без loop.run_until_complete)
-                ai_response = assistant.process_message(
-                    user_text=user_text,
-                    cart=cart_dict,
-                    menu_items=menu_items,
-                    chat_history=history
-                )
-            except Exception as e:
-                print(f"--- [TASK] AI ERROR (Check API Key!): {e}", flush=True)
-                ai_response = {"response": "Ошибка соединения с ИИ. Проверьте консоль сервера.", "actions": []}
+
+            # Быстрый путь: простые команды ("добавь 2 пепперони", "сколько с меня") разбираем без LLM
+            fast_response = intent_parser.parse_intent(user_text, menu_items, cart_dict)
+            if fast_response:
+                print(f"--- [TASK] Intent fast path (confidence {fast_response['confidence']:.2f})", flush=True)
+                ai_response = fast_response
+                if notify:
+                    notify('chat_delta', {"order_id": order_id, "delta": fast_response['response']})
+            else:
+                print(f"--- [TASK] Calling OpenAI... (User: {user_text})", flush=True)
+                try:
+                    # ВАЖНО: Тут может быть ошибка ключа API
+                    # ВЫЗЫВАЕМ СИНХРОННО (без loop.run_until_complete)
+                    if notify:
+                        ai_response = assistant.process_message_stream(
+                            user_text=user_text,
+                            cart=cart_dict,
+                            menu_items=menu_items,
+                            chat_history=history,
+                            summary=state.summary,
+                            on_delta=lambda delta: notify('chat_delta', {"order_id": order_id, "delta": delta})
+                        )
+                    else:
+                        ai_response = assistant.process_message(
+                            user_text=user_text,
+                            cart=cart_dict,
+                            menu_items=menu_items,
+                            chat_history=history,
+                            summary=state.summary
+                        )
+                except Exception as e:
+                    print(f"--- [TASK] AI ERROR (Check API Key!): {e}", flush=True)
+                    ai_response = {"response": "Ошибка соединения с ИИ. Проверьте консоль сервера.", "actions": []}
 
             bot_text = ai_response.get('response', '...')
             actions = ai_response.get('actions', [])
@@ -80,7 +91,10 @@ def process_ai_message_task(chat_id, user_text, order_id, restaurant_id, is_tele
                     db.rollback()
                     bot_text += "\n(Не удалось обновить корзину)"
 
+            overflow = []
             try:
+                overflow = conversation.record_turn(db, state, user_text, bot_text, menu_version)
+
                 if recommendations:
                     content_data = {"text": bot_text, "items": recommendations}
                     db.add(ChatMessage(order_id=order.id, sender='bot', content=json.dumps(content_data),
@@ -94,10 +108,25 @@ def process_ai_message_task(chat_id, user_text, order_id, restaurant_id, is_tele
                 print(f"--- [TASK] DB SAVE ERROR: {e}", flush=True)
                 db.rollback()
 
+            if notify:
+                # Финал стрима: клиент заменяет черновик сохраненным сообщением из истории
+                notify('chat_done', {"order_id": order_id})
+                if actions:
+                    notify('cart_updated', {"order_id": order_id, "total": order.total_price})
+
             if is_telegram and chat_id:
                 # ВЫЗЫВАЕМ СИНХРОННУЮ ОТПРАВКУ
                 send_telegram_sync(chat_id, bot_text)
 
+            # Гость уже получил ответ — теперь можно не спеша свернуть старые реплики в пересказ
+            if overflow:
+                try:
+                    conversation.fold_into_summary(state, overflow)
+                    db.commit()
+                except Exception as e:
+                    print(f"--- [TASK] SUMMARY ERROR: {e}", flush=True)
+                    db.rollback()
+
     except Exception as e:
         print(f"--- [TASK] CRITICAL THREAD FAILURE: {e}", flush=True)
     finally:
@@ -1,17 +1,29 @@
 import asyncio
 import logging
 import os
-import requests
+import aiohttp
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command, CommandObject
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 # --- Настройки ---
 load_dotenv()
 API_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:5000")  # Важно: порт 5000, как в app.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # Локальная заглушка Bot API (stub_server.py)
+
+# Пул соединений к бэкенду: общий на весь процесс бота
+BACKEND_MAX_CONNECTIONS = int(os.getenv("BACKEND_MAX_CONNECTIONS", 100))
+BACKEND_MAX_CONCURRENCY = int(os.getenv("BACKEND_MAX_CONCURRENCY", 200))  # Одновременных запросов в полете
+BACKEND_TIMEOUT = float(os.getenv("BACKEND_TIMEOUT", 5))
+
+# Webhook-режим: апдейты принимает сам Flask (telegram_webhook.py), этот скрипт только регистрирует URL
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")  # https://example.com/telegram/webhook
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
 
 if not API_TOKEN:
     raise ValueError("Не указан TELEGRAM_BOT_TOKEN")
@@ -21,10 +33,65 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 # Инициализация бота
-bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+bot_session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=API_TOKEN, session=bot_session, default=DefaultBotProperties(parse_mode="HTML"))
 dp = Dispatcher()
 
 
+# --- Неблокирующий клиент бэкенда ---
+
+class BackendError(Exception):
+    pass
+
+
+class BackendClient:
+    """
+    Общая aiohttp-сессия с пулом соединений, лимитом параллельных запросов и таймаутами.
+    Раньше хендлеры звали блокирующий requests.post и останавливали весь event loop бота.
+    """
+
+    def __init__(self, base_url, max_connections, max_concurrency, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        # Таймауты на сокет, а не total: ожидание свободного соединения в пуле не считается ошибкой
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.session = None
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+    async def post(self, path, payload):
+        """Возвращает (status, json|None). Сетевые ошибки и таймауты — BackendError."""
+        await self.start()
+        async with self.semaphore:
+            try:
+                async with self.session.post(f"{self.base_url}{path}", json=payload) as res:
+                    data = await res.json(content_type=None) if res.status == 200 else None
+                    return res.status, data
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise BackendError(str(e) or e.__class__.__name__) from e
+
+
+backend = BackendClient(BACKEND_URL, BACKEND_MAX_CONNECTIONS, BACKEND_MAX_CONCURRENCY, BACKEND_TIMEOUT)
+
+
+@dp.startup()
+async def on_startup():
+    await backend.start()
+
+
+@dp.shutdown()
+async def on_shutdown():
+    await backend.close()
+
+
 # --- Хендлеры (Обработчики) ---
 
 @dp.message(Command("start"))
@@ -38,13 +105,12 @@ async def send_welcome(message: types.Message, command: CommandObject = None):
     if token:
         # Попытка привязки
         try:
-            res = requests.post(f"{BACKEND_URL}/api/telegram/bind", json={
+            status, data = await backend.post("/api/telegram/bind", {
                 "chat_id": str(message.chat.id),
                 "token": token
-            }, timeout=5)
+            })
 
-            if res.status_code == 200:
-                data = res.json()
+            if status == 200:
                 await message.answer(f"✅ Вы подключены к: {data['restaurant_name']}, Стол {data['table']}")
                 # Сразу запускаем диалог
                 await forward_message_to_brain(message, override_text="Привет! Я за столом.")
@@ -77,28 +143,43 @@ async def forward_message_to_brain(message: types.Message, override_text=None):
 
     try:
         # Отправляем в очередь (через API)
-        response = requests.post(f"{BACKEND_URL}/api/chat", json=payload, timeout=5)
+        status, data = await backend.post("/api/chat", payload)
 
-        if response.status_code != 200:
+        if status != 200:
             await message.answer("⚠️ Ошибка сервера. Попробуйте позже.")
         else:
             # Опционально: проверить статус ответа
-            data = response.json()
-            if data.get("status") == "waiting_for_admin":
+            if data and data.get("status") == "waiting_for_admin":
                 await message.answer("👩‍💻 Зову оператора...")
 
         # Мы НЕ ждем генерации текста ответа AI здесь.
         # Ответ придет асинхронно через Celery Worker -> send_telegram_async
 
-    except requests.exceptions.RequestException as e:
+    except BackendError as e:
         logger.error(f"Connection Error: {e}")
         await message.answer("🔌 Не могу достучаться до кухни.")
 
 # --- Запуск ---
+async def setup_webhook():
+    """Регистрирует webhook в Telegram. Дальше апдейты идут прямо в бэкенд, процесс бота не нужен."""
+    if not TELEGRAM_WEBHOOK_SECRET:
+        raise ValueError("Для webhook-режима нужен TELEGRAM_WEBHOOK_SECRET")
+    await bot.set_webhook(TELEGRAM_WEBHOOK_URL, secret_token=TELEGRAM_WEBHOOK_SECRET,
+                          allowed_updates=["message"], max_connections=100)
+    logger.info(f"Webhook установлен: {TELEGRAM_WEBHOOK_URL}")
+    await bot.session.close()
+
+
 async def main():
+    if TELEGRAM_WEBHOOK_URL:
+        await setup_webhook()
+        return
+
     logger.info(f"Запускаем тонкого клиента Telegram... Backend: {BACKEND_URL}")
+    # Если раньше был включен webhook, Telegram не отдаст апдейты через getUpdates
+    await bot.delete_webhook()
     await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
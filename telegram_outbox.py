@@ -0,0 +1,275 @@
+"""
+Очередь исходящих сообщений в Telegram.
+
+Раньше каждый ответ бота уходил отдельным requests.post (новое соединение), а 429 от Bot API
+просто терялись. Теперь ответы ставятся в очередь, а несколько воркеров отправляют их через
+общий пул соединений с учетом лимитов Telegram:
+- глобально ~30 сообщений/сек на бота,
+- ~1 сообщение/сек в один чат (небольшой burst допускается),
+- 429 -> ждем retry_after для этого чата, 5xx/сеть -> повтор с экспоненциальной задержкой,
+- несколько ответов подряд в один чат склеиваются в одно сообщение (до 4096 символов).
+Метрики (глубина очереди, задержка доставки) — get_stats().
+"""
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Можно направить на локальную заглушку (stub_server.py) для нагрузочных тестов
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))  # сообщений/сек на бота
+CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))  # сообщений/сек в один чат
+CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", 3))
+WORKERS = int(os.getenv("TELEGRAM_OUTBOX_WORKERS", 4))
+MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", 5))
+BACKOFF_BASE = float(os.getenv("TELEGRAM_BACKOFF_BASE", 0.5))
+BACKOFF_MAX = float(os.getenv("TELEGRAM_BACKOFF_MAX", 30))
+MERGE_MESSAGES = os.getenv("TELEGRAM_MERGE_MESSAGES", "1") == "1"
+MAX_MESSAGE_LEN = 4096
+REQUEST_TIMEOUT = 10
+LATENCY_WINDOW = 1000  # Сколько последних доставок держим для перцентилей
+
+
+class TokenBucket:
+    """Классический token bucket. Не потокобезопасен — вызывается под замком очереди."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # retry_after от Telegram
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Через сколько секунд можно будет взять токен (0 — можно сейчас)."""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Message:
+    __slots__ = ("chat_id", "text", "parse_mode", "enqueued_at", "attempts", "parts")
+
+    def __init__(self, chat_id, text, parse_mode):
+        self.chat_id = chat_id
+        self.text = text
+        self.parse_mode = parse_mode
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        self.parts = 1  # Сколько исходных сообщений склеено в это
+
+
+class TelegramOutbox:
+    def __init__(self, token=TELEGRAM_TOKEN, api_url=TELEGRAM_API_URL, workers=WORKERS):
+        self.token = token
+        self.api_url = api_url
+        self.workers = workers
+
+        self._cond = threading.Condition()
+        self._pending = {}  # chat_id -> deque[_Message]
+        self._ready = deque()  # Чаты с сообщениями, в порядке постановки (FIFO между чатами)
+        self._in_flight = set()  # Чаты, в которые сейчас идет отправка (порядок внутри чата сохраняется)
+        self._chat_buckets = {}
+        self._global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._threads = []
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._counters = {"enqueued": 0, "sent": 0, "merged": 0, "retried": 0, "rate_limited": 0, "dropped": 0}
+
+    # --- Публичный API ---
+
+    def enqueue(self, chat_id, text, parse_mode="HTML"):
+        if not chat_id or not text or not self.token: return
+        chat_id = str(chat_id)
+        self._ensure_started()
+        with self._cond:
+            queue = self._pending.get(chat_id)
+            if queue is None:
+                queue = self._pending[chat_id] = deque()
+            if not queue and chat_id not in self._in_flight:
+                self._ready.append(chat_id)
+            queue.append(_Message(chat_id, text, parse_mode))
+            self._counters["enqueued"] += 1
+            self._cond.notify()
+
+    def get_stats(self):
+        with self._cond:
+            depth = sum(len(q) for q in self._pending.values())
+            stats = dict(self._counters, queue_depth=depth, chats_waiting=len(self._pending),
+                         in_flight=len(self._in_flight), workers=len(self._threads))
+            latencies = sorted(self._latencies)
+        for p in (50, 95, 99):
+            stats[f"latency_p{p}_ms"] = round(latencies[int(p / 100 * (len(latencies) - 1))] * 1000, 1) \
+                if latencies else None
+        return stats
+
+    def flush(self, timeout=10):
+        """Ждет, пока очередь опустеет (для тестов и остановки процесса)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._pending or self._in_flight) and time.monotonic() < deadline:
+                self._cond.wait(0.05)
+            return not self._pending and not self._in_flight
+
+    # --- Воркеры ---
+
+    def _ensure_started(self):
+        if self._threads: return
+        with self._cond:
+            if self._threads: return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"tg-outbox-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(CHAT_RATE, CHAT_BURST)
+        return bucket
+
+    def _take_next(self):
+        """Под замком: выбирает чат, которому можно отправить. Возвращает (_Message, 0) или (None, wait)."""
+        now = time.monotonic()
+        global_wait = self._global_bucket.wait_time(now)
+        if global_wait > 0: return None, global_wait
+
+        min_wait = None
+        for _ in range(len(self._ready)):
+            chat_id = self._ready.popleft()
+            wait = self._chat_bucket(chat_id).wait_time(now)
+            if wait > 0:
+                self._ready.append(chat_id)
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+                continue
+
+            queue = self._pending[chat_id]
+            msg = queue.popleft()
+            if MERGE_MESSAGES:
+                # Склеиваем следующие ответы в тот же чат, пока влезаем в лимит Telegram
+                while queue and queue[0].parse_mode == msg.parse_mode and queue[0].attempts == 0 \
+                        and len(msg.text) + 2 + len(queue[0].text) <= MAX_MESSAGE_LEN:
+                    nxt = queue.popleft()
+                    msg.text = f"{msg.text}\n\n{nxt.text}"
+                    msg.parts += nxt.parts
+                    self._counters["merged"] += nxt.parts
+            if not queue:
+                del self._pending[chat_id]
+
+            self._global_bucket.take(now)
+            self._chat_bucket(chat_id).take(now)
+            self._in_flight.add(chat_id)
+            return msg, 0
+        return None, min_wait
+
+    def _finish(self, msg, requeue=False):
+        with self._cond:
+            self._in_flight.discard(msg.chat_id)
+            queue = self._pending.get(msg.chat_id)
+            if requeue:
+                if queue is None:
+                    queue = self._pending[msg.chat_id] = deque()
+                queue.appendleft(msg)
+            if queue:
+                self._ready.append(msg.chat_id)
+            else:
+                self._pending.pop(msg.chat_id, None)
+                # Ведро простаивающего чата держим, пока действует пауза от Telegram, потом забываем
+                bucket = self._chat_buckets.get(msg.chat_id)
+                if bucket and bucket.blocked_until <= time.monotonic() and bucket.tokens >= 1:
+                    del self._chat_buckets[msg.chat_id]
+            self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                msg, wait = self._take_next()
+                while msg is None:
+                    self._cond.wait(wait)
+                    msg, wait = self._take_next()
+            self._deliver(msg)
+
+    def _deliver(self, msg):
+        msg.attempts += 1
+        retry_after = None
+        try:
+            res = self.session.post(
+                f"{self.api_url}/bot{self.token}/sendMessage",
+                json={"chat_id": msg.chat_id, "text": msg.text, "parse_mode": msg.parse_mode},
+                timeout=REQUEST_TIMEOUT)
+            if res.status_code == 200:
+                with self._cond:
+                    self._counters["sent"] += 1
+                    self._latencies.append(time.monotonic() - msg.enqueued_at)
+                self._finish(msg)
+                return
+            if res.status_code == 429:
+                try:
+                    retry_after = float(res.json().get("parameters", {}).get("retry_after", 1))
+                except ValueError:
+                    retry_after = 1.0
+            elif res.status_code < 500:
+                # 400/403 (бот заблокирован, битая разметка) — повтор не поможет
+                logger.error(f"Telegram Send Error {res.status_code}: {res.text[:200]}")
+                self._drop(msg)
+                return
+            error = f"HTTP {res.status_code}"
+        except requests.RequestException as e:
+            error = str(e)
+
+        if msg.attempts > MAX_RETRIES:
+            logger.error(f"Telegram Send Error (giving up after {msg.attempts} attempts): {error}")
+            self._drop(msg)
+            return
+
+        with self._cond:
+            bucket = self._chat_bucket(msg.chat_id)
+            if retry_after is not None:
+                self._counters["rate_limited"] += 1
+                delay = retry_after
+            else:
+                self._counters["retried"] += 1
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (msg.attempts - 1)) * (0.5 + random.random() / 2)
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + delay)
+        self._finish(msg, requeue=True)
+
+    def _drop(self, msg):
+        with self._cond:
+            self._counters["dropped"] += msg.parts
+        self._finish(msg)
+
+
+outbox = TelegramOutbox()
+
+
+def send_message(chat_id, text, parse_mode="HTML"):
+    """Ставит сообщение в очередь отправки. Не блокирует вызывающий поток."""
+    outbox.enqueue(chat_id, text, parse_mode)
+
+
+def get_stats():
+    return outbox.get_stats()
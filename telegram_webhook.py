@@ -0,0 +1,122 @@
+"""
+Webhook-режим Telegram-бота: апдейты приходят прямо в Flask.
+
+Вместо отдельного процесса с polling, который пересылает каждое сообщение в /api/chat по HTTP,
+Telegram шлет апдейты на /telegram/webhook, а мы сразу вызываем те же сервисы, что и
+/api/telegram/bind и /api/chat. Ответы уходят через очередь telegram_outbox.
+Своего состояния между запросами нет: повторы апдейтов (Telegram шлет апдейт снова, если не
+получил 200 вовремя) отсекаются по update_id в хранилище idempotency. С IDEMPOTENCY_BACKEND=sqlite
+оно общее для всех воркеров машины; с memory (по умолчанию) дедупликация — в пределах процесса,
+и повтор, попавший на другой инстанс, будет обработан второй раз.
+
+Включение: TELEGRAM_WEBHOOK_SECRET (тот же secret_token, что передан в setWebhook —
+см. telegram.py с TELEGRAM_WEBHOOK_URL).
+"""
+import os
+import hmac
+import logging
+import threading
+
+from flask import Blueprint, request, jsonify
+
+from models import SessionLocal
+from services import bind_telegram_chat, accept_chat_message
+from tasks import process_ai_message_task
+import telegram_outbox
+import idempotency
+
+logger = logging.getLogger(__name__)
+
+telegram_bp = Blueprint('telegram_webhook', __name__)
+
+WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+DEDUP_FINGERPRINT = "telegram-update"
+
+
+def _already_seen(update_id):
+    """Апдейт уже принят (этим или, при общем хранилище, другим воркером). Помним IDEMPOTENCY_TTL."""
+    if update_id is None: return False
+    key = f"telegram:update:{update_id}"
+    store = idempotency.get_store()
+    try:
+        state, _ = store.begin(key, DEDUP_FINGERPRINT)
+        if state != idempotency.NEW: return True
+        # Ответ на апдейт всегда 200 (и при ошибке обработки) — сразу помечаем принятым
+        store.complete(key, DEDUP_FINGERPRINT, (200, "application/json", b""))
+    except Exception as e:
+        # Хранилище недоступно — обрабатываем, как без дедупликации
+        logger.error(f"Telegram dedup store error: {e}")
+    return False
+
+
+def _handle_start(chat_id, token):
+    if not token:
+        telegram_outbox.send_message(chat_id, "👋 Чтобы сделать заказ, отсканируйте QR-код на столе.")
+        return
+
+    with SessionLocal() as db:
+        table = bind_telegram_chat(db, token, chat_id)
+        if not table:
+            telegram_outbox.send_message(chat_id, "❌ Неверный QR код или стол не активен.")
+            return
+        telegram_outbox.send_message(chat_id, f"✅ Вы подключены к: {table.restaurant.name}, Стол {table.number}")
+
+    # Сразу запускаем диалог
+    _handle_text(chat_id, "Привет! Я за столом.")
+
+
+def _handle_text(chat_id, text):
+    with SessionLocal() as db:
+        order, status = accept_chat_message(db, text, telegram_chat_id=chat_id)
+
+        if status == 'no_order':
+            telegram_outbox.send_message(chat_id, "Сначала отсканируйте QR код (для Telegram нажмите /start).")
+            return
+        if status == 'waiting_for_admin':
+            telegram_outbox.send_message(chat_id, "👩‍💻 Зову оператора...")
+            return
+
+        thread = threading.Thread(
+            target=process_ai_message_task,
+            kwargs={
+                "chat_id": order.telegram_chat_id,
+                "user_text": text,
+                "order_id": order.id,
+                "restaurant_id": order.restaurant_id,
+                "is_telegram": True,
+            }
+        )
+        thread.start()
+
+
+@telegram_bp.route("/telegram/webhook", methods=["POST"])
+def telegram_webhook():
+    if not WEBHOOK_SECRET:
+        return jsonify({"error": "Webhook disabled"}), 404
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(secret, WEBHOOK_SECRET):
+        return jsonify({"error": "Forbidden"}), 403
+
+    update = request.get_json(silent=True) or {}
+    if _already_seen(update.get("update_id")):
+        return jsonify({"ok": True})
+
+    message = update.get("message") or {}
+    text = message.get("text")
+    chat_id = (message.get("chat") or {}).get("id")
+    if not text or chat_id is None:
+        return jsonify({"ok": True})  # Остальные типы апдейтов бот не обрабатывает
+    chat_id = str(chat_id)
+
+    try:
+        args = text.split()
+        if args and args[0].split("@")[0] == "/start":  # "/start@bot_name" в группах
+            _handle_start(chat_id, args[1] if len(args) > 1 else None)
+        else:
+            _handle_text(chat_id, text)
+    except Exception as e:
+        # 200 все равно отдаем: иначе Telegram будет повторять апдейт
+        logger.error(f"Webhook Error: {e}")
+        telegram_outbox.send_message(chat_id, "⚠️ Ошибка сервера. Попробуйте позже.")
+
+    return jsonify({"ok": True})
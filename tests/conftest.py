@@ -0,0 +1,28 @@
+"""
+Общая настройка тестов: временная SQLite-база (до импорта models) и корень репозитория в sys.path.
+
+    python -m pytest tests/
+"""
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp.name}/test.db"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+
+import models
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    models.Base.metadata.create_all(models.engine)
+
+
+@pytest.fixture(scope="session")
+def app():
+    import app as app_module
+    app_module.app.config["TESTING"] = True
+    return app_module.app
@@ -0,0 +1,54 @@
+"""
+План зала админки (/api/admin/tables/status) собирается фиксированным числом запросов,
+сколько бы столов и заказов ни было в зале.
+"""
+import pytest
+
+from models import SessionLocal, Restaurant, Table, MenuItem, Order, OrderItem, OrderStatus, User
+from db_instrumentation import assert_max_queries, collect
+
+# Загрузка снимка: столы, последние заказы, заказы с позициями и блюдами (+ категории), вызовы
+FLOOR_PLAN_QUERIES = 5
+
+
+def _seed(tables):
+    """Ресторан с админом, где за каждым столом открыт заказ из двух позиций."""
+    with SessionLocal() as db:
+        r = Restaurant(name=f"R{tables}", slug=f"r{tables}", table_count=tables, admin_secret_link=f"sec{tables}")
+        db.add(r)
+        db.flush()
+        menu = [MenuItem(name=n, price=p, restaurant_id=r.id) for n, p in (("Пепперони", 2500), ("Кола", 500))]
+        db.add_all(menu)
+        admin = User(username=f"admin{tables}", role="admin", restaurant_id=r.id)
+        admin.set_password("x")
+        db.add(admin)
+        for n in range(1, tables + 1):
+            t = Table(restaurant_id=r.id, number=n, public_token=f"t{tables}-{n}")
+            db.add(t)
+            db.flush()
+            o = Order(restaurant_id=r.id, table_id=t.id, table_number=n, status=OrderStatus.IN_PROGRESS)
+            o.items = [OrderItem(menu_item=m, quantity=1) for m in menu]
+            db.add(o)
+        db.commit()
+        return r.id, admin.username
+
+
+@pytest.mark.parametrize("tables", [5, 60])
+def test_floor_plan_query_count(app, tables):
+    import floor_view
+    rid, username = _seed(tables)
+    client = app.test_client()
+    client.post("/login", data={"username": username, "password": "x"})
+    client.get("/api/admin/tables/status")  # Пользователь попадает в кэш авторизации
+    floor_view.invalidate(rid)  # Следующее чтение собирает снимок заново из БД
+
+    with assert_max_queries(FLOOR_PLAN_QUERIES):
+        response = client.get("/api/admin/tables/status")
+    plan = response.get_json()
+    assert response.status_code == 200
+    assert len(plan) == tables
+    assert all(t["active"] and len(t["items"]) == 2 for t in plan)
+
+    with collect() as warm:
+        client.get("/api/admin/tables/status")
+    assert warm.count == 0  # Без изменений снимок не перечитывается
@@ -0,0 +1,48 @@
+"""
+Быстрый путь без LLM: действия intent_parser.parse_intent выполняются services.execute_actions
+так же, как действия от модели.
+"""
+import pytest
+
+import intent_parser
+from models import SessionLocal, Restaurant, MenuItem, Order, OrderItem, OrderStatus
+from services import execute_actions, get_menu_snapshot
+
+
+@pytest.fixture
+def cart():
+    """Корзина гостя: Кола x3 и Пепперони x1. -> (restaurant_id, order_id)"""
+    with SessionLocal() as db:
+        r = Restaurant(name="Fast", slug="fast", table_count=1, admin_secret_link="fast")
+        db.add(r)
+        db.flush()
+        cola = MenuItem(name="Кола", price=500, restaurant_id=r.id)
+        pizza = MenuItem(name="Пепперони", price=2500, restaurant_id=r.id)
+        o = Order(restaurant_id=r.id, table_number=1, status=OrderStatus.BASKET_ASSEMBLY)
+        o.items = [OrderItem(menu_item=cola, quantity=3), OrderItem(menu_item=pizza, quantity=1)]
+        db.add(o)
+        db.commit()
+        yield r.id, o.id
+        db.query(OrderItem).filter(OrderItem.order_id == o.id).delete()
+        db.delete(db.get(Order, o.id))
+        db.query(MenuItem).filter(MenuItem.restaurant_id == r.id).delete()
+        db.delete(db.get(Restaurant, r.id))
+        db.commit()
+
+
+def _run(text, restaurant_id, order_id):
+    with SessionLocal() as db:
+        order = db.get(Order, order_id)
+        cart_dict = {str(i.menu_item_id): i.quantity for i in order.items}
+        result = intent_parser.parse_intent(text, get_menu_snapshot(db, restaurant_id), cart_dict)
+        assert result is not None, f"{text!r} ушло бы в LLM"
+        execute_actions(db, order, result["actions"], restaurant_id)
+        return {i.menu_item.name: i.quantity for i in db.query(OrderItem).filter(OrderItem.order_id == order_id)}
+
+
+def test_clear_cart_deletes_items(cart):
+    assert _run("очисти корзину", *cart) == {}
+
+
+def test_remove_with_quantity_decrements(cart):
+    assert _run("убери одну колу", *cart) == {"Кола": 2, "Пепперони": 1}
@@ -0,0 +1,45 @@
+"""
+Предагрегаты продаж: возврат доставленного заказа в другой статус вычитает ровно то,
+что было учтено при доставке.
+"""
+from sqlalchemy import func
+
+import analytics  # noqa: F401 — регистрирует before_flush
+from models import SessionLocal, Restaurant, MenuItem, Order, OrderItem, OrderStatus, SalesRollup, SalesItemRollup
+
+
+def _totals(restaurant_id):
+    with SessionLocal() as db:
+        orders, revenue = db.query(func.coalesce(func.sum(SalesRollup.order_count), 0),
+                                   func.coalesce(func.sum(SalesRollup.revenue), 0.0)) \
+            .filter(SalesRollup.restaurant_id == restaurant_id).one()
+        quantity = db.query(func.coalesce(func.sum(SalesItemRollup.quantity), 0)) \
+            .filter(SalesItemRollup.restaurant_id == restaurant_id).scalar()
+        return orders, revenue, quantity
+
+
+def test_revert_subtracts_what_was_rolled_up():
+    with SessionLocal() as db:
+        r = Restaurant(name="Rollup", slug="rollup", table_count=1, admin_secret_link="rollup")
+        db.add(r)
+        db.flush()
+        cola = MenuItem(name="Кола", price=500, restaurant_id=r.id)
+        o = Order(restaurant_id=r.id, table_number=1, status=OrderStatus.IN_PROGRESS)
+        o.items = [OrderItem(menu_item=cola, quantity=2)]
+        db.add(o)
+        db.commit()
+        rid = r.id
+
+        o.status = OrderStatus.SUCCESSFULLY_DELIVERED
+        db.commit()
+        assert _totals(rid) == (1, 1000.0, 2)
+
+        # Между доставкой и возвратом поменялись цена и состав заказа
+        cola.price = 700
+        o.items[0].quantity = 5
+        db.commit()
+
+        o.status = OrderStatus.IN_PROGRESS
+        db.commit()
+        assert _totals(rid) == (0, 0.0, 0)
+        assert o.rollup_lines is None and not o.rolled_up
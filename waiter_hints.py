@@ -0,0 +1,135 @@
+"""
+Подсказки для официантов.
+
+Раньше /api/waiter/tables дергал LLM на каждый опрос (каждые 5 сек от каждого официанта).
+Теперь подсказки считает фоновый планировщик: раз в HINTS_INTERVAL секунд или сразу после
+изменения зала (mark_dirty). Результат лежит в общем кэше ресторана, эндпоинт его только читает.
+"""
+import os
+import time
+import logging
+import threading
+
+from models import OrderStatus
+import assistant
+
+logger = logging.getLogger(__name__)
+
+HINTS_INTERVAL = int(os.getenv("WAITER_HINTS_INTERVAL", 30))  # Плановый пересчет, сек
+HINTS_AI_INTERVAL = int(os.getenv("WAITER_HINTS_AI_INTERVAL", 120))  # LLM не чаще, чем раз в N сек
+HINTS_AI_ENABLED = os.getenv("WAITER_HINTS_AI", "1") == "1"
+IDLE_MINUTES = int(os.getenv("WAITER_IDLE_MINUTES", 15))  # Стол "забыт", если нет активности N минут
+SIGNAL_MINUTES = int(os.getenv("WAITER_SIGNAL_MINUTES", 2))  # Вызов висит дольше N минут -> срочно
+WATCH_TTL = 300  # Считаем только рестораны, которые официанты открывали за последние 5 минут
+
+# {restaurant_id: {"hints": [...], "ai_hints": [...], "computed_at": float, "ai_at": float}}
+_cache = {}
+_dirty = set()
+_watched = {}  # {restaurant_id: время последнего чтения}
+_lock = threading.Lock()
+
+
+def mark_dirty(restaurant_id):
+    """Зал изменился (заказ, статус, вызов) — пересчитать подсказки на ближайшем тике."""
+    if restaurant_id is None: return
+    with _lock:
+        _dirty.add(int(restaurant_id))
+
+
+def get_hints(restaurant_id):
+    """Чтение из кэша. Никаких запросов к БД/LLM."""
+    restaurant_id = int(restaurant_id)
+    with _lock:
+        _watched[restaurant_id] = time.time()
+        entry = _cache.get(restaurant_id)
+        if entry is None:
+            # Первый запрос — посчитаем на ближайшем тике планировщика
+            _dirty.add(restaurant_id)
+            return []
+        return entry["hints"] + entry["ai_hints"]
+
+
+# --- Правила ---
+
+PAYMENT_STATUSES = (OrderStatus.REQUIRES_PAYMENT.value, OrderStatus.VERIFICATION.value, OrderStatus.PAYMENT_ERROR.value)
+# Черновики корзин создаются простым открытием меню — "простой" для них не считаем
+IDLE_IGNORED_STATUSES = (OrderStatus.BASKET_ASSEMBLY.value,)
+
+
+def build_rule_hints(orders_info, signals_info):
+    """
+    Быстрые правила для типовых ситуаций.
+    orders_info: [{'id', 'table', 'status', 'minutes', ...}], signals_info: [{'table', 'minutes'}]
+    """
+    hints = []
+
+    for s in signals_info:
+        urgent = s['minutes'] >= SIGNAL_MINUTES
+        hints.append({
+            "table": s['table'], "type": "signal", "priority": "high" if urgent else "normal",
+            "text": f"Стол {s['table']} зовет официанта" + (f" уже {s['minutes']} мин!" if urgent else "")
+        })
+
+    for o in orders_info:
+        if o['status'] in PAYMENT_STATUSES:
+            hints.append({
+                "table": o['table'], "type": "payment", "priority": "high",
+                "text": f"Стол {o['table']}: {o['status'].lower()} ({o['total']}тг)"
+            })
+        elif o['minutes'] >= IDLE_MINUTES and o['status'] not in IDLE_IGNORED_STATUSES:
+            hints.append({
+                "table": o['table'], "type": "idle", "priority": "normal",
+                "text": f"Стол {o['table']} без внимания {o['minutes']} мин. Подойдите проверить."
+            })
+
+    order_rank = {"high": 0, "normal": 1}
+    hints.sort(key=lambda h: order_rank.get(h['priority'], 2))
+    return hints
+
+
+# --- Фоновый пересчет ---
+
+def refresh_restaurant(restaurant_id, with_ai=False):
+    import floor_view  # Локальный импорт, чтобы избежать цикла
+
+    orders_info, signals_info = floor_view.waiter_floor_info(restaurant_id)
+
+    hints = build_rule_hints(orders_info, signals_info)
+    now = time.time()
+
+    with _lock:
+        entry = _cache.get(restaurant_id) or {"ai_hints": [], "ai_at": 0.0}
+
+    ai_hints, ai_at = entry["ai_hints"], entry["ai_at"]
+    if with_ai:
+        try:
+            ai_hints = [h if isinstance(h, dict) else {"type": "ai", "priority": "normal", "text": str(h)}
+                        for h in assistant.analyze_tables_for_waiter(orders_info)]
+        except Exception as e:
+            logger.error(f"Waiter AI hints error: {e}")
+        ai_at = now
+
+    with _lock:
+        _cache[restaurant_id] = {"hints": hints, "ai_hints": ai_hints, "computed_at": now, "ai_at": ai_at}
+
+
+def refresh_due_hints():
+    """Один тик планировщика: пересчитываем измененные и просроченные рестораны."""
+    now = time.time()
+    with _lock:
+        for rid in [r for r, t in _watched.items() if now - t > WATCH_TTL]:
+            _watched.pop(rid, None)
+            _cache.pop(rid, None)
+        due = []
+        for rid in _watched:
+            entry = _cache.get(rid)
+            if rid in _dirty or not entry or now - entry["computed_at"] >= HINTS_INTERVAL:
+                with_ai = HINTS_AI_ENABLED and (not entry or now - entry["ai_at"] >= HINTS_AI_INTERVAL)
+                due.append((rid, with_ai))
+        _dirty.clear()
+
+    for rid, with_ai in due:
+        try:
+            refresh_restaurant(rid, with_ai=with_ai)
+        except Exception as e:
+            logger.error(f"Waiter hints refresh error (restaurant {rid}): {e}")